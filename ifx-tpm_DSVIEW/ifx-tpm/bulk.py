@@ -0,0 +1,113 @@
+##
+## This file is part of the libsigrokdecode project.
+##
+## This program is free software; you can redistribute it and/or modify
+## it under the terms of the GNU General Public License as published by
+## the Free Software Foundation; either version 2 of the License, or
+## (at your option) any later version.
+##
+## This program is distributed in the hope that it will be useful,
+## but WITHOUT ANY WARRANTY; without even the implied warranty of
+## MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+## GNU General Public License for more details.
+##
+## You should have received a copy of the GNU General Public License
+## along with this program; if not, see <http://www.gnu.org/licenses/>.
+##
+
+'''
+Bulk SPI deserializer.
+
+Instead of waking up on every CLK edge, the deserializer takes chunks of
+CLK/MISO/MOSI/CS# samples, finds the CS# edges and the CLK rising edges
+while CS# is asserted with array operations, and packs the MISO/MOSI
+samples at those edges into whole bytes. The caller is only called back
+once per CS# change and once per byte.
+
+Chunks must be fed in order; CLK/CS# levels and incomplete bytes are
+carried over from one chunk to the next.
+'''
+
+import numpy as np
+
+class SpiDeserializer:
+    def __init__(self, cs_active, on_cs, on_byte):
+        # cs_active: CS# level which selects the device, None without CS#.
+        # on_cs(samplenum, cs, first): CS# pin change (first: sample 0).
+        # on_byte(miso, mosi, samples): byte values and the sample numbers
+        #                               of their eight CLK edges, MSB first.
+        self.cs_active = cs_active
+        self.on_cs = on_cs
+        self.on_byte = on_byte
+        self.offset = 0
+        # CLK rising edges dropped because CS# was deasserted.
+        self.skipped = 0
+        self.last_clk = self.last_cs = None
+        self.clear_bits()
+
+    def clear_bits(self):
+        self.pend_ss = np.empty(0, dtype=np.int64)
+        self.pend_miso = np.empty(0, dtype=bool)
+        self.pend_mosi = np.empty(0, dtype=bool)
+
+    def feed(self, clk, miso, mosi, cs=None):
+        clk = np.asarray(clk) != 0
+        miso = np.asarray(miso) != 0
+        mosi = np.asarray(mosi) != 0
+        have_cs = self.cs_active is not None
+        if have_cs:
+            cs = np.asarray(cs) != 0
+        if not len(clk):
+            return
+
+        if self.last_clk is None:
+            # The very first sample has no edges, it only reports the
+            # initial CS# state.
+            self.last_clk = clk[0]
+            if have_cs:
+                self.last_cs = cs[0]
+                self.on_cs(self.offset, int(cs[0]), True)
+
+        rise = np.flatnonzero(clk & ~np.concatenate(([self.last_clk], clk[:-1])))
+        if have_cs:
+            # Only CLK edges while CS# is asserted carry bits. A CLK edge
+            # at the same sample as a CS# edge is seen after the CS# edge.
+            selected = cs[rise] == self.cs_active
+            self.skipped += len(rise) - int(np.count_nonzero(selected))
+            rise = rise[selected]
+            edges = np.flatnonzero(cs != np.concatenate(([self.last_cs], cs[:-1])))
+            cuts = np.searchsorted(rise, edges)
+            start = 0
+            for edge, cut in zip(edges.tolist(), cuts.tolist()):
+                self.put_bits(rise[start:cut], miso, mosi)
+                # CS# changes drop any incomplete byte.
+                self.clear_bits()
+                self.on_cs(self.offset + edge, int(cs[edge]), False)
+                start = cut
+            rise = rise[start:]
+            self.last_cs = cs[-1]
+        self.put_bits(rise, miso, mosi)
+
+        self.last_clk = clk[-1]
+        self.offset += len(clk)
+
+    def put_bits(self, idx, miso, mosi):
+        if not len(idx):
+            return
+        ss = np.concatenate((self.pend_ss, idx + self.offset))
+        so = np.concatenate((self.pend_miso, miso[idx]))
+        si = np.concatenate((self.pend_mosi, mosi[idx]))
+
+        # SPI is MSB-first, which is also packbits' default bit order.
+        nbits = len(ss) & ~7
+        if nbits:
+            samples = ss[:nbits].tolist()
+            so_bytes = np.packbits(so[:nbits]).tolist()
+            si_bytes = np.packbits(si[:nbits]).tolist()
+            on_byte = self.on_byte
+            for i, (so_byte, si_byte) in enumerate(zip(so_bytes, si_bytes)):
+                on_byte(so_byte, si_byte, samples[i * 8:i * 8 + 8])
+
+        self.pend_ss = ss[nbits:]
+        self.pend_miso = so[nbits:]
+        self.pend_mosi = si[nbits:]
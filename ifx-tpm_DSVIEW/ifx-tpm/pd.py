@@ -20,7 +20,12 @@
 ##
 
 import sigrokdecode as srd
+from array import array
 from collections import namedtuple
+from collections.abc import Sequence
+import struct
+from .tpm2 import Message as Tpm2Message, decode_rc
+from . import registry
 
 Data = namedtuple('Data', ['ss', 'es', 'val'])
 
@@ -41,9 +46,19 @@ Packet:
    Both data items are Python numbers (0/1), not strings. At the beginning of
    the decoding a packet is generated with <data1> = None and <data2> being the
    initial state of the CS# pin or None if the chip select pin is not supplied.
- - 'TRANSFER': <data1>/<data2> contain a list of Data() namedtuples for each
-   byte transferred during this block of CS# asserted time. Each Data() has
-   fields ss, es, and val.
+ - 'TRANSFER': <data1>/<data2> contain a sequence of Data() namedtuples for
+   each byte transferred during this block of CS# asserted time. Each Data()
+   has fields ss, es, and val. The sequence is a view of the transfer's byte
+   and sample number arrays, its Data() items are made as they are accessed.
+ - 'TPM-COMMAND'/'TPM-RESPONSE': <data1> (command, MOSI) or <data2>
+   (response, MISO) is a dict with the header fields 'tag', 'size' and
+   'code' (command code or response code), the 'payload' following the
+   header as a memoryview of the reassembled message, the 'parsed' message
+   (a tpm2.Message, whose 'fields' are parsed when first accessed) and the
+   'ss'/'es' of the FIFO transfers carrying it. A response also has the
+   classified response code as 'rc' (a tpm2.RcInfo namedtuple). The other
+   data item is None. One packet per command/response, once its last byte
+   is in (only if 'layer_max' is 'frame' or 'parameter').
 
 Examples:
  ['CS-CHANGE', None, 1]
@@ -59,211 +74,168 @@ Examples:
  ['CS-CHANGE', 0, 1]
  ['TRANSFER', [Data(ss=80, es=96, val=0xff), ...],
               [Data(ss=80, es=96, val=0x3a), ...]]
+ ['TPM-COMMAND', {'tag': 0x8001, 'size': 12, 'code': 0x144,
+                  'payload': <memory>, 'parsed': <Message>, 'ss': 1200,
+                  'es': 1980}, None]
 '''
-# TCG Command
-cmdcode = {
-    0x0000011F: [28,'TPM_CC_NV_UNDEFINESPACESPECIAL'],
-    0x00000120: [28,'TPM_CC_EVICTCONTROL'],
-    0x00000121: [28,'TPM_CC_HIERARCHYCONTROL'],
-    0x00000122: [28,'TPM_CC_NV_UNDEFINESPACE'],
-    0x00000124: [28,'TPM_CC_CHANGEEPS'],
-    0x00000125: [28,'TPM_CC_CHANGEPPS'],
-    0x00000126: [28,'TPM_CC_CLEAR'],
-    0x00000127: [28,'TPM_CC_CLEARCONTROL'],
-    0x00000128: [28,'TPM_CC_CLOCKSET'],
-    0x00000129: [28,'TPM_CC_HIERARCHYCHANGEAUTH'],
-    0x0000012A: [28,'TPM_CC_NV_DEFINESPACE'],
-    0x0000012B: [28,'TPM_CC_PCR_ALLOCATE'],
-    0x0000012C: [28,'TPM_CC_PCR_SETAUTHPOLICY'],
-    0x0000012D: [28,'TPM_CC_PP_COMMANDS'],
-    0x0000012E: [28,'TPM_CC_SETPRIMARYPOLICY'],
-    0x0000012F: [28,'TPM_CC_FIELDUPGRADESTART'],
-    0x00000130: [28,'TPM_CC_CLOCKRATEADJUST'],
-    0x00000131: [28,'TPM_CC_CREATEPRIMARY'],
-    0x00000132: [28,'TPM_CC_NV_GLOBALWRITELOCK'],
-    0x00000133: [28,'TPM_CC_GETCOMMANDAUDITDIGEST'],
-    0x00000134: [28,'TPM_CC_NV_INCREMENT'],
-    0x00000135: [28,'TPM_CC_NV_SETBITS'],
-    0x00000136: [28,'TPM_CC_NV_EXTEND'],
-    0x00000137: [28,'TPM_CC_NV_WRITE'],
-    0x00000138: [28,'TPM_CC_NV_WRITELOCK'],
-    0x00000139: [28,'TPM_CC_DICTIONARYATTACKLOCKRESET'],
-    0x0000013A: [28,'TPM_CC_DICTIONARYATTACKPARAMETERS'],
-    0x0000013B: [28,'TPM_CC_NV_CHANGEAUTH'],
-    0x0000013C: [28,'TPM_CC_PCR_EVENT'],
-    0x0000013D: [28,'TPM_CC_PCR_RESET'],
-    0x0000013E: [28,'TPM_CC_SEQUENCECOMPLETE'],
-    0x0000013F: [28,'TPM_CC_SETALGORITHMSET'],
-    0x00000140: [28,'TPM_CC_SETCOMMANDCODEAUDITSTATUS'],
-    0x00000141: [28,'TPM_CC_FIELDUPGRADEDATA'],
-    0x00000142: [28,'TPM_CC_INCREMENTALSELFTEST'],
-    0x00000143: [28,'TPM_CC_SELFTEST'],
-    0x00000144: [28,'TPM_CC_STARTUP'],
-    0x00000145: [28,'TPM_CC_SHUTDOWN'],
-    0x00000146: [28,'TPM_CC_STIRRANDOM'],
-    0x00000147: [28,'TPM_CC_ACTIVATECREDENTIAL'],
-    0x00000148: [28,'TPM_CC_CERTIFY'],
-    0x00000149: [28,'TPM_CC_POLICYNV'],
-    0x0000014A: [28,'TPM_CC_CERTIFYCREATION'],
-    0x0000014B: [28,'TPM_CC_DUPLICATE'],
-    0x0000014C: [28,'TPM_CC_GETTIME'],
-    0x0000014D: [28,'TPM_CC_GETSESSIONAUDITDIGEST'],
-    0x0000014E: [28,'TPM_CC_NV_READ'],
-    0x0000014F: [28,'TPM_CC_NV_READLOCK'],
-    0x00000150: [28,'TPM_CC_OBJECTCHANGEAUTH'],
-    0x00000151: [28,'TPM_CC_POLICYSECRET'],
-    0x00000152: [28,'TPM_CC_REWRAP'],
-    0x00000153: [28,'TPM_CC_CREATE'],
-    0x00000154: [28,'TPM_CC_ECDH_ZGEN'],
-    0x00000155: [28,'TPM_CC_HMAC'],
-    0x00000156: [28,'TPM_CC_IMPORT'],
-    0x00000157: [28,'TPM_CC_LOAD'],
-    0x00000158: [28,'TPM_CC_QUOTE'],
-    0x00000159: [28,'TPM_CC_RSA_DECRYPT'],
-    0x0000015B: [28,'TPM_CC_HMAC_START'],
-    0x0000015C: [28,'TPM_CC_SEQUENCEUPDATE'],
-    0x0000015D: [28,'TPM_CC_SIGN'],
-    0x0000015E: [28,'TPM_CC_UNSEAL'],
-    0x00000160: [28,'TPM_CC_POLICYSIGNED'],
-    0x00000161: [28,'TPM_CC_CONTEXTLOAD'],
-    0x00000162: [28,'TPM_CC_CONTEXTSAVE'],
-    0x00000163: [28,'TPM_CC_ECDH_KEYGEN'],
-    0x00000164: [28,'TPM_CC_ENCRYPTDECRYPT'],
-    0x00000165: [28,'TPM_CC_FLUSHCONTEXT'],
-    0x00000167: [28,'TPM_CC_LOADEXTERNAL'],
-    0x00000168: [28,'TPM_CC_MAKECREDENTIAL'],
-    0x00000169: [28,'TPM_CC_NV_READPUBLIC'],
-    0x0000016A: [28,'TPM_CC_POLICYAUTHORIZE'],
-    0x0000016B: [28,'TPM_CC_POLICYAUTHVALUE'],
-    0x0000016C: [28,'TPM_CC_POLICYCOMMANDCODE'],
-    0x0000016D: [28,'TPM_CC_POLICYCOUNTERTIMER'],
-    0x0000016E: [28,'TPM_CC_POLICYCPHASH'],
-    0x0000016F: [28,'TPM_CC_POLICYLOCALITY'],
-    0x00000170: [28,'TPM_CC_POLICYNAMEHASH'],
-    0x00000171: [28,'TPM_CC_POLICYOR'],
-    0x00000172: [28,'TPM_CC_POLICYTICKET'],
-    0x00000173: [28,'TPM_CC_READPUBLIC'],
-    0x00000174: [28,'TPM_CC_RSA_ENCRYPT'],
-    0x00000176: [28,'TPM_CC_STARTAUTHSESSION'],
-    0x00000177: [28,'TPM_CC_VERIFYSIGNATURE'],
-    0x00000178: [28,'TPM_CC_ECC_PARAMETERS'],
-    0x00000179: [28,'TPM_CC_FIRMWAREREAD'],
-    0x0000017A: [28,'TPM_CC_GETCAPABILITY'],
-    0x0000017B: [28,'TPM_CC_GETRANDOM'],
-    0x0000017C: [28,'TPM_CC_GETTESTRESULT'],
-    0x0000017D: [28,'TPM_CC_HASH'],
-    0x0000017E: [28,'TPM_CC_PCR_READ'],
-    0x0000017F: [28,'TPM_CC_POLICYPCR'],
-    0x00000180: [28,'TPM_CC_POLICYRESTART'],
-    0x00000181: [28,'TPM_CC_READCLOCK'],
-    0x00000182: [28,'TPM_CC_PCR_EXTEND'],
-    0x00000183: [28,'TPM_CC_PCR_SETAUTHVALUE'],
-    0x00000184: [28,'TPM_CC_NV_CERTIFY'],
-    0x00000185: [28,'TPM_CC_EVENTSEQUENCECOMPLETE'],
-    0x00000186: [28,'TPM_CC_HASHSEQUENCESTART'],
-    0x00000187: [28,'TPM_CC_POLICYPHYSICALPRESENCE'],
-    0x00000188: [28,'TPM_CC_POLICYDUPLICATIONSELECT'],
-    0x00000189: [28,'TPM_CC_POLICYGETDIGEST'],
-    0x0000018A: [28,'TPM_CC_TESTPARMS'],
-    0x0000018B: [28,'TPM_CC_COMMIT'],
-    0x0000018C: [28,'TPM_CC_POLICYPASSWORD'],
-    0x0000018D: [28,'TPM_CC_ZGEN_2PHASE'],
-    0x0000018E: [28,'TPM_CC_EC_EPHEMERAL'],
-    0x0000018F: [28,'TPM_CC_POLICYNVWRITTEN'],
-    0x00000190: [28,'TPM_CC_POLICYTEMPLATE'],
-    0x00000191: [28,'TPM_CC_CREATELOADED'],
-    0x00000192: [28,'TPM_CC_POLICYAUTHORIZENV'],
-    0x00000193: [28,'TPM_CC_ENCRYPTDECRYPT2'],
-    0x00000194: [28,'TPM_CC_AC_GETCAPABILITY'],
-    0x00000195: [28,'TPM_CC_AC_SEND'],
-    0x00000196: [28,'TPM_CC_POLICY_AC_SENDSELECT'],
-    0x00000197: [28,'TPM_CC_CERTIFYX509'],
-    0x00000198: [28,'TPM_CC_ACT_SETTIMEOUT'],
-}
-
-
-# TCG TAG Main spec part 2
-tag = {
-    0x00C4: [26,'TPM_ST_RSP_COMMAND',           'RSP_CMD',           'RSP'],
-    0x8000: [26,'TPM_ST_NULL',                  'NULL',               'NL'],
-    0x8001: [26,'TPM_ST_NO_SESSIONS',           'NO_SESS',           'NSE'],
-    0x8002: [26,'TPM_ST_SESSIONS',              'SESSION',           'SES'],
-    0x8014: [26,'TPM_ST_ATTEST_NV',             'ATT_NV',            'ANV'],
-    0x8015: [26,'TPM_ST_ATTEST_COMMAND_AUDIT',  'ATT_CMD',           'ACM'],
-    0x8016: [26,'TPM_ST_ATTEST_SESSION_AUDIT',  'ATT_SES',           'ASE'],
-    0x8017: [26,'TPM_ST_ATTEST_CERTIFY',        'ATT_CER',           'ACR'],
-    0x8018: [26,'TPM_ST_ATTEST_QUOTE',          'ATT_QUO',           'AQU'],
-    0x8019: [26,'TPM_ST_ATTEST_TIME',           'ATT_TIM',           'ATM'],
-    0x801A: [26,'TPM_ST_ATTEST_CREATION',       'ATT_CRE',           'ACR'],
-    0x801C: [26,'TPM_ST_ATTEST_NV_DIGEST',      'ATT_NVD',           'AND'],
-    0x8021: [26,'TPM_ST_CREATION',              'CREATIN',           'CRE'],
-    0x8022: [26,'TPM_ST_VERIFIED',              'VERIFED',           'VER'],
-    0x8023: [26,'TPM_ST_AUTH_SECRET',           'AUTHSEC',           'ASC'],
-    0x8024: [26,'TPM_ST_HASHCHECK',             'HASHCHK',           'HAC'],
-    0x8025: [26,'TPM_ST_AUTH_SIGNED',           'AUTHSIG',           'ASG'],
-    0x8029: [26,'TPM_ST_FU_MANIFEST',           'FU_MANI',           'FUM'],
-}
-
-# REG
-reg = {
-    0x0000: [17,'TPM_ACCESS_0',           'ACCESS_0',           'AC0'],
-    0x0008: [17,'TPM_INT_ENABLE_0',       'INT_ENABLE_0',       'IE0'],
-    0x000C: [17,'TPM_INT_VECTOR_0',       'INT_VECTOR_0',       'IV0'],
-    0x0010: [17,'TPM_INT_STATUS_0',       'INT_STATUS_0',       'IS0'],
-    0x0014: [17,'TPM_INTF_CAPABILITY_0',  'INTF_CAPABILITY_0',  'IC0'],
-    0x0018: [17,'TPM_STS_0',              'STS_0',              'ST0'],
-    0x0024: [17,'TPM_DATA_FIFO_0',        'DATA_FIFO_0',        'DF0'],
-    0x0080: [17,'TPM_XDATA_FIFO_0',       'XDATA_FIFO_0',       'XD0'],
-    0x0F00: [17,'TPM_DID_VID_0',          'DID_VID_0',          'DV0'],
-    0x0F04: [17,'TPM_RID_0',              'RID_0',              'RI0'],
-    0x0000: [17,'TPM_ACCESS_0',           'ACCESS_0',           'AC0'],
-
-    0x1000: [9,'TPM_ACCESS_1',           'ACCESS_1',           'AC1'],
-    0x1008: [9,'TPM_INT_ENABLE_1',       'INT_ENABLE_1',       'IE1'],
-    0x100C: [9,'TPM_INT_VECTOR_1',       'INT_VECTOR_1',       'IV1'],
-    0x1010: [9,'TPM_INT_STATUS_1',       'INT_STATUS_1',       'IS1'],
-    0x1014: [9,'TPM_INTF_CAPABILITY_1',  'INTF_CAPABILITY_1',  'IC1'],
-    0x1018: [9,'TPM_STS_1',              'STS_1',              'ST1'],
-    0x1024: [9,'TPM_DATA_FIFO_1',        'DATA_FIFO_1',        'DF1'],
-    0x1080: [9,'TPM_XDATA_FIFO_1',       'XDATA_FIFO_1',       'XD1'],
-    0x1F00: [9,'TPM_DID_VID_1',          'DID_VID_1',          'DV1'],
-    0x1F04: [9,'TPM_RID_1',              'RID_1',              'RI1'],
-
-    0x2000: [11,'TPM_ACCESS_2',           'ACCESS_2',           'AC2'],
-    0x2008: [11,'TPM_INT_ENABLE_2',       'INT_ENABLE_2',       'IE2'],
-    0x200C: [11,'TPM_INT_VECTOR_2',       'INT_VECTOR_2',       'IV2'],
-    0x2010: [11,'TPM_INT_STATUS_2',       'INT_STATUS_2',       'IS2'],
-    0x2014: [11,'TPM_INTF_CAPABILITY_2',  'INTF_CAPABILITY_2',  'IC2'],
-    0x2018: [11,'TPM_STS_2',              'STS_2',              'ST2'],
-    0x2024: [11,'TPM_DATA_FIFO_2',        'DATA_FIFO_2',        'DF2'],
-    0x2080: [11,'TPM_XDATA_FIFO_2',       'XDATA_FIFO_2',       'XD2'],
-    0x2F00: [11,'TPM_DID_VID_2',          'DID_VID_2',          'DV2'],
-    0x2F04: [11,'TPM_RID_2',              'RID_2',              'RI2'],
-
-    0x3000: [13,'TPM_ACCESS_3',           'ACCESS_3',           'AC3'],
-    0x3008: [13,'TPM_INT_ENABLE_3',       'INT_ENABLE_3',       'IE3'],
-    0x300C: [13,'TPM_INT_VECTOR_3',       'INT_VECTOR_3',       'IV3'],
-    0x3010: [13,'TPM_INT_STATUS_3',       'INT_STATUS_3',       'IS3'],
-    0x3014: [13,'TPM_INTF_CAPABILITY_3',  'INTF_CAPABILITY_3',  'IC3'],
-    0x3018: [13,'TPM_STS_3',              'STS_3',              'ST3'],
-    0x3024: [13,'TPM_DATA_FIFO_3',        'DATA_FIFO_3',        'DF3'],
-    0x3080: [13,'TPM_XDATA_FIFO_3',       'XDATA_FIFO_3',       'XD3'],
-    0x3F00: [13,'TPM_DID_VID_3',          'DID_VID_3',          'DV3'],
-    0x3F04: [13,'TPM_RID_3',              'RID_3',              'RI3'],
-
-    0x4000: [15,'TPM_ACCESS_4',           'ACCESS_4',           'AC4'],
-    0x4008: [15,'TPM_INT_ENABLE_4',       'INT_ENABLE_4',       'IE4'],
-    0x400C: [15,'TPM_INT_VECTOR_4',       'INT_VECTOR_4',       'IV4'],
-    0x4010: [15,'TPM_INT_STATUS_4',       'INT_STATUS_4',       'IS4'],
-    0x4014: [15,'TPM_INTF_CAPABILITY_4',  'INTF_CAPABILITY_4',  'IC4'],
-    0x4018: [15,'TPM_STS_4',              'STS_4',              'ST4'],
-    0x4024: [15,'TPM_DATA_FIFO_4',        'DATA_FIFO_4',        'DF4'],
-    0x4080: [15,'TPM_XDATA_FIFO_4',       'XDATA_FIFO_4',       'XD4'],
-    0x4F00: [15,'TPM_DID_VID_4',          'DID_VID_4',          'DV4'],
-    0x4F04: [15,'TPM_RID_4',              'RID_4',              'RI4'],
-}
 
+class Transfer:
+    # The bytes of one block of CS# asserted time, as arrays: the MISO and
+    # MOSI values and the start/end sample numbers of each byte.
+    __slots__ = ('miso', 'mosi', 'ss', 'es')
 
+    def __init__(self):
+        self.miso = bytearray()
+        self.mosi = bytearray()
+        self.ss = array('q')
+        self.es = array('q')
+
+    def __len__(self):
+        return len(self.miso)
+
+    def append(self, ss, es, so, si):
+        self.miso.append(so)
+        self.mosi.append(si)
+        self.ss.append(ss)
+        self.es.append(es)
+
+class DataView(Sequence):
+    # One direction of a Transfer as a sequence of Data() namedtuples, which
+    # are only made when accessed.
+    __slots__ = ('xfer', 'vals')
+
+    def __init__(self, xfer, vals):
+        self.xfer = xfer
+        self.vals = vals
+
+    def __len__(self):
+        return len(self.vals)
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return [self[j] for j in range(*i.indices(len(self.vals)))]
+        return Data(ss=self.xfer.ss[i], es=self.xfer.es[i], val=self.vals[i])
+
+    def __eq__(self, other):
+        return list(self) == list(other)
+
+    def __repr__(self):
+        return repr(list(self))
+
+def hex_text(data):
+    # Annotation text of a run of bytes: upper case hex, space separated.
+    return data.hex(' ').upper()
+
+# Annotation payloads for every byte value, built once and indexed by the
+# byte. They are never modified, so the same list can be put() repeatedly.
+def byte_anns(cls, name, short, letter):
+    return tuple([cls, ['%s:0x%02X' % (name, b), '%s:0x%02X' % (short, b),
+                        '%s:%02X' % (letter, b), '%02X' % b]] for b in range(256))
+
+miso_bit_anns = ([2, ['0']], [2, ['1']])
+mosi_bit_anns = ([3, ['0']], [3, ['1']])
+miso_data_anns = tuple([0, ['%02X' % b]] for b in range(256))
+mosi_data_anns = tuple([1, ['%02X' % b]] for b in range(256))
+reg_write_anns = byte_anns(21, 'WRITE', 'WR', 'W')
+reg_read_anns = byte_anns(22, 'READ', 'RD', 'R')
+cmd_write_anns = byte_anns(29, 'WRITE', 'WR', 'W')
+cmd_read_anns = byte_anns(30, 'READ', 'RD', 'R')
+
+# TPM_ACCESS and TPM_STS register bits, MSB first.
+access_fields = ('VALIDSTS', 'RESERVED', 'ACTIVELOCALITY', 'BEENSEIZED',
+                 'SEIZE', 'PENDING', 'REQUESTUSE', 'ESTABLISHMENT')
+sts_fields = ('VALIDSTS', 'READY', 'TPMGO', 'DATAAVAIL',
+              'EXPECT', 'SELFTESTDONE', 'RESPRETRY', 'RESERVED')
+
+def field_anns(fields, classes, invalid_classes):
+    # Per byte value, the annotation payload of each register bit. Reads
+    # with VALIDSTS clear flag the bits that are not valid then.
+    return tuple(tuple([c, ['%s:%d' % (f, (b >> (7 - k)) & 1)]] for k, (f, c) in
+                       enumerate(zip(fields, classes if b & 0x80 else invalid_classes)))
+                 for b in range(256))
+
+state_classes = (23, 24, 23, 24, 23, 24, 23, 24)
+access_write_anns = field_anns(access_fields, state_classes, state_classes)
+access_read_anns = field_anns(access_fields, state_classes, (25, 24, 23, 24, 23, 24, 23, 24))
+sts_write_anns = field_anns(sts_fields, state_classes, state_classes)
+sts_read_anns = field_anns(sts_fields, state_classes, (25, 24, 23, 25, 25, 24, 23, 24))
+
+def access_locality_sts(b):
+    # Locality state reported by a TPM_ACCESS read (with VALIDSTS set).
+    sts = 'NOT ACTIVE'
+    if b & 0x20:
+        sts = 'ACTIVE'
+    if b & 0x10:
+        sts = 'SEIZED'
+    if b & 0x02:
+        sts = 'REQUEST'
+    return sts
+
+# TPM_ACCESS state requested by a write / reported by a read, by byte value.
+access_write_sts = tuple({0x20: 'RELINUISH', 0x10: 'CLEAR SEIZED', 0x08: 'SEIZE',
+                          0x02: 'REQUEST'}.get(b, 'ERROR') for b in range(256))
+access_read_sts = tuple(access_locality_sts(b) for b in range(256))
+
+# TPM command/response header: tag, size and command code (or response
+# code), big-endian.
+tpm_header = struct.Struct('>HII')
+tpm_tag = struct.Struct('>H')
+tpm_size = struct.Struct('>2xI')
+
+def parse_tpm_header(data):
+    # (tag, size, code) of the TPM command or response header at the start
+    # of data.
+    return tpm_header.unpack_from(data)
+
+def rc_texts(rc):
+    # Response code annotation text, longest first.
+    info = decode_rc(rc)
+    return ['RC : 0x%08X %s' % (rc, info.text), 'RC : 0x%08X' % rc, info.short]
+
+def error_ann(cls):
+    return [cls, ['PROTOCOL ERROR', 'ERROR', 'ERR', 'E']]
+
+# Register addresses, tags and command codes which are not in the registry.
+reg_error_ann = error_ann(51)
+cmd_error_ann = error_ann(49)
+frame_cmd_error_ann = error_ann(52)
+frame_reg_error_ann = error_ann(54)
+
+class ProtocolErrors:
+    # Protocol errors seen so far, by category: how many, and the start
+    # samples of the first and of the last one.
+    def __init__(self):
+        self.total = 0
+        self.first = -1
+        self.categories = {}
+
+    def add(self, category, ss):
+        if not self.total:
+            self.first = ss
+        self.total += 1
+        seen = self.categories.get(category)
+        if seen:
+            seen[0] += 1
+            seen[2] = ss
+        else:
+            self.categories[category] = [1, ss, ss]
+
+    def summary(self):
+        return ', '.join('%s: %d (%d-%d)' % (category, count, first, last)
+                         for category, (count, first, last) in self.categories.items())
+
+# Annotation layers, lowest first, and their annotation classes. Only the
+# layers between the 'layer_min' and 'layer_max' options are annotated, and
+# nothing above 'layer_max' is parsed at all.
+ann_layers = (
+    ('bits',     (2, 3)),
+    ('data',     (0, 1)),
+    ('transfer', (5, 6)),
+    ('register', tuple(range(7, 26)) + (50, 51)),
+    ('command',  tuple(range(26, 31)) + (49,)),
+    ('frame',    tuple(range(31, 49)) + (52, 53, 54)),
+    ('parameter', tuple(range(55, 60))),
+)
 
 class ChannelError(Exception):
     pass
@@ -287,6 +259,16 @@ class Decoder(srd.Decoder):
     options = (
         {'id': 'cs_polarity', 'desc': 'CS# polarity', 'default': 'active-low',
             'values': ('active-low', 'active-high')},
+        {'id': 'python_output', 'desc': 'Python output (stacked decoders)',
+            'default': 'yes', 'values': ('yes', 'no')},
+        {'id': 'binary_output', 'desc': 'Binary output',
+            'default': 'yes', 'values': ('yes', 'no')},
+        {'id': 'bitrate_output', 'desc': 'Bitrate (meta) output',
+            'default': 'yes', 'values': ('yes', 'no')},
+        {'id': 'layer_min', 'desc': 'Lowest annotation layer',
+            'default': 'bits', 'values': ('bits', 'data', 'transfer', 'register', 'command', 'frame', 'parameter')},
+        {'id': 'layer_max', 'desc': 'Highest annotation layer',
+            'default': 'frame', 'values': ('bits', 'data', 'transfer', 'register', 'command', 'frame', 'parameter')},
     )
     annotations = (
         ('106', 'miso-data', 'MISO data'),                          #0
@@ -353,6 +335,12 @@ class Decoder(srd.Decoder):
         ('0', 'frame-cmd-err', 'Frame Command Error'),              #52
         ('0', 'frame-state-err', 'Frame State Error'),              #53
         ('0', 'frame-reg-err', 'Frame Register Error'),             #54
+
+        ('901', 'param-handle', 'Parameter Handle'),                #55
+        ('903', 'param-session', 'Parameter Session'),              #56
+        ('909', 'param-w', 'Command Parameter'),                    #57
+        ('907', 'param-r', 'Response Parameter'),                   #58
+        ('0', 'param-err', 'Parameter Error'),                      #59
     )
     annotation_rows = (
         ('miso-bits', 'MISO bits', (2,)),
@@ -370,6 +358,8 @@ class Decoder(srd.Decoder):
         ('frame-cmd','Frame-Command', (38,39,40,41,42,52,)),
         ('frame-state','Frame-State', (43,44,45,46,47,48,53,)),
         ('frame-reg','Frame-Register', (31,32,33,34,35,36,37,54,)),
+
+        ('param','Parameters', (55,56,57,58,59,)),
     )
     binary = (
         ('miso', 'MISO'),
@@ -383,10 +373,12 @@ class Decoder(srd.Decoder):
         self.samplerate = None
         self.bitcount = 0
         self.misodata = self.mosidata = 0
-        self.misobits = []
-        self.mosibits = []
-        self.misobytes = []
-        self.mosibytes = []
+        # Start/end sample numbers of the bits of the current dataword, in
+        # the order they are received (MSB first). The bit values are in
+        # the misodata/mosidata shift registers.
+        self.bit_ss = [0] * 8
+        self.bit_es = [0] * 8
+        self.xfer = Transfer()
         self.ss_block = -1
         self.samplenum = -1
         self.ss_transfer = -1
@@ -406,7 +398,7 @@ class Decoder(srd.Decoder):
         self.reg_selftest = 0
         self.reg_commandready = 0
         self.reg_valid = 0
-        self_reg_responseretry = 0
+        self.reg_responseretry = 0
         self.reg_tpmgo = 0
 
         self.reg_tpmestablishment = 0
@@ -422,6 +414,7 @@ class Decoder(srd.Decoder):
 
         self.cmd = 0
         self.cmd_count = 0
+        self.cmd_buf = bytearray(tpm_header.size)
         self.cmd_tag = 0
         self.cmd_ord = 0
         self.cmd_rc = 0
@@ -440,16 +433,47 @@ class Decoder(srd.Decoder):
         self.frame_cmd_sp = -1
         self.frame_cmd_ep = -1
         self.frame_cmd_wr = -1
-        self.frame_bytes = []
-        self.frame_reg_bytes = []
-        self.frame_cmd_first = 0
+        self.message = bytearray()
+        self.message_pos = 0
+        self.frame_reg_bytes = b''
+
+        self.deserializer = None
+
+        self.errors = ProtocolErrors()
+
+        # Which output streams to produce, see start().
+        self.python_on = self.binary_on = self.bitrate_on = True
+        self.ann_on = [True] * len(self.annotations)
+        self.bits_on = self.data_on = self.transfer_on = True
+        self.parse_register = self.parse_command = self.parse_frame = True
+        self.parse_parameter = False
 
     def start(self):
+        self.registry = registry.load()
         self.out_python = self.register(srd.OUTPUT_PYTHON)
         self.out_ann = self.register(srd.OUTPUT_ANN)
         self.out_binary = self.register(srd.OUTPUT_BINARY)
         self.out_bitrate = self.register(srd.OUTPUT_META,
         meta=(int, 'Bitrate', 'Bitrate during transfers'))
+        self.out_errors = self.register(srd.OUTPUT_META,
+                meta=(int, 'Protocol errors', 'Protocol errors so far'))
+        self.python_on = self.options['python_output'] == 'yes'
+        self.binary_on = self.options['binary_output'] == 'yes'
+        self.bitrate_on = self.options['bitrate_output'] == 'yes'
+
+        names = [name for name, classes in ann_layers]
+        lo = names.index(self.options['layer_min'])
+        hi = max(lo, names.index(self.options['layer_max']))
+        for i, (name, classes) in enumerate(ann_layers):
+            for c in classes:
+                self.ann_on[c] = lo <= i <= hi
+        self.bits_on = self.ann_on[2]
+        self.data_on = self.ann_on[0]
+        self.transfer_on = self.ann_on[5]
+        self.parse_register = hi >= names.index('register')
+        self.parse_command = hi >= names.index('command')
+        self.parse_frame = hi >= names.index('frame')
+        self.parse_parameter = hi >= names.index('parameter')
         self.bw = (8 + 7) // 8
 
     def metadata(self, key, value):
@@ -459,332 +483,390 @@ class Decoder(srd.Decoder):
     def putw(self, data):
         self.put(self.ss_block, self.samplenum, self.out_ann, data)
 
+    def puta(self, ss, es, data):
+        # Register, command and frame annotations.
+        if self.ann_on[data[0]]:
+            self.put(ss, es, self.out_ann, data)
+
+    def protocol_error(self, category, ss, es):
+        # Count the error, the META output is the running total.
+        self.errors.add(category, ss)
+        self.put(ss, es, self.out_errors, self.errors.total)
+
+    def finish(self):
+        # End of the samples: sum up the protocol errors, if there were
+        # any. decode() does this itself, decode_chunk() hosts call it
+        # after the last chunk.
+        errors = self.errors
+        if errors.total:
+            self.put(errors.first, max(errors.first, self.samplenum), self.out_ann,
+                     [4, ['PROTOCOL ERRORS: %d, %s' % (errors.total, errors.summary()),
+                          'PROTOCOL ERRORS: %d' % errors.total, 'ERRORS', 'E']])
+
+    def put_fields(self, anns):
+        # TPM_ACCESS/TPM_STS bit annotations, MSB first.
+        bit_ss, bit_es = self.bit_ss, self.bit_es
+        for k in range(8):
+            self.puta(bit_ss[k], bit_es[k], anns[k])
+
     def putdata(self, frame):
         # Pass MISO and MOSI bits and then data to the next PD up the stack.
         so = self.misodata
         si = self.mosidata
-        so_bits = self.misobits
-        si_bits = self.mosibits
-
+        bit_ss, bit_es = self.bit_ss, self.bit_es
 
-        ss, es = self.misobits[-1][1], self.misobits[0][2]
-        bdata = so.to_bytes(self.bw, byteorder='big')
-        self.put(ss, es, self.out_binary, [0, bdata])
+        ss, es = bit_ss[0], bit_es[7]
+        if self.binary_on:
+            bdata = so.to_bytes(self.bw, byteorder='big')
+            self.put(ss, es, self.out_binary, [0, bdata])
 
-        ss, es = self.mosibits[-1][1], self.mosibits[0][2]
-        bdata = si.to_bytes(self.bw, byteorder='big')
-        self.put(ss, es, self.out_binary, [1, bdata])
+            bdata = si.to_bytes(self.bw, byteorder='big')
+            self.put(ss, es, self.out_binary, [1, bdata])
 
-        self.put(ss, es, self.out_python, ['BITS', si_bits, so_bits])
-        self.put(ss, es, self.out_python, ['DATA', si, so])
+        if self.python_on:
+            self.put(ss, es, self.out_python, ['BITS', self.bit_list(si), self.bit_list(so)])
+            self.put(ss, es, self.out_python, ['DATA', si, so])
 
         if frame:
-            self.misobytes.append(Data(ss=ss, es=es, val=so))
-            self.mosibytes.append(Data(ss=ss, es=es, val=si))
+            self.xfer.append(ss, es, so, si)
 
-        # Bit annotations.
-        for bit in self.misobits:
-            self.put(bit[1], bit[2], self.out_ann, [2, ['%d' % bit[0]]])
-        for bit in self.mosibits:
-            self.put(bit[1], bit[2], self.out_ann, [3, ['%d' % bit[0]]])
+        # Bit annotations, LSB first.
+        if self.bits_on:
+            for i in range(8):
+                self.put(bit_ss[7 - i], bit_es[7 - i], self.out_ann, miso_bit_anns[(so >> i) & 1])
+            for i in range(8):
+                self.put(bit_ss[7 - i], bit_es[7 - i], self.out_ann, mosi_bit_anns[(si >> i) & 1])
 
         # Dataword annotations.
-        self.put(ss, es, self.out_ann, [0, ['%02X' % self.misodata]])
-        self.put(ss, es, self.out_ann, [1, ['%02X' % self.mosidata]])
+        if self.data_on:
+            self.put(ss, es, self.out_ann, miso_data_anns[so])
+            self.put(ss, es, self.out_ann, mosi_data_anns[si])
+
+        if not self.parse_register:
+            return
 
         # Register annotations.
-        if self.bytecount == 0:
-            #first byte
-            self.sizeofxfer = (self.mosidata & 0x7f) + 1
-            if (self.mosidata & 0x80) == 0x00:
-                #reg write
-                self.reg_wr = 1
-                self.put(ss, es, self.out_ann, [8, ['WRITE:%d' % self.sizeofxfer, 'WR:%d' % self.sizeofxfer, 'W:%d' % self.sizeofxfer]])
+        if self.bytecount < 4:
+            self.reg_header_steps[self.bytecount](self, ss, es)
+        else:
+            self.handle_reg_data(ss, es)
+        self.bytecount += 1
+
+    def handle_reg_size(self, ss, es):
+        #first byte
+        self.sizeofxfer = (self.mosidata & 0x7f) + 1
+        if (self.mosidata & 0x80) == 0x00:
+            #reg write
+            self.reg_wr = 1
+            self.puta(ss, es, [8, ['WRITE:%d' % self.sizeofxfer, 'WR:%d' % self.sizeofxfer, 'W:%d' % self.sizeofxfer]])
+        else:
+            #reg read
+            self.reg_wr = 0
+            self.puta(ss, es, [7, ['READ:%d' % self.sizeofxfer, 'RD:%d' % self.sizeofxfer, 'R:%d' % self.sizeofxfer],])
+
+    def handle_reg_skip(self, ss, es):
+        # skip D4
+        self.reg_sp = ss
+
+    def handle_reg_addr_hi(self, ss, es):
+        # upper reg address
+        self.reg_addr = (self.mosidata << 8)
+
+    def handle_reg_addr_lo(self, ss, es):
+        # lower reg address
+        self.reg_ep = es
+        self.reg_addr += self.mosidata
+        self.reg_locality = (self.reg_addr & 0xf000) >> 12
+        if ((self.reg_addr & 0x0fff) == 0x0024) or ((self.reg_addr & 0x0fff) == 0x0080):
+            # TPM Command / Response byte stream
+            self.cmd = 1
+        ann = self.registry.reg(self.reg_addr)
+        if ann:
+            self.puta(self.reg_sp,self.reg_ep,ann)
+        else:
+            self.puta(self.reg_sp,self.reg_ep,reg_error_ann)
+            self.protocol_error('unknown register', self.reg_sp, self.reg_ep)
+
+        if self.misodata == 1:
+            self.puta(ss,es,[19,['ACK','AK','A']])
+        else:
+            self.puta(ss,es,[20,['NACK','NK','N']])
+
+    # SPI header handlers, by byte number within the transfer.
+    reg_header_steps = (handle_reg_size, handle_reg_skip, handle_reg_addr_hi, handle_reg_addr_lo)
+
+    def handle_reg_data(self, ss, es):
+        if self.reg_wr == 1:
+            self.puta(ss, es, reg_write_anns[self.mosidata])
+            # Reg Header / Status
+            if ((self.reg_addr & 0x0fff) == 0x0000):
+                # TPM_ACCESS
+                self.reg_access_sts = access_write_sts[self.mosidata]
+                self.put_fields(access_write_anns[self.mosidata])
+
+                #self.put(ss, es,self.out_ann,[23,['%s' % (self.reg_access_sts)]])
+
+            if ((self.reg_addr & 0x0fff) == 0x0018):
+                # TPM_STATUS
+                self.reg_tpmgo = (self.mosidata >> 5) & 1
+                self.reg_commandready = (self.mosidata >> 6) & 1
+                self.reg_responseretry = (self.mosidata >> 2) & 1
+
+                if ((self.reg_tpmgo == 1) or (self.reg_commandready == 1)):
+                    self.cmd_response = 0
+                    self.cmd_command = 0
+
+                self.put_fields(sts_write_anns[self.mosidata])
+
+                #self.put(ss,es,self.out_ann,[23,['TPMGO:%d, CMDREADY:%d, RESPONSERETRY:%d' % (self.reg_tpmgo,self.reg_commandready,self.reg_responseretry)]])
+        else:
+            self.puta(ss, es, reg_read_anns[self.misodata])
+            # Reg Header / Status
+            if ((self.reg_addr & 0x0fff) == 0x0000):
+                # TPM_ACCESS
+                self.reg_tpmestablishment = self.misodata & 1
+                self.reg_requestuse = (self.misodata >> 1) & 1
+                self.reg_pendingrequest = (self.misodata >> 2) & 1
+                self.reg_beenseized = (self.misodata >> 4) & 1
+                self.reg_activelocality = (self.misodata >> 5) & 1
+                self.reg_tpmregvalidsts = (self.misodata >> 7) & 1
+
+                if self.reg_tpmregvalidsts == 1:
+                    self.reg_access_sts = access_read_sts[self.misodata]
+                    if self.reg_pendingrequest == 1:
+                        self.reg_access_sts1 = 'PENDING'
+
+                self.put_fields(access_read_anns[self.misodata])
+
+            if ((self.reg_addr & 0x0fff) == 0x0018):
+                # TPM_STATUS
+                if (self.bytecount == 4):
+                    self.reg_selftest = (self.misodata >> 2) & 1
+                    self.reg_commandready = (self.misodata >> 6) & 1
+                    self.reg_valid = (self.misodata >> 7) & 1
+                    if (self.reg_valid != 0x00):
+                        self.reg_data_avail = (self.misodata >> 4) & 1
+                        self.reg_expect = (self.misodata >> 3) & 1
+                    else:
+                        self.reg_data_avail = -1
+                        self.reg_expect = -1
+
+                    self.put_fields(sts_read_anns[self.misodata])
+
+                elif (self.bytecount == 5):
+                    self.reg_sp = ss
+                    self.reg_burstcnt = self.misodata
+                elif (self.bytecount == 6):
+                    self.reg_ep = es
+                    self.reg_burstcnt += (self.misodata << 8)
+                    if self.reg_data_avail == 1:
+                        self.cmd_burst = self.reg_burstcnt
+                    self.puta(self.reg_sp,self.reg_ep,[23,['BURSTCOUNT:%d' % self.reg_burstcnt,
+                                                'BC:%d' % self.reg_burstcnt,'%d' % self.reg_burstcnt]])
+
+        # Command annotation
+        if self.cmd == 1 and self.parse_command:
+            if (self.cmd_command == 0) and (self.cmd_response == 0):
+                self.handle_cmd_header(ss, es)
             else:
-                #reg read
-                self.reg_wr = 0
-                self.put(ss, es, self.out_ann, [7, ['READ:%d' % self.sizeofxfer, 'RD:%d' % self.sizeofxfer, 'R:%d' % self.sizeofxfer],])
-        elif self.bytecount == 1:
-            # skip D4
-            self.reg_sp = ss
-        elif self.bytecount == 2:
-            # upper reg address
-            self.reg_addr = (self.mosidata << 8)
-        elif self.bytecount == 3:
-            # lower reg address
-            self.reg_ep = es
-            self.reg_addr += self.mosidata
-            self.reg_locality = (self.reg_addr & 0xf000) >> 12
-            if ((self.reg_addr & 0x0fff) == 0x0024) or ((self.reg_addr & 0x0fff) == 0x0080):
-                # TPM Command / Response byte stream
-                self.cmd = 1
-            try:
-                self.put(self.reg_sp,self.reg_ep,self.out_ann,[reg[self.reg_addr][0],['%s' % reg[self.reg_addr][1],
-                                                        '%s' % reg[self.reg_addr][2],'%s' % reg[self.reg_addr][3]]])
-            except:
-                self.put(self.reg_sp,self.reg_ep,self.out_ann,[51, ['PROTOCOL ERROR','ERROR','ERR','E']])
-
-            if self.misodata == 1:
-                self.put(ss,es,self.out_ann,[19,['ACK','AK','A']])
+                if self.cmd_command == 1:
+                    self.puta(ss, es, cmd_write_anns[self.mosidata])
+                else:
+                    self.puta(ss, es, cmd_read_anns[self.misodata])
+                if self.message_pos < len(self.message):
+                    self.message[self.message_pos] = self.mosidata if self.cmd_command == 1 else self.misodata
+                    self.message_pos += 1
+                self.cmd_expect -= 1
+                if self.cmd_expect == 0:
+                    self.cmd_response = 0
+                    self.cmd_command = 0
+                    self.cmd_done = 1
+            self.cmd_count += 1
+
+    def handle_cmd_header(self, ss, es):
+        # Collect the command/response header of the FIFO byte stream; each
+        # field is decoded as soon as its last byte is in.
+        n = self.cmd_count
+        if n >= tpm_header.size:
+            return
+        self.cmd_buf[n] = self.mosidata if self.reg_wr == 1 else self.misodata
+        step = self.cmd_header_steps[n]
+        if step:
+            step(self, ss, es)
+
+    def start_cmd_header(self, ss, es):
+        # tag
+        self.cmd_sp = ss
+        self.frame_cmd_wr = self.reg_wr
+
+    def start_cmd_field(self, ss, es):
+        self.cmd_sp = ss
+
+    def handle_cmd_tag(self, ss, es):
+        self.cmd_ep = es
+        self.cmd_tag, = tpm_tag.unpack_from(self.cmd_buf)
+        ann = self.registry.tag(self.cmd_tag)
+        if ann:
+            self.puta(self.cmd_sp,self.cmd_ep,ann)
+        else:
+            self.puta(self.cmd_sp,self.cmd_ep,cmd_error_ann)
+            self.protocol_error('unknown tag', self.cmd_sp, self.cmd_ep)
+
+    def handle_cmd_len(self, ss, es):
+        # length
+        self.cmd_ep = es
+        self.cmd_len, = tpm_size.unpack_from(self.cmd_buf)
+        self.puta(self.cmd_sp,self.cmd_ep,[27,['LENGTH:%d' % self.cmd_len,
+                            'LEN:%d' % self.cmd_len,'%d' % self.cmd_len]])
+        if self.cmd_len < tpm_header.size:
+            self.protocol_error('bad command length', self.cmd_sp, self.cmd_ep)
+
+    def handle_cmd_code(self, ss, es):
+        # Command Code
+        self.cmd_ep = es
+        code = parse_tpm_header(self.cmd_buf)[2]
+        if self.reg_wr == 1:
+            self.cmd_command = 1
+            self.cmd_response = 0
+
+            self.cmd_ord = code
+            if (self.cmd_ord & 0x2000) == 0:
+                # TCG Command
+                ann = self.registry.cmd(self.cmd_ord)
+                if ann:
+                    self.puta(self.cmd_sp,self.cmd_ep,ann)
+                else:
+                    self.puta(self.cmd_sp,self.cmd_ep,cmd_error_ann)
+                    self.protocol_error('unknown command code', self.cmd_sp, self.cmd_ep)
             else:
-                self.put(ss,es,self.out_ann,[20,['NACK','NK','N']])
+                # Vendor Specific Command
+                self.puta(self.cmd_sp,self.cmd_ep,[28,['VENDOR SPECIFIC CMD : 0x%08X' % self.cmd_ord,
+                                    'VENDOR:0x%08X' % self.cmd_ord,'V:%08X' % self.cmd_ord,'%08X' % self.cmd_ord]])
         else:
-            if self.reg_wr == 1:
-                self.put(ss,es,self.out_ann,[21,['WRITE:0x%02X' % self.mosidata,'WR:0x%02X' % self.mosidata,
-                                                    'W:%02X' % self.mosidata,'%02X' % self.mosidata]])
-                # Reg Header / Status
-                if ((self.reg_addr & 0x0fff) == 0x0000):
-                    # TPM_ACCESS
-                    if self.mosidata == 0x20:
-                        self.reg_access_sts = 'RELINUISH'
-                    elif self.mosidata == 0x10:
-                        self.reg_access_sts = 'CLEAR SEIZED'
-                    elif self.mosidata == 0x08:
-                        self.reg_access_sts = 'SEIZE'
-                    elif self.mosidata == 0x02:
-                        self.reg_access_sts = 'REQUEST'
-                    else:
-                        self.reg_access_sts = 'ERROR'
-
-                    self.put(self.mosibits[7][1],self.mosibits[7][2],self.out_ann,[23,['VALIDSTS:%d'%self.mosibits[7][0]]])
-                    self.put(self.mosibits[6][1],self.mosibits[6][2],self.out_ann,[24,['RESERVED:%d'%self.mosibits[6][0]]])
-                    self.put(self.mosibits[5][1],self.mosibits[5][2],self.out_ann,[23,['ACTIVELOCALITY:%d'%self.mosibits[5][0]]])
-                    self.put(self.mosibits[4][1],self.mosibits[4][2],self.out_ann,[24,['BEENSEIZED:%d'%self.mosibits[4][0]]])
-                    self.put(self.mosibits[3][1],self.mosibits[3][2],self.out_ann,[23,['SEIZE:%d'%self.mosibits[3][0]]])
-                    self.put(self.mosibits[2][1],self.mosibits[2][2],self.out_ann,[24,['PENDING:%d'%self.mosibits[2][0]]])
-                    self.put(self.mosibits[1][1],self.mosibits[1][2],self.out_ann,[23,['REQUESTUSE:%d'%self.mosibits[1][0]]])
-                    self.put(self.mosibits[0][1],self.mosibits[0][2],self.out_ann,[24,['ESTABLISHMENT:%d'%self.mosibits[0][0]]])
-
-                    #self.put(ss, es,self.out_ann,[23,['%s' % (self.reg_access_sts)]])
-
-                if ((self.reg_addr & 0x0fff) == 0x0018):
-                    # TPM_STATUS
-                    self.reg_tpmgo = self.mosibits[5][0]
-                    self.reg_commandready = self.mosibits[6][0]
-                    self.reg_responseretry = self.mosibits[2][0]
-
-                    if ((self.reg_tpmgo == 1) or (self.reg_commandready == 1)):
-                        self.cmd_response = 0
-                        self.cmd_command = 0
-
-                    self.put(self.mosibits[7][1],self.mosibits[7][2],self.out_ann,[23,['VALIDSTS:%d'%self.mosibits[7][0]]])
-                    self.put(self.mosibits[6][1],self.mosibits[6][2],self.out_ann,[24,['READY:%d'%self.mosibits[6][0]]])
-                    self.put(self.mosibits[5][1],self.mosibits[5][2],self.out_ann,[23,['TPMGO:%d'%self.mosibits[5][0]]])
-                    self.put(self.mosibits[4][1],self.mosibits[4][2],self.out_ann,[24,['DATAAVAIL:%d'%self.mosibits[4][0]]])
-                    self.put(self.mosibits[3][1],self.mosibits[3][2],self.out_ann,[23,['EXPECT:%d'%self.mosibits[3][0]]])
-                    self.put(self.mosibits[2][1],self.mosibits[2][2],self.out_ann,[24,['SELFTESTDONE:%d'%self.mosibits[2][0]]])
-                    self.put(self.mosibits[1][1],self.mosibits[1][2],self.out_ann,[23,['RESPRETRY:%d'%self.mosibits[1][0]]])
-                    self.put(self.mosibits[0][1],self.mosibits[0][2],self.out_ann,[24,['RESERVED:%d'%self.mosibits[0][0]]])
-
-                    #self.put(ss,es,self.out_ann,[23,['TPMGO:%d, CMDREADY:%d, RESPONSERETRY:%d' % (self.reg_tpmgo,self.reg_commandready,self.reg_responseretry)]])
+            self.cmd_response = 1
+            self.cmd_command = 0
+            self.cmd_rc = code
+            self.reg_tpmgo = 0
+            self.puta(self.cmd_sp,self.cmd_ep,[30,rc_texts(self.cmd_rc)])
+
+        self.cmd_expect = self.cmd_len - 10
+        # flag if there is not more expected bytes
+        if self.cmd_expect == 0:
+            self.cmd_done = 1
+        else:
+            self.cmd_done = 0
+
+        # The whole message is reassembled in place, its size is known now.
+        self.message = bytearray(max(self.cmd_len, tpm_header.size))
+        self.message[:tpm_header.size] = self.cmd_buf
+        self.message_pos = tpm_header.size
+        self.frame_cmd_sp = self.ss_transfer
+
+        self.puta(self.cmd_sp,self.cmd_ep,[25,['remaining : %d' % self.cmd_expect]])
+
+    # Command/response header handlers, by byte number within the header.
+    cmd_header_steps = (start_cmd_header, handle_cmd_tag, start_cmd_field, None, None,
+                        handle_cmd_len, start_cmd_field, None, None, handle_cmd_code)
+
+    def put_message(self):
+        # The command/response is complete: pass it to the next PD up the
+        # stack and annotate it as a whole.
+        payload = memoryview(self.message)[tpm_header.size:self.message_pos]
+        # Handles, sessions and parameters, parsed only once asked for.
+        parsed = None
+        if self.python_on or self.parse_parameter:
+            parsed = Tpm2Message(memoryview(self.message)[:self.message_pos],
+                                 self.frame_cmd_wr == 1, self.cmd_ord)
+        if self.python_on:
+            msg_tag, msg_size, msg_code = parse_tpm_header(self.message)
+            msg = {'tag': msg_tag, 'size': msg_size, 'code': msg_code,
+                   'payload': payload, 'parsed': parsed,
+                   'ss': self.frame_cmd_sp, 'es': self.frame_cmd_ep}
+            if self.frame_cmd_wr == 1:
+                self.put(self.frame_cmd_sp, self.frame_cmd_ep, self.out_python,
+                         ['TPM-COMMAND', msg, None])
             else:
-                self.put(ss,es,self.out_ann,[22,['READ:0x%02X' % self.misodata,'RD:0x%02X' % self.misodata,
-                                                    'R:%02X' % self.misodata,'%02X' % self.misodata]])
-                # Reg Header / Status
-                if ((self.reg_addr & 0x0fff) == 0x0000):
-                    # TPM_ACCESS
-                    reg_byte = es - ss
-                    reg_bit = int(reg_byte / 8)
-
-                    self.reg_tpmestablishment = self.misobits[0][0]
-                    self.reg_requestuse = self.misobits[1][0]
-                    self.reg_pendingrequest = self.misobits[2][0]
-                    self.reg_beenseized = self.misobits[4][0]
-                    self.reg_activelocality = self.misobits[5][0]
-                    self.reg_tpmregvalidsts = self.misobits[7][0]
-
-                    if self.reg_tpmregvalidsts == 1:
-                        self.reg_access_sts = 'NOT ACTIVE'
-                        if self.reg_activelocality == 1:
-                            self.reg_access_sts = 'ACTIVE'
-                        if self.reg_beenseized == 1:
-                            self.reg_access_sts = 'SEIZED'
-                        if self.reg_requestuse == 1:
-                            self.reg_access_sts = 'REQUEST'
-
-                        if self.reg_pendingrequest == 1:
-                            self.reg_access_sts1 = 'PENDING'
-
-                        self.put(self.misobits[7][1],self.misobits[7][2],self.out_ann,[23,['VALIDSTS:%d'%self.misobits[7][0]]])
-                        self.put(self.misobits[6][1],self.misobits[6][2],self.out_ann,[24,['RESERVED:%d'%self.misobits[6][0]]])
-                        self.put(self.misobits[5][1],self.misobits[5][2],self.out_ann,[23,['ACTIVELOCALITY:%d'%self.misobits[5][0]]])
-                        self.put(self.misobits[4][1],self.misobits[4][2],self.out_ann,[24,['BEENSEIZED:%d'%self.misobits[4][0]]])
-                        self.put(self.misobits[3][1],self.misobits[3][2],self.out_ann,[23,['SEIZE:%d'%self.misobits[3][0]]])
-                        self.put(self.misobits[2][1],self.misobits[2][2],self.out_ann,[24,['PENDING:%d'%self.misobits[2][0]]])
-                        self.put(self.misobits[1][1],self.misobits[1][2],self.out_ann,[23,['REQUESTUSE:%d'%self.misobits[1][0]]])
-                        self.put(self.misobits[0][1],self.misobits[0][2],self.out_ann,[24,['ESTABLISHMENT:%d'%self.misobits[0][0]]])
-                    else:
-                        self.put(self.misobits[7][1],self.misobits[7][2],self.out_ann,[25,['VALIDSTS:%d'%self.misobits[7][0]]])
-                        self.put(self.misobits[6][1],self.misobits[6][2],self.out_ann,[24,['RESERVED:%d'%self.misobits[6][0]]])
-                        self.put(self.misobits[5][1],self.misobits[5][2],self.out_ann,[23,['ACTIVELOCALITY:%d'%self.misobits[5][0]]])
-                        self.put(self.misobits[4][1],self.misobits[4][2],self.out_ann,[24,['BEENSEIZED:%d'%self.misobits[4][0]]])
-                        self.put(self.misobits[3][1],self.misobits[3][2],self.out_ann,[23,['SEIZE:%d'%self.misobits[3][0]]])
-                        self.put(self.misobits[2][1],self.misobits[2][2],self.out_ann,[24,['PENDING:%d'%self.misobits[2][0]]])
-                        self.put(self.misobits[1][1],self.misobits[1][2],self.out_ann,[23,['REQUESTUSE:%d'%self.misobits[1][0]]])
-                        self.put(self.misobits[0][1],self.misobits[0][2],self.out_ann,[24,['ESTABLISHMENT:%d'%self.misobits[0][0]]])
-
-                if ((self.reg_addr & 0x0fff) == 0x0018):
-                    # TPM_STATUS
-                    if (self.bytecount == 4):
-                        self.reg_selftest = self.misobits[2][0]
-                        self.reg_commandready = self.misobits[6][0]
-                        self.reg_valid = self.misobits[7][0]
-                        if (self.reg_valid != 0x00):
-                            self.reg_data_avail = self.misobits[4][0]
-                            self.reg_expect = self.misobits[3][0]
-
-                            self.put(self.misobits[7][1],self.misobits[7][2],self.out_ann,[23,['VALIDSTS:%d'%self.misobits[7][0]]])
-                            self.put(self.misobits[6][1],self.misobits[6][2],self.out_ann,[24,['READY:%d'%self.misobits[6][0]]])
-                            self.put(self.misobits[5][1],self.misobits[5][2],self.out_ann,[23,['TPMGO:%d'%self.misobits[5][0]]])
-                            self.put(self.misobits[4][1],self.misobits[4][2],self.out_ann,[24,['DATAAVAIL:%d'%self.misobits[4][0]]])
-                            self.put(self.misobits[3][1],self.misobits[3][2],self.out_ann,[23,['EXPECT:%d'%self.misobits[3][0]]])
-                            self.put(self.misobits[2][1],self.misobits[2][2],self.out_ann,[24,['SELFTESTDONE:%d'%self.misobits[2][0]]])
-                            self.put(self.misobits[1][1],self.misobits[1][2],self.out_ann,[23,['RESPRETRY:%d'%self.misobits[1][0]]])
-                            self.put(self.misobits[0][1],self.misobits[0][2],self.out_ann,[24,['RESERVED:%d'%self.misobits[0][0]]])
-                        else:
-                            self.reg_data_avail = -1
-                            self.reg_expect = -1
-
-                            self.put(self.misobits[7][1],self.misobits[7][2],self.out_ann,[25,['VALIDSTS:%d'%self.misobits[7][0]]])
-                            self.put(self.misobits[6][1],self.misobits[6][2],self.out_ann,[24,['READY:%d'%self.misobits[6][0]]])
-                            self.put(self.misobits[5][1],self.misobits[5][2],self.out_ann,[23,['TPMGO:%d'%self.misobits[5][0]]])
-                            self.put(self.misobits[4][1],self.misobits[4][2],self.out_ann,[25,['DATAAVAIL:%d'%self.misobits[4][0]]])
-                            self.put(self.misobits[3][1],self.misobits[3][2],self.out_ann,[25,['EXPECT:%d'%self.misobits[3][0]]])
-                            self.put(self.misobits[2][1],self.misobits[2][2],self.out_ann,[24,['SELFTESTDONE:%d'%self.misobits[2][0]]])
-                            self.put(self.misobits[1][1],self.misobits[1][2],self.out_ann,[23,['RESPRETRY:%d'%self.misobits[1][0]]])
-                            self.put(self.misobits[0][1],self.misobits[0][2],self.out_ann,[24,['RESERVED:%d'%self.misobits[0][0]]])
-
-                    elif (self.bytecount == 5):
-                        self.reg_sp = ss
-                        self.reg_burstcnt = self.misodata
-                    elif (self.bytecount == 6):
-                        self.reg_ep = es
-                        self.reg_burstcnt += (self.misodata << 8)
-                        if self.reg_data_avail == 1:
-                            self.cmd_burst = self.reg_burstcnt
-                        self.put(self.reg_sp,self.reg_ep,self.out_ann,[23,['BURSTCOUNT:%d' % self.reg_burstcnt,
-                                                    'BC:%d' % self.reg_burstcnt,'%d' % self.reg_burstcnt]])
-
-            # Command annotation
-            if self.cmd == 1:
-                if (self.cmd_command == 0) and (self.cmd_response == 0):
-                    # tag
-                    if self.cmd_count == 0:
-                        self.cmd_sp = ss
-                        if self.reg_wr == 1:
-                            self.frame_cmd_wr = 1
-                            self.cmd_tag = (self.mosidata << 8)
-                        else:
-                            self.frame_cmd_wr = 0
-                            self.cmd_tag = (self.misodata << 8)
-                    elif self.cmd_count == 1:
-                        self.cmd_ep = es
-                        if self.reg_wr == 1:
-                            self.cmd_tag += (self.mosidata)
-                        else:
-                            self.cmd_tag += (self.misodata)
-                        try:
-                            self.put(self.cmd_sp,self.cmd_ep,self.out_ann,[tag[self.cmd_tag][0],['%s' % tag[self.cmd_tag][1],
-                                                '%s' % tag[self.cmd_tag][2],'%s' % tag[self.cmd_tag][3]]])
-                        except:
-                            self.put(self.cmd_sp,self.cmd_ep,self.out_ann,[49, ['PROTOCOL ERROR','ERROR','ERR','E']])
-                    # length
-                    elif self.cmd_count == 2:
-                        self.cmd_sp = ss
-                        if self.reg_wr == 1:
-                            self.cmd_len = (self.mosidata << 24)
-                        else:
-                            self.cmd_len = (self.misodata << 24)
-                    elif self.cmd_count == 3:
-                        if self.reg_wr == 1:
-                            self.cmd_len += (self.mosidata << 16)
-                        else:
-                            self.cmd_len += (self.misodata << 16)
-                    elif self.cmd_count == 4:
-                        if self.reg_wr == 1:
-                            self.cmd_len += (self.mosidata << 8)
-                        else:
-                            self.cmd_len += (self.misodata << 8)
-                    elif self.cmd_count == 5:
-                        self.cmd_ep = es
-                        if self.reg_wr == 1:
-                            self.cmd_len += (self.mosidata)
-                        else:
-                            self.cmd_len += (self.misodata)
-                        self.put(self.cmd_sp,self.cmd_ep,self.out_ann,[27,['LENGTH:%d' % self.cmd_len,
-                                            'LEN:%d' % self.cmd_len,'%d' % self.cmd_len]])
-                    # Command Code
-                    elif self.cmd_count == 6:
-                        self.cmd_sp = ss
-                        if self.reg_wr == 1:
-                            self.cmd_ord = (self.mosidata << 24)
-                        else:
-                            self.cmd_rc = (self.misodata << 24)
-                    elif self.cmd_count == 7:
-                        if self.reg_wr == 1:
-                            self.cmd_ord += (self.mosidata << 16)
-                        else:
-                            self.cmd_rc += (self.misodata << 16)
-                    elif self.cmd_count == 8:
-                        if self.reg_wr == 1:
-                            self.cmd_ord += (self.mosidata << 8)
-                        else:
-                            self.cmd_rc += (self.misodata << 8)
-                    elif self.cmd_count == 9:
-                        self.cmd_ep = es
-                        if self.reg_wr == 1:
-                            self.cmd_command = 1
-                            self.cmd_response = 0
-
-                            self.cmd_ord += (self.mosidata)
-                            if (self.cmd_ord & 0x2000) == 0:
-                                # TCG Command
-                                try:
-                                    self.put(self.cmd_sp,self.cmd_ep,self.out_ann,[cmdcode[self.cmd_ord][0],['%s' % cmdcode[self.cmd_ord][1]]])
-                                except:
-                                    self.put(self.cmd_sp,self.cmd_ep,self.out_ann,[49, ['PROTOCOL ERROR','ERROR','ERR','E']])
-                            else:
-                                # Vendor Specific Command
-                                self.put(self.cmd_sp,self.cmd_ep,self.out_ann,[28,['VENDOR SPECIFIC CMD : 0x%08X' % self.cmd_ord,
-                                                    'VENDOR:0x%08X' % self.cmd_ord,'V:%08X' % self.cmd_ord,'%08X' % self.cmd_ord]])
-                        else:
-                            self.cmd_response = 1
-                            self.cmd_command = 0
-                            self.cmd_rc += (self.misodata)
-                            self.reg_tpmgo = 0
-                            self.put(self.cmd_sp,self.cmd_ep,self.out_ann,[30,['RC : 0x%08X' % self.cmd_rc]])
-
-                        self.cmd_expect = self.cmd_len - 10
-                        # flag if there is not more expected bytes
-                        if self.cmd_expect == 0:
-                            self.cmd_done = 1
-                        else:
-                            self.cmd_done = 0
-
-                        self.put(self.cmd_sp,self.cmd_ep,self.out_ann,[25,['remaining : %d' % self.cmd_expect]])
-
+                msg['rc'] = decode_rc(msg_code)
+                self.put(self.frame_cmd_sp, self.frame_cmd_ep, self.out_python,
+                         ['TPM-RESPONSE', None, msg])
+
+        frame_total_sample = self.frame_cmd_ep - self.frame_cmd_sp
+        frame_byte = int(frame_total_sample / self.message_pos)
+
+        # Frame Tag
+        ss, es = self.frame_cmd_sp, self.frame_cmd_sp + (frame_byte * 2)
+        ann = self.registry.frame_tag(self.cmd_tag)
+        if ann:
+            self.puta(ss, es, ann)
+        else:
+            self.puta(ss,es,frame_cmd_error_ann)
+        # Frame Length
+        ss, es = es, self.frame_cmd_sp + (frame_byte * 6)
+        self.puta(ss, es,[39, ['LENGTH:%d' % self.cmd_len,
+                    'LEN:%d' % self.cmd_len,'%d' % self.cmd_len]])
+        # Frame Command/Response
+        ss, es = es, self.frame_cmd_sp + (frame_byte * 10)
+        if self.frame_cmd_wr == 1:
+            if (self.cmd_ord & 0x2000) == 0:
+                # TCG Command
+                ann = self.registry.frame_cmd(self.cmd_ord)
+                if ann:
+                    self.puta(ss, es, ann)
                 else:
-                    if self.cmd_command == 1:
-                        self.put(ss,es,self.out_ann,[29,['WRITE:0x%02X' % self.mosidata,'WR:0x%02X' % self.mosidata,
-                                                    'W:%02X' % self.mosidata,'%02X' % self.mosidata]])
-                    else:
-                        self.put(ss,es,self.out_ann,[30,['READ:0x%02X' % self.misodata,'RD:0x%02X' % self.misodata,
-                                                    'R:%02X' % self.misodata,'%02X' % self.misodata]])
-                    self.cmd_expect -= 1
-                    if self.cmd_expect == 0:
-                        self.cmd_response = 0
-                        self.cmd_command = 0
-                        self.cmd_done = 0
-                self.cmd_count += 1
-        self.bytecount += 1
+                    self.puta(ss,es,frame_cmd_error_ann)
+            else:
+                # Vendor Specific Command
+                self.puta(ss,es,[40,['VENDOR SPECIFIC CMD : 0x%08X' % self.cmd_ord,
+                                    'VENDOR:0x%08X' % self.cmd_ord,'V:%08X' % self.cmd_ord,'%08X' % self.cmd_ord]])
+        else:
+            self.puta(ss,es,[42,rc_texts(self.cmd_rc)])
+        # Frame rest of data
+        if es != self.frame_cmd_ep:
+            ss, es = es, self.frame_cmd_ep
+            payload_hex = hex_text(payload)
+            if self.frame_cmd_wr == 1:
+                self.puta(ss, es,[41, [payload_hex]])
+            else:
+                self.puta(ss, es,[42, [payload_hex]])
+
+        if self.parse_parameter:
+            self.put_parameters(parsed, frame_byte)
+
+    def put_parameters(self, parsed, frame_byte):
+        # Parsed fields, spread over the message like the frame fields.
+        param_class = 57 if parsed.command else 58
+        for f in parsed.fields:
+            ss = self.frame_cmd_sp + (frame_byte * f.offset)
+            es = min(ss + (frame_byte * max(f.size, 1)), self.frame_cmd_ep)
+            if f.name == 'error':
+                self.puta(ss, es, [59, ['PARSE ERROR: %s' % f.value, 'PARSE ERROR', 'ERR', 'E']])
+            elif f.area == 'handle':
+                self.puta(ss, es, [55, ['%s: %s' % (f.name, f.value), f.value]])
+            elif f.area == 'session':
+                self.puta(ss, es, [56, ['%s: %s' % (f.name, f.value), f.name]])
+            else:
+                self.puta(ss, es, [param_class, ['%s: %s' % (f.name, f.value), f.name]])
 
     def reset_decoder_state(self):
         self.misodata = 0
         self.mosidata = 0
-        self.misobits = []
-        self.mosibits = []
         self.bitcount = 0
 
+    def reset_register_state(self):
+        # Reset when not CS#
+        self.bytecount = 0
+        self.reg_locality = 0
+        self.reg_addr = 0
+        self.cmd = 0
+        self.cmd_count = 0
+        self.cmd_buf = bytearray(tpm_header.size)
+
+    def bit_list(self, data):
+        # [bit, ss, es] per bit of the current dataword, as for 'BITS'.
+        # Index 0 represents the LSB (SPI transmits MSB-first).
+        bit_ss, bit_es = self.bit_ss, self.bit_es
+        return [[(data >> i) & 1, bit_ss[7 - i], bit_es[7 - i]] for i in range(8)]
+
     def cs_asserted(self, cs):
         active_low = (self.options['cs_polarity'] == 'active-low')
         return (cs == 0) if active_low else (cs == 1)
@@ -804,18 +886,15 @@ class Decoder(srd.Decoder):
         # Receive MOSI bit into our shift register.
         self.mosidata |= mosi << (ws - 1 - self.bitcount)
 
-        # Guesstimate the endsample for this bit (can be overridden below).
+        # Guesstimate the endsample for this bit (can be overridden by the
+        # next bit).
+        n = self.bitcount
         es = self.samplenum
-        if self.bitcount > 0:
-            es += self.samplenum - self.misobits[0][1]
-
-        self.misobits.insert(0, [miso, self.samplenum, es])
-        self.mosibits.insert(0, [mosi, self.samplenum, es])
-
-        if self.bitcount > 0:
-            self.misobits[1][2] = self.samplenum
-        if self.bitcount > 0:
-            self.mosibits[1][2] = self.samplenum
+        if n > 0:
+            es += self.samplenum - self.bit_ss[n - 1]
+            self.bit_es[n - 1] = self.samplenum
+        self.bit_ss[n] = self.samplenum
+        self.bit_es[n] = es
 
         self.bitcount += 1
 
@@ -823,10 +902,15 @@ class Decoder(srd.Decoder):
         if self.bitcount != ws:
             return
 
+        self.handle_byte(frame)
+
+    def handle_byte(self, frame):
+        ws = 8
+
         self.putdata(frame)
 
         # Meta bitrate.
-        if self.samplerate:
+        if self.samplerate and self.bitrate_on:
             elapsed = 1 / float(self.samplerate)
             elapsed *= (self.samplenum - self.ss_block + 1)
             bitrate = int(1 / elapsed * ws)
@@ -834,29 +918,33 @@ class Decoder(srd.Decoder):
 
         if self.have_cs and self.cs_was_deasserted:
             self.putw([4, ['CS# was deasserted during this data word!']])
+            self.protocol_error('CS# deasserted mid-word', self.ss_block, self.samplenum)
 
         self.reset_decoder_state()
 
-    def find_clk_edge(self, miso, mosi, clk, cs, first, frame):
-        if self.have_cs and (first or (self.matched & (0b1 << self.have_cs))):
-            # Send all CS# pin value changes.
+    def handle_cs(self, cs, first, frame):
+        # Send all CS# pin value changes.
+        if self.python_on:
             oldcs = None if first else 1 - cs
             self.put(self.samplenum, self.samplenum, self.out_python,
                      ['CS-CHANGE', oldcs, cs])
 
-            if frame:
-                if self.cs_asserted(cs):
-                    self.ss_transfer = self.samplenum
-                    self.misobytes = []
-                    self.mosibytes = []
-                elif self.ss_transfer != -1:
+        if frame:
+            if self.cs_asserted(cs):
+                self.ss_transfer = self.samplenum
+                self.xfer = Transfer()
+            elif self.ss_transfer != -1:
+                if self.transfer_on:
                     self.put(self.ss_transfer, self.samplenum, self.out_ann,
-                        [5, [' '.join(format(x.val, '02X') for x in self.misobytes)]])
+                        [5, [hex_text(self.xfer.miso)]])
                     self.put(self.ss_transfer, self.samplenum, self.out_ann,
-                        [6, [' '.join(format(x.val, '02X') for x in self.mosibytes)]])
+                        [6, [hex_text(self.xfer.mosi)]])
+                if self.python_on:
                     self.put(self.ss_transfer, self.samplenum, self.out_python,
-                        ['TRANSFER', self.mosibytes, self.misobytes])
+                        ['TRANSFER', DataView(self.xfer, self.xfer.mosi),
+                         DataView(self.xfer, self.xfer.miso)])
 
+                if self.parse_frame:
                     # Frame Register
                     self.frame_sp = self.ss_transfer
                     self.frame_ep = self.samplenum
@@ -867,36 +955,36 @@ class Decoder(srd.Decoder):
                     # First Byte
                     ss, es = self.frame_sp, self.frame_sp + (frame_byte * 1)
                     if self.reg_wr == 1:
-                        self.put(ss, es,self.out_ann,[31,['WRITE:%d' % self.sizeofxfer,
+                        self.puta(ss, es,[31,['WRITE:%d' % self.sizeofxfer,
                                     'WR:%d' % self.sizeofxfer, 'W:%d' % self.sizeofxfer]])
                     else:
-                        self.put(ss, es,self.out_ann,[32,['READ:%d' % self.sizeofxfer,
+                        self.puta(ss, es,[32,['READ:%d' % self.sizeofxfer,
                                     'RD:%d' % self.sizeofxfer, 'R:%d' % self.sizeofxfer]])
                     # Register Name
                     ss, es = es, self.frame_sp + (frame_byte * 3)
-                    try:
-                        self.put(ss,es,self.out_ann,[33,['%s' % reg[self.reg_addr][1],
-                                                                '%s' % reg[self.reg_addr][2],'%s' % reg[self.reg_addr][3]]])
-                    except:
-                        self.put(ss,es,self.out_ann,[54, ['PROTOCOL ERROR','ERROR','ERR','E']])
+                    ann = self.registry.frame_reg(self.reg_addr)
+                    if ann:
+                        self.puta(ss, es, ann)
+                    else:
+                        self.puta(ss,es,frame_reg_error_ann)
                     # Ack
                     ss, es = es, self.frame_sp + (frame_byte * 4)
-                    if self.misobytes[3][2] == 1:
-                        self.put(ss,es,self.out_ann,[34,['ACK','AK','A']])
+                    if self.xfer.miso[3] == 1:
+                        self.puta(ss,es,[34,['ACK','AK','A']])
                     else:
-                        self.put(ss,es,self.out_ann,[35,['NACK','NK','N']])
+                        self.puta(ss,es,[35,['NACK','NK','N']])
 
                     # Data
                     ss, es = es, self.frame_ep
                     frame_reg_total_sample = es - ss
                     if self.reg_wr == 1:
-                        self.frame_reg_bytes = self.mosibytes[4:]
+                        self.frame_reg_bytes = memoryview(self.xfer.mosi)[4:]
                         frame_reg_byte = int(frame_reg_total_sample / len(self.frame_reg_bytes))
-                        self.put(ss, es, self.out_ann,[36, [' '.join(format(x.val, '02X') for x in self.frame_reg_bytes)]])
+                        self.puta(ss, es,[36, [hex_text(self.frame_reg_bytes)]])
                     else:
-                        self.frame_reg_bytes = self.misobytes[4:]
+                        self.frame_reg_bytes = memoryview(self.xfer.miso)[4:]
                         frame_reg_byte = int(frame_reg_total_sample / len(self.frame_reg_bytes))
-                        self.put(ss, es, self.out_ann,[37, [' '.join(format(x.val, '02X') for x in self.frame_reg_bytes)]])
+                        self.puta(ss, es,[37, [hex_text(self.frame_reg_bytes)]])
 
 
                     # Frame Reg Header / Status
@@ -907,20 +995,20 @@ class Decoder(srd.Decoder):
                         if self.reg_wr == 1:
                             if ((self.reg_access_sts == 'RELINUISH') or (self.reg_access_sts == 'CLEAR SEIZED') or
                                     (self.reg_access_sts == 'SEIZE') or (self.reg_access_sts == 'REQUEST')):
-                                self.put(self.frame_sp, self.frame_ep,self.out_ann,[48,['%s' % (self.reg_access_sts)]])
+                                self.puta(self.frame_sp, self.frame_ep,[48,['%s' % (self.reg_access_sts)]])
                             else:
-                                self.put(self.frame_sp, self.frame_ep,self.out_ann,[45,['%s' % (self.reg_access_sts)]])
+                                self.puta(self.frame_sp, self.frame_ep,[45,['%s' % (self.reg_access_sts)]])
                         else:
                             if self.reg_tpmregvalidsts == 1:
                                 if ((self.reg_access_sts == 'NOT ACTIVE') or (self.reg_access_sts == 'SEIZED') or
                                         (self.reg_access_sts == 'REQUEST') or (self.reg_access_sts1 == 'PENDING')):
-                                    self.put(self.frame_sp, self.frame_sp + (reg_bit*7),self.out_ann,[45,['%s %s' % (self.reg_access_sts,self.reg_access_sts1)]])
+                                    self.puta(self.frame_sp, self.frame_sp + (reg_bit*7),[45,['%s %s' % (self.reg_access_sts,self.reg_access_sts1)]])
                                 else:
-                                    self.put(self.frame_sp, self.frame_sp + (reg_bit*7),self.out_ann,[43,['%s %s' % (self.reg_access_sts,self.reg_access_sts1)]])
-                                self.put(self.frame_sp + (reg_bit*7), self.frame_ep,self.out_ann,[44,['ESTABLISHMENT:%d' % (self.reg_tpmestablishment),
+                                    self.puta(self.frame_sp, self.frame_sp + (reg_bit*7),[43,['%s %s' % (self.reg_access_sts,self.reg_access_sts1)]])
+                                self.puta(self.frame_sp + (reg_bit*7), self.frame_ep,[44,['ESTABLISHMENT:%d' % (self.reg_tpmestablishment),
                                                         'EST:%d' % (self.reg_tpmestablishment),'%d' % (self.reg_tpmestablishment)]])
                             else:
-                                self.put(self.frame_sp, self.frame_ep,self.out_ann,[45,['INVALID FLAG']])
+                                self.puta(self.frame_sp, self.frame_ep,[45,['INVALID FLAG']])
 
                     ss, es = self.frame_sp, self.frame_sp + (frame_reg_byte * 1)
                     if ((self.reg_addr & 0x0fff) == 0x0018):
@@ -928,123 +1016,59 @@ class Decoder(srd.Decoder):
                         if self.reg_wr == 1:
                             if (self.reg_tpmgo + self.reg_commandready + self.reg_responseretry) == 1:
                                 if self.reg_tpmgo == 1:
-                                    self.put(ss,self.frame_ep,self.out_ann,[46,['TPMGO','GO']])
+                                    self.puta(ss,self.frame_ep,[46,['TPMGO','GO']])
                                 elif self.reg_commandready == 1:
-                                    self.put(ss,self.frame_ep,self.out_ann,[47,['COMMAND ABORT','ABORT','AB']])
+                                    self.puta(ss,self.frame_ep,[47,['COMMAND ABORT','ABORT','AB']])
                                 else:
-                                    self.put(ss,self.frame_ep,self.out_ann,[47,['RESPONSE RETRY','RETRY','RT']])
+                                    self.puta(ss,self.frame_ep,[47,['RESPONSE RETRY','RETRY','RT']])
                             else:
-                                self.put(ss,self.frame_ep,self.out_ann,[45,['ERROR : %d%d%d' % (self.reg_tpmgo,self.reg_commandready,self.reg_responseretry)]])
+                                self.puta(ss,self.frame_ep,[45,['ERROR : %d%d%d' % (self.reg_tpmgo,self.reg_commandready,self.reg_responseretry)]])
                         else:
                             es = (ss + (frame_reg_byte * 2))
                             if (self.reg_valid != 0x00):
                                 if self.reg_data_avail == 1:
-                                    self.put(ss,es,self.out_ann,[43,['DATA AVAILABLE','DATA','DA']])
+                                    self.puta(ss,es,[43,['DATA AVAILABLE','DATA','DA']])
                                 elif self.reg_expect == 1:
-                                    self.put(ss,es,self.out_ann,[43,['EXPECT COMMAND','EXPECT','EP']])
+                                    self.puta(ss,es,[43,['EXPECT COMMAND','EXPECT','EP']])
                                 else:
-                                    self.put(ss,es,self.out_ann,[43,['NONE','NN']])
+                                    self.puta(ss,es,[43,['NONE','NN']])
                             else:
-                                self.put(ss,es,self.out_ann,[45,['INVALID DATA_AVAIL/EXPECT FLAG','IVD AVA/EXP']])
+                                self.puta(ss,es,[45,['INVALID DATA_AVAIL/EXPECT FLAG','IVD AVA/EXP']])
 
                             ss = es
                             es = (ss + (frame_reg_byte * 1))
-                            self.put(ss,es,self.out_ann,[43,['SELFTESTDONE:%d'%self.reg_selftest,'STEST:%d'%self.reg_selftest,
+                            self.puta(ss,es,[43,['SELFTESTDONE:%d'%self.reg_selftest,'STEST:%d'%self.reg_selftest,
                                                                 'ST:%d'%self.reg_selftest]])
                             ss = es
                             es = (ss + (frame_reg_byte * 2))
                             if self.reg_commandready == 1:
-                                self.put(ss,es,self.out_ann,[43,['COMMAND READY','READY','RY']])
+                                self.puta(ss,es,[43,['COMMAND READY','READY','RY']])
                             else:
-                                self.put(ss,es,self.out_ann,[45,['COMMAND BUSY','BUSY','BZ']])
+                                self.puta(ss,es,[45,['COMMAND BUSY','BUSY','BZ']])
 
                             if len(self.frame_reg_bytes) > 1:
                                 ss = es
                                 es = self.frame_ep
-                                self.put(ss,es,self.out_ann,[43,['BURSTCOUNT:%d' % self.reg_burstcnt,
+                                self.puta(ss,es,[43,['BURSTCOUNT:%d' % self.reg_burstcnt,
                                                             'BC:%d' % self.reg_burstcnt,'%d' % self.reg_burstcnt]])
 
                     # Frame Command
-                    if self.cmd == 1:
-                        if self.cmd_done == 0:
-                            if (self.cmd_expect == 0):
-                                self.frame_cmd_ep = self.samplenum
-                                self.cmd_done = 2
-                                if self.frame_cmd_wr == 1:
-                                    self.frame_bytes.extend(self.mosibytes[4:])
-                                else:
-                                    self.frame_bytes.extend(self.misobytes[4:])
-                                self.frame_cmd_first = 0
-                            elif self.frame_cmd_first == 1:
-                                if self.frame_cmd_wr == 1:
-                                    self.frame_bytes.extend(self.mosibytes[4:])
-                                else:
-                                    self.frame_bytes.extend(self.misobytes[4:])
-                            else:
-                                self.frame_cmd_sp = self.ss_transfer
-                                if self.frame_cmd_wr == 1:
-                                    self.frame_bytes = self.mosibytes[4:]
-                                else:
-                                    self.frame_bytes = self.misobytes[4:]
-                                self.frame_cmd_first = 1
-                        elif self.cmd_done == 1:
-                                self.frame_cmd_sp = self.ss_transfer
-                                self.frame_cmd_ep = self.samplenum
-                                self.cmd_done = 2
-                                if self.frame_cmd_wr == 1:
-                                    self.frame_bytes = self.mosibytes[4:]
-                                else:
-                                    self.frame_bytes = self.misobytes[4:]
-
-                        if self.cmd_done == 2:
-                            frame_total_sample = self.frame_cmd_ep - self.frame_cmd_sp
-                            frame_byte = int(frame_total_sample / len(self.frame_bytes))
-
-                            # Frame Tag
-                            ss, es = self.frame_cmd_sp, self.frame_cmd_sp + (frame_byte * 2)
-                            try:
-                                self.put(ss, es, self.out_ann,[38, ['%s' % tag[self.cmd_tag][1],
-                                           '%s' % tag[self.cmd_tag][2],'%s' % tag[self.cmd_tag][3]]])
-                            except:
-                                self.put(ss,es,self.out_ann,[52, ['PROTOCOL ERROR','ERROR','ERR','E']])
-                            # Frame Length
-                            ss, es = es, self.frame_cmd_sp + (frame_byte * 6)
-                            self.put(ss, es, self.out_ann,[39, ['LENGTH:%d' % self.cmd_len,
-                                        'LEN:%d' % self.cmd_len,'%d' % self.cmd_len]])
-                            # Frame Command/Response
-                            ss, es = es, self.frame_cmd_sp + (frame_byte * 10)
-                            if self.frame_cmd_wr == 1:
-                                if (self.cmd_ord & 0x2000) == 0:
-                                    # TCG Command
-                                    try:
-                                        self.put(ss,es,self.out_ann,[40,['%s' % cmdcode[self.cmd_ord][1]]])
-                                    except:
-                                        self.put(ss,es,self.out_ann,[52, ['PROTOCOL ERROR','ERROR','ERR','E']])
-                                else:
-                                    # Vendor Specific Command
-                                    self.put(ss,es,self.out_ann,[40,['VENDOR SPECIFIC CMD : 0x%08X' % self.cmd_ord,
-                                                        'VENDOR:0x%08X' % self.cmd_ord,'V:%08X' % self.cmd_ord,'%08X' % self.cmd_ord]])
-                            else:
-                                self.put(ss,es,self.out_ann,[42,['RC : 0x%08X' % self.cmd_rc]])
-                            # Frame rest of data
-                            if es != self.frame_cmd_ep:
-                                ss, es = es, self.frame_cmd_ep
-                                if self.frame_cmd_wr == 1:
-                                    self.put(ss, es, self.out_ann,[41, [' '.join(format(x.val, '02X') for x in self.frame_bytes[10:])]])
-                                else:
-                                    self.put(ss, es, self.out_ann,[42, [' '.join(format(x.val, '02X') for x in self.frame_bytes[10:])]])
+                    if self.cmd == 1 and self.cmd_done == 1:
+                        self.frame_cmd_ep = self.samplenum
+                        self.cmd_done = 2
+                        self.put_message()
+
 
-            # Reset decoder state when CS# changes (and the CS# pin is used).
-            self.reset_decoder_state()
+        # Reset decoder state when CS# changes (and the CS# pin is used).
+        self.reset_decoder_state()
+
+    def find_clk_edge(self, miso, mosi, clk, cs, first, frame):
+        if self.have_cs and (first or (self.matched & (0b1 << self.have_cs))):
+            self.handle_cs(cs, first, frame)
 
         # We only care about samples if CS# is asserted.
         if self.have_cs and not self.cs_asserted(cs):
-            # Reset when not CS#
-            self.bytecount = 0
-            self.reg_locality = 0
-            self.reg_addr = 0
-            self.cmd = 0
-            self.cmd_count = 0
+            self.reset_register_state()
             return
 
         # Ignore sample if the clock pin hasn't changed.
@@ -1056,7 +1080,7 @@ class Decoder(srd.Decoder):
 
     def decode(self):
         self.have_cs = self.has_channel(3)
-        if not self.have_cs:
+        if not self.have_cs and self.python_on:
             self.put(0, 0, self.out_python, ['CS-CHANGE', None, None])
 
         frame = 'no'
@@ -1070,6 +1094,10 @@ class Decoder(srd.Decoder):
         if self.have_cs:
             self.have_cs = len(wait_cond)
             wait_cond.append({3: 'e'})
+            # While CS# is deasserted only its (asserting) edge is of
+            # interest, plus a CLK edge on that very sample. All other
+            # CLK edges are skipped without waking up the decoder.
+            idle_cond = [{0: 'r', 3: 'e'}, {3: 'e'}]
 
         # "Pixel compatibility" with the v2 implementation. Grab and
         # process the very first sample before checking for edges. The
@@ -1078,6 +1106,51 @@ class Decoder(srd.Decoder):
         (clk, miso, mosi, cs) = self.wait({})
         self.find_clk_edge(miso, mosi, clk, cs, True, frame)
 
-        while True:
-            (clk, miso, mosi, cs) = self.wait(wait_cond)
-            self.find_clk_edge(miso, mosi, clk, cs, False, frame)
+        try:
+            while True:
+                if self.have_cs and not self.cs_asserted(cs):
+                    (clk, miso, mosi, cs) = self.wait(idle_cond)
+                else:
+                    (clk, miso, mosi, cs) = self.wait(wait_cond)
+                self.find_clk_edge(miso, mosi, clk, cs, False, frame)
+        except EOFError:
+            # No more samples.
+            self.finish()
+
+    def handle_bulk_cs(self, samplenum, cs, first, frame):
+        self.samplenum = samplenum
+        self.handle_cs(cs, first, frame)
+        if not self.cs_asserted(cs):
+            self.reset_register_state()
+
+    def handle_bulk_byte(self, miso, mosi, samples, frame):
+        # Same bits and guesstimated endsamples as handle_bit() produces.
+        es = samples[1:]
+        es.append(samples[7] + (samples[7] - samples[6]))
+        self.bit_ss[:] = samples
+        self.bit_es[:] = es
+        self.misodata, self.mosidata = miso, mosi
+        self.ss_block, self.samplenum = samples[0], samples[7]
+        self.cs_was_deasserted = False
+        self.bitcount = 8
+        self.handle_byte(frame)
+
+    def decode_chunk(self, clk, miso, mosi, cs=None):
+        # Alternative to decode() for hosts which have the samples at hand:
+        # feed consecutive chunks of CLK/MISO/MOSI(/CS#) sample arrays and
+        # the bits are gathered and packed per chunk with NumPy, so only
+        # whole bytes reach putdata(). Annotations and outputs are the same
+        # as with decode().
+        if self.deserializer is None:
+            from .bulk import SpiDeserializer
+            frame = 'no'
+            self.have_cs = cs is not None
+            if not self.have_cs and self.python_on:
+                self.put(0, 0, self.out_python, ['CS-CHANGE', None, None])
+            cs_active = None
+            if self.have_cs:
+                cs_active = 0 if self.options['cs_polarity'] == 'active-low' else 1
+            self.deserializer = SpiDeserializer(cs_active,
+                lambda samplenum, cs, first: self.handle_bulk_cs(samplenum, cs, first, frame),
+                lambda miso, mosi, samples: self.handle_bulk_byte(miso, mosi, samples, frame))
+        self.deserializer.feed(clk, miso, mosi, cs)
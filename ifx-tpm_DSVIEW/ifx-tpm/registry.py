@@ -0,0 +1,163 @@
+##
+## This file is part of the libsigrokdecode project.
+##
+## This program is free software; you can redistribute it and/or modify
+## it under the terms of the GNU General Public License as published by
+## the Free Software Foundation; either version 2 of the License, or
+## (at your option) any later version.
+##
+## This program is distributed in the hope that it will be useful,
+## but WITHOUT ANY WARRANTY; without even the implied warranty of
+## MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+## GNU General Public License for more details.
+##
+## You should have received a copy of the GNU General Public License
+## along with this program; if not, see <http://www.gnu.org/licenses/>.
+##
+
+'''
+TPM constant registry: command codes, structure tags and registers.
+
+The constants are kept as compact templates. load() expands them into the
+annotation payloads the decoder puts, the first time it is called, and
+every decoder instance shares the result:
+
+ - command codes: a tuple indexed by code - CC_FIRST,
+ - structure tags: a small table sorted by tag, searched by bisection,
+ - registers: the registers of one locality, repeated for each locality
+   with the annotation class of that locality.
+
+The payloads are never modified, so the same list can be put() repeatedly.
+'''
+
+from bisect import bisect_left
+from functools import lru_cache
+
+# TCG command codes (TPM_CC_*), from CC_FIRST on; None for unassigned codes.
+CC_FIRST = 0x11F
+cc_names = (
+    'NV_UNDEFINESPACESPECIAL', 'EVICTCONTROL', 'HIERARCHYCONTROL',
+    'NV_UNDEFINESPACE', None, 'CHANGEEPS', 'CHANGEPPS', 'CLEAR',
+    'CLEARCONTROL', 'CLOCKSET', 'HIERARCHYCHANGEAUTH', 'NV_DEFINESPACE',
+    'PCR_ALLOCATE', 'PCR_SETAUTHPOLICY', 'PP_COMMANDS', 'SETPRIMARYPOLICY',
+    'FIELDUPGRADESTART', 'CLOCKRATEADJUST', 'CREATEPRIMARY',
+    'NV_GLOBALWRITELOCK', 'GETCOMMANDAUDITDIGEST', 'NV_INCREMENT',
+    'NV_SETBITS', 'NV_EXTEND', 'NV_WRITE', 'NV_WRITELOCK',
+    'DICTIONARYATTACKLOCKRESET', 'DICTIONARYATTACKPARAMETERS', 'NV_CHANGEAUTH',
+    'PCR_EVENT', 'PCR_RESET', 'SEQUENCECOMPLETE', 'SETALGORITHMSET',
+    'SETCOMMANDCODEAUDITSTATUS', 'FIELDUPGRADEDATA', 'INCREMENTALSELFTEST',
+    'SELFTEST', 'STARTUP', 'SHUTDOWN', 'STIRRANDOM', 'ACTIVATECREDENTIAL',
+    'CERTIFY', 'POLICYNV', 'CERTIFYCREATION', 'DUPLICATE', 'GETTIME',
+    'GETSESSIONAUDITDIGEST', 'NV_READ', 'NV_READLOCK', 'OBJECTCHANGEAUTH',
+    'POLICYSECRET', 'REWRAP', 'CREATE', 'ECDH_ZGEN', 'HMAC', 'IMPORT', 'LOAD',
+    'QUOTE', 'RSA_DECRYPT', None, 'HMAC_START', 'SEQUENCEUPDATE', 'SIGN',
+    'UNSEAL', None, 'POLICYSIGNED', 'CONTEXTLOAD', 'CONTEXTSAVE',
+    'ECDH_KEYGEN', 'ENCRYPTDECRYPT', 'FLUSHCONTEXT', None, 'LOADEXTERNAL',
+    'MAKECREDENTIAL', 'NV_READPUBLIC', 'POLICYAUTHORIZE', 'POLICYAUTHVALUE',
+    'POLICYCOMMANDCODE', 'POLICYCOUNTERTIMER', 'POLICYCPHASH',
+    'POLICYLOCALITY', 'POLICYNAMEHASH', 'POLICYOR', 'POLICYTICKET',
+    'READPUBLIC', 'RSA_ENCRYPT', None, 'STARTAUTHSESSION', 'VERIFYSIGNATURE',
+    'ECC_PARAMETERS', 'FIRMWAREREAD', 'GETCAPABILITY', 'GETRANDOM',
+    'GETTESTRESULT', 'HASH', 'PCR_READ', 'POLICYPCR', 'POLICYRESTART',
+    'READCLOCK', 'PCR_EXTEND', 'PCR_SETAUTHVALUE', 'NV_CERTIFY',
+    'EVENTSEQUENCECOMPLETE', 'HASHSEQUENCESTART', 'POLICYPHYSICALPRESENCE',
+    'POLICYDUPLICATIONSELECT', 'POLICYGETDIGEST', 'TESTPARMS', 'COMMIT',
+    'POLICYPASSWORD', 'ZGEN_2PHASE', 'EC_EPHEMERAL', 'POLICYNVWRITTEN',
+    'POLICYTEMPLATE', 'CREATELOADED', 'POLICYAUTHORIZENV', 'ENCRYPTDECRYPT2',
+    'AC_GETCAPABILITY', 'AC_SEND', 'POLICY_AC_SENDSELECT', 'CERTIFYX509',
+    'ACT_SETTIMEOUT',
+)
+
+# TCG structure tags (TPM_ST_*), TPM 2.0 Part 2, sorted by tag: tag, name,
+# medium and short name.
+st_table = (
+    (0x00C4, 'RSP_COMMAND',           'RSP_CMD', 'RSP'),
+    (0x8000, 'NULL',                  'NULL',    'NL'),
+    (0x8001, 'NO_SESSIONS',           'NO_SESS', 'NSE'),
+    (0x8002, 'SESSIONS',              'SESSION', 'SES'),
+    (0x8014, 'ATTEST_NV',             'ATT_NV',  'ANV'),
+    (0x8015, 'ATTEST_COMMAND_AUDIT',  'ATT_CMD', 'ACM'),
+    (0x8016, 'ATTEST_SESSION_AUDIT',  'ATT_SES', 'ASE'),
+    (0x8017, 'ATTEST_CERTIFY',        'ATT_CER', 'ACR'),
+    (0x8018, 'ATTEST_QUOTE',          'ATT_QUO', 'AQU'),
+    (0x8019, 'ATTEST_TIME',           'ATT_TIM', 'ATM'),
+    (0x801A, 'ATTEST_CREATION',       'ATT_CRE', 'ACR'),
+    (0x801C, 'ATTEST_NV_DIGEST',      'ATT_NVD', 'AND'),
+    (0x8021, 'CREATION',              'CREATIN', 'CRE'),
+    (0x8022, 'VERIFIED',              'VERIFED', 'VER'),
+    (0x8023, 'AUTH_SECRET',           'AUTHSEC', 'ASC'),
+    (0x8024, 'HASHCHECK',             'HASHCHK', 'HAC'),
+    (0x8025, 'AUTH_SIGNED',           'AUTHSIG', 'ASG'),
+    (0x8029, 'FU_MANIFEST',           'FU_MANI', 'FUM'),
+)
+
+# Registers of a locality, by offset within its 4 KiB block: offset, name
+# and short name. The locality number is appended to both.
+reg_table = (
+    (0x000, 'ACCESS',          'AC'),
+    (0x008, 'INT_ENABLE',      'IE'),
+    (0x00C, 'INT_VECTOR',      'IV'),
+    (0x010, 'INT_STATUS',      'IS'),
+    (0x014, 'INTF_CAPABILITY', 'IC'),
+    (0x018, 'STS',             'ST'),
+    (0x024, 'DATA_FIFO',       'DF'),
+    (0x080, 'XDATA_FIFO',      'XD'),
+    (0xF00, 'DID_VID',         'DV'),
+    (0xF04, 'RID',             'RI'),
+)
+
+# Register name annotation class, by locality.
+locality_classes = (17, 9, 11, 13, 15)
+
+class Registry:
+    # The expanded tables, see load(). Each lookup returns the annotation
+    # payload, or None for an unknown constant.
+    def __init__(self):
+        self.cmd_anns = tuple(None if n is None else [28, ['TPM_CC_' + n]] for n in cc_names)
+        self.frame_cmd_anns = tuple(None if n is None else [40, ['TPM_CC_' + n]] for n in cc_names)
+        self.st_keys = tuple(t[0] for t in st_table)
+        self.tag_anns = tuple([26, ['TPM_ST_' + n, m, s]] for t, n, m, s in st_table)
+        self.frame_tag_anns = tuple([38, ['TPM_ST_' + n, m, s]] for t, n, m, s in st_table)
+        self.reg_anns = {}
+        self.frame_reg_anns = {}
+        for loc, c in enumerate(locality_classes):
+            for offset, n, s in reg_table:
+                names = ['TPM_%s_%d' % (n, loc), '%s_%d' % (n, loc), '%s%d' % (s, loc)]
+                self.reg_anns[(loc << 12) | offset] = [c, names]
+                self.frame_reg_anns[(loc << 12) | offset] = [33, names]
+
+    def cmd(self, code):
+        i = code - CC_FIRST
+        if 0 <= i < len(self.cmd_anns):
+            return self.cmd_anns[i]
+        return None
+
+    def frame_cmd(self, code):
+        i = code - CC_FIRST
+        if 0 <= i < len(self.frame_cmd_anns):
+            return self.frame_cmd_anns[i]
+        return None
+
+    def st_index(self, tag):
+        i = bisect_left(self.st_keys, tag)
+        if i < len(self.st_keys) and self.st_keys[i] == tag:
+            return i
+        return None
+
+    def tag(self, tag):
+        i = self.st_index(tag)
+        return None if i is None else self.tag_anns[i]
+
+    def frame_tag(self, tag):
+        i = self.st_index(tag)
+        return None if i is None else self.frame_tag_anns[i]
+
+    def reg(self, addr):
+        return self.reg_anns.get(addr)
+
+    def frame_reg(self, addr):
+        return self.frame_reg_anns.get(addr)
+
+@lru_cache(maxsize=None)
+def load():
+    return Registry()
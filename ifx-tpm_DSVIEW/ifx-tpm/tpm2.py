@@ -0,0 +1,483 @@
+##
+## This file is part of the libsigrokdecode project.
+##
+## This program is free software; you can redistribute it and/or modify
+## it under the terms of the GNU General Public License as published by
+## the Free Software Foundation; either version 2 of the License, or
+## (at your option) any later version.
+##
+## This program is distributed in the hope that it will be useful,
+## but WITHOUT ANY WARRANTY; without even the implied warranty of
+## MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+## GNU General Public License for more details.
+##
+## You should have received a copy of the GNU General Public License
+## along with this program; if not, see <http://www.gnu.org/licenses/>.
+##
+
+'''
+TPM 2.0 command/response parameter parser.
+
+A reassembled command or response is split into its handle area, its
+authorization session area and its parameters, following TPM 2.0 Library
+Part 3. The handle counts are known for every command code; the parameters
+are decoded field by field (TPM2B buffers, TPML lists, TPMS/TPMT
+structures) for the commands listed in cmd_params/rsp_params, and passed on
+as a single raw field otherwise.
+
+Parsing is lazy: a Message only parses its bytes the first time its fields
+are asked for, and keeps the result. Response codes are classified by
+decode_rc(), following TPM 2.0 Library Part 2. Nothing here depends on
+sigrok, e.g.:
+
+    for f in Message(data, True).fields:
+        print(f.offset, f.size, f.name, f.value)
+    print(decode_rc(0x9A2).text)
+'''
+
+from collections import namedtuple
+from functools import lru_cache
+import struct
+
+# A parsed field: offset and size in bytes from the start of the message,
+# area ('handle', 'session' or 'param'), name and value text.
+Field = namedtuple('Field', ['offset', 'size', 'area', 'name', 'value'])
+
+class ParseError(Exception):
+    pass
+
+TPM_ST_SESSIONS = 0x8002
+
+# Permanent handles.
+handle_names = {
+    0x40000001: 'TPM_RH_OWNER',
+    0x40000007: 'TPM_RH_NULL',
+    0x40000009: 'TPM_RS_PW',
+    0x4000000A: 'TPM_RH_LOCKOUT',
+    0x4000000B: 'TPM_RH_ENDORSEMENT',
+    0x4000000C: 'TPM_RH_PLATFORM',
+    0x4000000D: 'TPM_RH_PLATFORM_NV',
+}
+
+alg_names = {
+    0x0001: 'RSA', 0x0004: 'SHA1', 0x0005: 'HMAC', 0x0006: 'AES',
+    0x0007: 'MGF1', 0x0008: 'KEYEDHASH', 0x000A: 'XOR', 0x000B: 'SHA256',
+    0x000C: 'SHA384', 0x000D: 'SHA512', 0x0010: 'NULL', 0x0012: 'SM3_256',
+    0x0013: 'SM4', 0x0014: 'RSASSA', 0x0015: 'RSAES', 0x0016: 'RSAPSS',
+    0x0017: 'OAEP', 0x0018: 'ECDSA', 0x0019: 'ECDH', 0x001A: 'ECDAA',
+    0x001B: 'SM2', 0x001C: 'ECSCHNORR', 0x001D: 'ECMQV',
+    0x0020: 'KDF1_SP800_56A', 0x0021: 'KDF2', 0x0022: 'KDF1_SP800_108',
+    0x0023: 'ECC', 0x0025: 'SYMCIPHER', 0x0026: 'CAMELLIA', 0x0040: 'CTR',
+    0x0041: 'OFB', 0x0042: 'CBC', 0x0043: 'CFB', 0x0044: 'ECB',
+}
+
+# Digest size by hash algorithm, for TPMT_HA.
+digest_sizes = {0x0004: 20, 0x000B: 32, 0x000C: 48, 0x000D: 64, 0x0012: 32}
+
+cap_names = {
+    0x00: 'TPM_CAP_ALGS', 0x01: 'TPM_CAP_HANDLES', 0x02: 'TPM_CAP_COMMANDS',
+    0x03: 'TPM_CAP_PP_COMMANDS', 0x04: 'TPM_CAP_AUDIT_COMMANDS',
+    0x05: 'TPM_CAP_PCRS', 0x06: 'TPM_CAP_TPM_PROPERTIES',
+    0x07: 'TPM_CAP_PCR_PROPERTIES', 0x08: 'TPM_CAP_ECC_CURVES',
+    0x09: 'TPM_CAP_AUTH_POLICIES', 0x0A: 'TPM_CAP_ACT',
+    0x100: 'TPM_CAP_VENDOR_PROPERTY',
+}
+
+su_names = {0x0000: 'TPM_SU_CLEAR', 0x0001: 'TPM_SU_STATE'}
+
+se_names = {0x00: 'TPM_SE_HMAC', 0x01: 'TPM_SE_POLICY', 0x03: 'TPM_SE_TRIAL'}
+
+# Number of handles in the command and in the response, by command code.
+handle_counts = {
+    0x11F: (2, 0), 0x120: (2, 0), 0x121: (1, 0), 0x122: (2, 0),
+    0x124: (1, 0), 0x125: (1, 0), 0x126: (1, 0), 0x127: (1, 0),
+    0x128: (1, 0), 0x129: (1, 0), 0x12A: (1, 0), 0x12B: (1, 0),
+    0x12C: (1, 0), 0x12D: (1, 0), 0x12E: (1, 0), 0x12F: (2, 0),
+    0x130: (1, 0), 0x131: (1, 1), 0x132: (1, 0), 0x133: (2, 0),
+    0x134: (2, 0), 0x135: (2, 0), 0x136: (2, 0), 0x137: (2, 0),
+    0x138: (2, 0), 0x139: (1, 0), 0x13A: (1, 0), 0x13B: (1, 0),
+    0x13C: (1, 0), 0x13D: (1, 0), 0x13E: (1, 0), 0x13F: (1, 0),
+    0x140: (1, 0), 0x141: (0, 0), 0x142: (0, 0), 0x143: (0, 0),
+    0x144: (0, 0), 0x145: (0, 0), 0x146: (0, 0), 0x147: (2, 0),
+    0x148: (2, 0), 0x149: (3, 0), 0x14A: (2, 0), 0x14B: (2, 0),
+    0x14C: (2, 0), 0x14D: (3, 0), 0x14E: (2, 0), 0x14F: (2, 0),
+    0x150: (2, 0), 0x151: (2, 0), 0x152: (2, 0), 0x153: (1, 0),
+    0x154: (1, 0), 0x155: (1, 0), 0x156: (1, 0), 0x157: (1, 1),
+    0x158: (1, 0), 0x159: (1, 0), 0x15B: (1, 1), 0x15C: (1, 0),
+    0x15D: (1, 0), 0x15E: (1, 0), 0x160: (2, 0), 0x161: (0, 1),
+    0x162: (1, 0), 0x163: (1, 0), 0x164: (1, 0), 0x165: (0, 0),
+    0x167: (0, 1), 0x168: (1, 0), 0x169: (1, 0), 0x16A: (1, 0),
+    0x16B: (1, 0), 0x16C: (1, 0), 0x16D: (1, 0), 0x16E: (1, 0),
+    0x16F: (1, 0), 0x170: (1, 0), 0x171: (1, 0), 0x172: (1, 0),
+    0x173: (1, 0), 0x174: (1, 0), 0x176: (2, 1), 0x177: (1, 0),
+    0x178: (0, 0), 0x179: (0, 0), 0x17A: (0, 0), 0x17B: (0, 0),
+    0x17C: (0, 0), 0x17D: (0, 0), 0x17E: (0, 0), 0x17F: (1, 0),
+    0x180: (1, 0), 0x181: (0, 0), 0x182: (1, 0), 0x183: (1, 0),
+    0x184: (3, 0), 0x185: (2, 0), 0x186: (0, 1), 0x187: (1, 0),
+    0x188: (1, 0), 0x189: (1, 0), 0x18A: (0, 0), 0x18B: (1, 0),
+    0x18C: (1, 0), 0x18D: (1, 0), 0x18E: (0, 0), 0x18F: (1, 0),
+    0x190: (1, 0), 0x191: (1, 1), 0x192: (3, 0), 0x193: (1, 0),
+    0x194: (1, 0), 0x195: (3, 0), 0x196: (1, 0), 0x197: (2, 0),
+    0x198: (1, 0),
+}
+
+# TPM_RC: format-zero codes (bit 7 clear), by error number within
+# RC_VER1 (0x100) and RC_WARN (0x900).
+rc_ver1_names = {
+    0x00: 'INITIALIZE', 0x01: 'FAILURE', 0x03: 'SEQUENCE', 0x0B: 'PRIVATE',
+    0x19: 'HMAC', 0x20: 'DISABLED', 0x21: 'EXCLUSIVE', 0x24: 'AUTH_TYPE',
+    0x25: 'AUTH_MISSING', 0x26: 'POLICY', 0x27: 'PCR', 0x28: 'PCR_CHANGED',
+    0x2D: 'UPGRADE', 0x2E: 'TOO_MANY_CONTEXTS', 0x2F: 'AUTH_UNAVAILABLE',
+    0x30: 'REBOOT', 0x31: 'UNBALANCED', 0x42: 'COMMAND_SIZE',
+    0x43: 'COMMAND_CODE', 0x44: 'AUTHSIZE', 0x45: 'AUTH_CONTEXT',
+    0x46: 'NV_RANGE', 0x47: 'NV_SIZE', 0x48: 'NV_LOCKED',
+    0x49: 'NV_AUTHORIZATION', 0x4A: 'NV_UNINITIALIZED', 0x4B: 'NV_SPACE',
+    0x4C: 'NV_DEFINED', 0x50: 'BAD_CONTEXT', 0x51: 'CPHASH', 0x52: 'PARENT',
+    0x53: 'NEEDS_TEST', 0x54: 'NO_RESULT', 0x55: 'SENSITIVE',
+}
+
+rc_warn_names = {
+    0x01: 'CONTEXT_GAP', 0x02: 'OBJECT_MEMORY', 0x03: 'SESSION_MEMORY',
+    0x04: 'MEMORY', 0x05: 'SESSION_HANDLES', 0x06: 'OBJECT_HANDLES',
+    0x07: 'LOCALITY', 0x08: 'YIELDED', 0x09: 'CANCELED', 0x0A: 'TESTING',
+    0x10: 'REFERENCE_H0', 0x11: 'REFERENCE_H1', 0x12: 'REFERENCE_H2',
+    0x13: 'REFERENCE_H3', 0x14: 'REFERENCE_H4', 0x15: 'REFERENCE_H5',
+    0x16: 'REFERENCE_H6', 0x18: 'REFERENCE_S0', 0x19: 'REFERENCE_S1',
+    0x1A: 'REFERENCE_S2', 0x1B: 'REFERENCE_S3', 0x1C: 'REFERENCE_S4',
+    0x1D: 'REFERENCE_S5', 0x1E: 'REFERENCE_S6', 0x20: 'NV_RATE',
+    0x21: 'LOCKOUT', 0x22: 'RETRY', 0x23: 'NV_UNAVAILABLE', 0x7F: 'NOT_USED',
+}
+
+# TPM_RC: format-one codes (bit 7 set), by error number within RC_FMT1.
+rc_fmt1_names = {
+    0x01: 'ASYMMETRIC', 0x02: 'ATTRIBUTES', 0x03: 'HASH', 0x04: 'VALUE',
+    0x05: 'HIERARCHY', 0x07: 'KEY_SIZE', 0x08: 'MGF', 0x09: 'MODE',
+    0x0A: 'TYPE', 0x0B: 'HANDLE', 0x0C: 'KDF', 0x0D: 'RANGE',
+    0x0E: 'AUTH_FAIL', 0x0F: 'NONCE', 0x10: 'PP', 0x12: 'SCHEME',
+    0x15: 'SIZE', 0x16: 'SYMMETRIC', 0x17: 'TAG', 0x18: 'SELECTOR',
+    0x1A: 'INSUFFICIENT', 0x1B: 'SIGNATURE', 0x1C: 'KEY', 0x1D: 'POLICY_FAIL',
+    0x1F: 'INTEGRITY', 0x20: 'TICKET', 0x21: 'RESERVED_BITS',
+    0x22: 'BAD_AUTH', 0x23: 'EXPIRED', 0x24: 'POLICY_CC', 0x25: 'BINDING',
+    0x26: 'CURVE', 0x27: 'ECC_POINT',
+}
+
+# A classified response code. kind is 'success', 'tpm12', 'vendor', 'error'
+# (format zero), 'warning' (format zero) or 'format1'. number is the error
+# number within its kind. A format-one code may refer to a 'parameter',
+# 'handle' or 'session' (index_type) by its 1-based index (0 if unspecified).
+# text and short are the long and short annotation text.
+RcInfo = namedtuple('RcInfo', ['rc', 'kind', 'name', 'number', 'index_type',
+                               'index', 'text', 'short'])
+
+@lru_cache(maxsize=64)
+def decode_rc(rc):
+    # Real traces repeat a handful of codes (SUCCESS, RETRY, YIELDED, ...)
+    # over and over, so the results are cached.
+    layer = rc >> 16
+    code = rc & 0xFFFF
+    index_type, index = None, 0
+    if rc == 0:
+        kind, number, name = 'success', 0, 'TPM_RC_SUCCESS'
+    elif code & 0x080:
+        kind, number = 'format1', code & 0x3F
+        name = 'TPM_RC_' + rc_fmt1_names.get(number, '0x%02X' % number)
+        n = (code >> 8) & 0xF
+        if code & 0x040:
+            index_type, index = 'parameter', n
+        elif n & 0x8:
+            index_type, index = 'session', n & 0x7
+        else:
+            index_type, index = 'handle', n
+    elif not code & 0x100:
+        kind, number = 'tpm12', code & 0xFF
+        name = 'TPM 1.2 RC 0x%02X' % number
+    elif code & 0x400:
+        kind, number = 'vendor', code & 0x7F
+        name = 'VENDOR RC 0x%02X' % number
+    elif code & 0x800:
+        kind, number = 'warning', code & 0x7F
+        name = 'TPM_RC_' + rc_warn_names.get(number, 'WARN 0x%02X' % number)
+    else:
+        kind, number = 'error', code & 0x7F
+        name = 'TPM_RC_' + rc_ver1_names.get(number, '0x%02X' % number)
+    text = name
+    short = name[7:] if name.startswith('TPM_RC_') else name
+    if index_type:
+        where = '%s %d' % (index_type, index) if index else '%s unspecified' % index_type
+        text += ' (%s)' % where
+        if index:
+            short += ' %s%d' % (index_type[0].upper(), index)
+    if kind == 'warning':
+        text += ' (warning)'
+    if layer:
+        text += ' (layer 0x%02X)' % layer
+    return RcInfo(rc, kind, name, number, index_type, index, text, short)
+
+class Reader:
+    # Big-endian reads from a message, raising ParseError past its end.
+    def __init__(self, data, pos, end):
+        self.data = data
+        self.pos = pos
+        self.end = end
+
+    def take(self, n):
+        pos = self.pos
+        if pos + n > self.end:
+            raise ParseError('%d bytes at offset %d, past the end (%d)' %
+                             (n, pos, self.end))
+        self.pos = pos + n
+        return self.data[pos:pos + n]
+
+    def uint(self, n):
+        return int.from_bytes(self.take(n), 'big')
+
+def name_or_hex(names, v, width):
+    return names.get(v, '0x%0*X' % (width, v))
+
+def hex_value(data):
+    return bytes(data).hex().upper() if len(data) else '(empty)'
+
+# Field types. Each reads one field and returns its value text, reading
+# nested structures as a whole.
+
+def read_u8(r):
+    return '0x%02X' % r.uint(1)
+
+def read_u16(r):
+    return '%d' % r.uint(2)
+
+def read_u32(r):
+    return '%d' % r.uint(4)
+
+def read_u64(r):
+    return '%d' % r.uint(8)
+
+def read_yesno(r):
+    return 'YES' if r.uint(1) else 'NO'
+
+def read_handle(r):
+    return name_or_hex(handle_names, r.uint(4), 8)
+
+def read_alg(r):
+    return name_or_hex(alg_names, r.uint(2), 4)
+
+def read_hex32(r):
+    # TPM_CC, TPM_RC, TPM_PT and other 32-bit codes.
+    return '0x%08X' % r.uint(4)
+
+def read_cap(r):
+    return name_or_hex(cap_names, r.uint(4), 8)
+
+def read_su(r):
+    return name_or_hex(su_names, r.uint(2), 4)
+
+def read_se(r):
+    return name_or_hex(se_names, r.uint(1), 2)
+
+def read_tpm2b(r):
+    # TPM2B_*: UINT16 size and that many bytes.
+    n = r.uint(2)
+    return '(%d) %s' % (n, hex_value(r.take(n)))
+
+def read_pcr_selection(r):
+    # TPML_PCR_SELECTION: count, then hash algorithm and PCR bitmap each.
+    sels = []
+    for _ in range(r.uint(4)):
+        alg = read_alg(r)
+        bitmap = r.take(r.uint(1))
+        pcrs = [i for i in range(len(bitmap) * 8) if bitmap[i // 8] & (1 << (i % 8))]
+        sels.append('%s:%s' % (alg, ','.join('%d' % i for i in pcrs) or '-'))
+    return ' '.join(sels) or '(none)'
+
+def read_digests(r):
+    # TPML_DIGEST: count, then TPM2B_DIGEST each.
+    return ' '.join(read_tpm2b(r) for _ in range(r.uint(4))) or '(none)'
+
+def read_digest_values(r):
+    # TPML_DIGEST_VALUES: count, then TPMT_HA (hash algorithm, digest) each.
+    values = []
+    for _ in range(r.uint(4)):
+        alg = r.uint(2)
+        if alg not in digest_sizes:
+            raise ParseError('unknown hash algorithm 0x%04X' % alg)
+        values.append('%s:%s' % (alg_names[alg], hex_value(r.take(digest_sizes[alg]))))
+    return ' '.join(values) or '(none)'
+
+def read_public(r):
+    # TPM2B_PUBLIC: size, then TPMT_PUBLIC of which type, nameAlg,
+    # objectAttributes and authPolicy are decoded.
+    n = r.uint(2)
+    if n == 0:
+        return '(0)'
+    inner = Reader(r.data, r.pos, r.pos + n)
+    r.take(n)
+    obj_type = read_alg(inner)
+    name_alg = read_alg(inner)
+    attrs = inner.uint(4)
+    policy = read_tpm2b(inner)
+    return '(%d) type:%s nameAlg:%s attributes:0x%08X authPolicy:%s' % (
+        n, obj_type, name_alg, attrs, policy)
+
+def read_ticket(r):
+    # TPMT_TK_CREATION/TPMT_TK_HASHCHECK/...: tag, hierarchy, digest.
+    tag = r.uint(2)
+    hierarchy = read_handle(r)
+    return 'tag:0x%04X hierarchy:%s digest:%s' % (tag, hierarchy, read_tpm2b(r))
+
+def read_sym_def(r):
+    # TPMT_SYM_DEF: algorithm, and key bits and mode unless it is NULL.
+    alg = r.uint(2)
+    if alg == 0x0010:
+        return 'NULL'
+    return '%s keyBits:%d mode:%s' % (name_or_hex(alg_names, alg, 4), r.uint(2), read_alg(r))
+
+def read_rest(r):
+    return hex_value(r.take(r.end - r.pos))
+
+# Parameters of the commands (cmd_params) and responses (rsp_params) that
+# are decoded, by command code: (name, field type) each. A trailing
+# read_rest takes whatever follows the decoded part.
+cmd_params = {
+    0x120: (('persistentHandle', read_handle),),
+    0x127: (('disable', read_yesno),),
+    0x129: (('newAuth', read_tpm2b),),
+    0x12A: (('auth', read_tpm2b), ('publicInfo', read_tpm2b)),
+    0x131: (('inSensitive', read_tpm2b), ('inPublic', read_public),
+            ('outsideInfo', read_tpm2b), ('creationPCR', read_pcr_selection)),
+    0x13A: (('newMaxTries', read_u32), ('newRecoveryTime', read_u32),
+            ('lockoutRecovery', read_u32)),
+    0x13C: (('eventData', read_tpm2b),),
+    0x143: (('fullTest', read_yesno),),
+    0x144: (('startupType', read_su),),
+    0x145: (('shutdownType', read_su),),
+    0x146: (('inData', read_tpm2b),),
+    0x14E: (('size', read_u16), ('offset', read_u16)),
+    0x137: (('data', read_tpm2b), ('offset', read_u16)),
+    0x153: (('inSensitive', read_tpm2b), ('inPublic', read_public),
+            ('outsideInfo', read_tpm2b), ('creationPCR', read_pcr_selection)),
+    0x155: (('buffer', read_tpm2b), ('hashAlg', read_alg)),
+    0x157: (('inPrivate', read_tpm2b), ('inPublic', read_public)),
+    0x165: (('flushHandle', read_handle),),
+    0x16C: (('code', read_hex32),),
+    0x176: (('nonceCaller', read_tpm2b), ('encryptedSalt', read_tpm2b),
+            ('sessionType', read_se), ('symmetric', read_sym_def),
+            ('authHash', read_alg)),
+    0x17A: (('capability', read_cap), ('property', read_hex32),
+            ('propertyCount', read_u32)),
+    0x17B: (('bytesRequested', read_u16),),
+    0x17D: (('data', read_tpm2b), ('hashAlg', read_alg), ('hierarchy', read_handle)),
+    0x17E: (('pcrSelectionIn', read_pcr_selection),),
+    0x17F: (('pcrDigest', read_tpm2b), ('pcrs', read_pcr_selection)),
+    0x182: (('digests', read_digest_values),),
+}
+
+rsp_params = {
+    0x131: (('outPublic', read_public), ('creationData', read_tpm2b),
+            ('creationHash', read_tpm2b), ('creationTicket', read_ticket),
+            ('name', read_tpm2b)),
+    0x14E: (('data', read_tpm2b),),
+    0x153: (('outPrivate', read_tpm2b), ('outPublic', read_public),
+            ('creationData', read_tpm2b), ('creationHash', read_tpm2b),
+            ('creationTicket', read_ticket)),
+    0x155: (('outHMAC', read_tpm2b),),
+    0x157: (('name', read_tpm2b),),
+    0x15E: (('outData', read_tpm2b),),
+    0x169: (('nvPublic', read_tpm2b), ('nvName', read_tpm2b)),
+    0x173: (('outPublic', read_public), ('name', read_tpm2b),
+            ('qualifiedName', read_tpm2b)),
+    0x176: (('nonceTPM', read_tpm2b),),
+    0x17A: (('moreData', read_yesno), ('capability', read_cap),
+            ('capabilityData', read_rest)),
+    0x17B: (('randomBytes', read_tpm2b),),
+    0x17C: (('outData', read_tpm2b), ('testResult', read_hex32)),
+    0x17D: (('outHash', read_tpm2b), ('validation', read_ticket)),
+    0x17E: (('pcrUpdateCounter', read_u32), ('pcrSelectionOut', read_pcr_selection),
+            ('pcrValues', read_digests)),
+    0x181: (('time', read_u64), ('clock', read_u64), ('resetCount', read_u32),
+            ('restartCount', read_u32), ('safe', read_yesno)),
+    0x189: (('policyDigest', read_tpm2b),),
+}
+
+# Command/response header: tag, size and command code (or response code).
+header = struct.Struct('>HII')
+
+class Message:
+    # A TPM 2.0 command (command=True) or response, the whole message
+    # including its header. cc is the command code, for a response the one
+    # of the command it answers.
+    __slots__ = ('data', 'command', 'cc', '_fields')
+
+    def __init__(self, data, command, cc=None):
+        self.data = data
+        self.command = command
+        self.cc = header.unpack_from(data)[2] if command else cc
+        self._fields = None
+
+    @property
+    def fields(self):
+        # The list of Field()s, parsed on first use only. A malformed message
+        # ends with a field named 'error', over the bytes left unparsed.
+        if self._fields is None:
+            fields = []
+            try:
+                self.parse(fields)
+            except ParseError as e:
+                pos = fields[-1].offset + fields[-1].size if fields else header.size
+                fields.append(Field(pos, len(self.data) - pos, 'param', 'error', str(e)))
+            self._fields = fields
+        return self._fields
+
+    def read(self, fields, r, area, name, read):
+        pos = r.pos
+        value = read(r)
+        fields.append(Field(pos, r.pos - pos, area, name, value))
+
+    def parse(self, fields):
+        data = self.data
+        tag, size, code = header.unpack_from(data)
+        if not self.command and code != 0:
+            # Error responses are header only.
+            return
+        r = Reader(data, header.size, len(data))
+        counts = handle_counts.get(self.cc)
+        if counts is None:
+            if r.pos < r.end:
+                self.read(fields, r, 'param', 'parameters', read_rest)
+            return
+        for i in range(counts[0] if self.command else counts[1]):
+            self.read(fields, r, 'handle', 'handle%d' % (i + 1), read_handle)
+        params = (cmd_params if self.command else rsp_params).get(self.cc, ())
+        if tag != TPM_ST_SESSIONS:
+            self.parse_params(fields, r, params)
+        elif self.command:
+            pos = r.pos
+            auth_end = r.pos + 4 + r.uint(4)
+            fields.append(Field(pos, 4, 'session', 'authorizationSize', '%d' % (auth_end - pos - 4)))
+            if auth_end > r.end:
+                raise ParseError('authorizationSize past the end of the command')
+            sessions = Reader(data, r.pos, auth_end)
+            while sessions.pos < auth_end:
+                self.read(fields, sessions, 'session', 'sessionHandle', read_handle)
+                self.read(fields, sessions, 'session', 'nonceCaller', read_tpm2b)
+                self.read(fields, sessions, 'session', 'sessionAttributes', read_u8)
+                self.read(fields, sessions, 'session', 'hmac', read_tpm2b)
+            r.pos = auth_end
+            self.parse_params(fields, r, params)
+        else:
+            pos = r.pos
+            param_end = r.pos + 4 + r.uint(4)
+            fields.append(Field(pos, 4, 'session', 'parameterSize', '%d' % (param_end - pos - 4)))
+            if param_end > r.end:
+                raise ParseError('parameterSize past the end of the response')
+            self.parse_params(fields, Reader(data, r.pos, param_end), params)
+            r.pos = param_end
+            while r.pos < r.end:
+                self.read(fields, r, 'session', 'nonceTPM', read_tpm2b)
+                self.read(fields, r, 'session', 'sessionAttributes', read_u8)
+                self.read(fields, r, 'session', 'hmac', read_tpm2b)
+
+    def parse_params(self, fields, r, params):
+        for name, read in params:
+            self.read(fields, r, 'param', name, read)
+        if r.pos < r.end:
+            self.read(fields, r, 'param', 'parameters', read_rest)
@@ -0,0 +1,195 @@
+##
+## This file is part of the libsigrokdecode project.
+##
+## This program is free software; you can redistribute it and/or modify
+## it under the terms of the GNU General Public License as published by
+## the Free Software Foundation; either version 2 of the License, or
+## (at your option) any later version.
+##
+## This program is distributed in the hope that it will be useful,
+## but WITHOUT ANY WARRANTY; without even the implied warranty of
+## MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+## GNU General Public License for more details.
+##
+## You should have received a copy of the GNU General Public License
+## along with this program; if not, see <http://www.gnu.org/licenses/>.
+##
+
+'''
+Bulk I²C condition and bit extractor.
+
+Takes chunks of SCL/SDA samples and locates the SCL rising edges and the
+START/STOP conditions with array operations. The decoder's state machine
+is then walked per byte instead of per wake-up: eight SCL rising edges
+without a START/STOP in between are handed over as one byte, the ninth
+one as the ACK/NACK bit. Only bytes which are cut short by a START/STOP
+condition or by the end of a chunk are handed over bit by bit. Skipped
+transactions are jumped over up to the next START/STOP condition.
+
+Chunks must be fed in order; SCL/SDA levels, the state and incomplete
+bytes are carried over from one chunk to the next.
+'''
+
+from bisect import bisect_left
+
+import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
+
+FIND_START, FIND_ADDRESS, FIND_DATA, FIND_ACK, SKIP = range(5)
+
+class I2cExtractor:
+    def __init__(self, address_conditions, on_start, on_stop, on_skip_end,
+                 on_bit, on_byte, on_ack):
+        # address_conditions: START/STOP are also looked for while the
+        #                     address byte is received.
+        # on_start(samplenum), on_stop(samplenum): START/STOP condition.
+        # on_skip_end(samplenum, edges): end of a skipped transaction and
+        #                                the number of SCL edges in it.
+        # on_bit(samplenum, sda): single address/data bit.
+        # on_byte(value, samples): whole address/data byte and the sample
+        #                          numbers of its eight SCL edges.
+        # on_ack(samplenum, sda): ACK/NACK bit.
+        self.address_conditions = address_conditions
+        self.on_start = on_start
+        self.on_stop = on_stop
+        self.on_skip_end = on_skip_end
+        self.on_bit = on_bit
+        self.on_byte = on_byte
+        self.on_ack = on_ack
+        self.state = FIND_START
+        self.bitcount = 0
+        self.skip_edges = 0
+        self.offset = 0
+        self.last_scl = self.last_sda = None
+
+    def skip(self):
+        # Called back from on_byte()/on_bit(): ignore the rest of the
+        # transaction.
+        self.state = SKIP
+        self.skip_edges = 0
+
+    def feed(self, scl, sda):
+        scl = np.asarray(scl) != 0
+        sda = np.asarray(sda) != 0
+        n = len(scl)
+        if not n:
+            return
+        if self.last_scl is None:
+            # No edges on the very first sample.
+            self.last_scl, self.last_sda = scl[0], sda[0]
+
+        prev_scl = np.concatenate(([self.last_scl], scl[:-1]))
+        prev_sda = np.concatenate(([self.last_sda], sda[:-1]))
+        rise = np.flatnonzero(scl & ~prev_scl)
+        starts = np.flatnonzero(scl & prev_sda & ~sda)
+        stops = np.flatnonzero(scl & ~prev_sda & sda)
+
+        # While SCL rising edges are awaited as well, they take precedence
+        # over a START/STOP condition on the same sample. Only a plain
+        # 'FIND START' wait and skipped transactions see those.
+        all_conds = np.concatenate((starts, stops))
+        all_is_stop = np.concatenate((np.zeros(len(starts), dtype=bool),
+                                      np.ones(len(stops), dtype=bool)))
+        order = np.argsort(all_conds, kind='stable')
+        all_conds = all_conds[order]
+        all_is_stop = all_is_stop[order]
+        keep = ~np.isin(all_conds, rise)
+        conds = all_conds[keep]
+        is_stop = all_is_stop[keep]
+
+        bits = sda[rise]
+        if len(bits) >= 8:
+            windows = np.packbits(sliding_window_view(bits, 8), axis=1).ravel().tolist()
+        else:
+            windows = []
+
+        self.walk((rise + self.offset).tolist(), bits.view(np.uint8).tolist(), windows,
+                  (starts + self.offset).tolist(),
+                  (conds + self.offset).tolist(), is_stop.tolist(),
+                  (all_conds + self.offset).tolist(), all_is_stop.tolist())
+
+        self.last_scl, self.last_sda = scl[-1], sda[-1]
+        self.offset += n
+
+    def walk(self, rise, bits, windows, starts, conds, is_stop, all_conds,
+             all_is_stop):
+        # rise/bits: SCL rising edges and SDA there, windows[i]: the byte
+        # made up of rise[i:i + 8]. starts: all START conditions, conds:
+        # START/STOP conditions not on an SCL rising edge, all_conds: all
+        # START/STOP conditions.
+        nrise, nstarts, nconds = len(rise), len(starts), len(conds)
+        nall = len(all_conds)
+        i = js = jc = ja = 0
+        pos = self.offset
+        while True:
+            state = self.state
+            if state == FIND_START:
+                while js < nstarts and starts[js] < pos:
+                    js += 1
+                if js == nstarts:
+                    break
+                s = starts[js]
+                self.state, self.bitcount = FIND_ADDRESS, 0
+                self.on_start(s)
+                pos = s + 1
+                continue
+
+            while i < nrise and rise[i] < pos:
+                i += 1
+            if state == SKIP:
+                while ja < nall and all_conds[ja] < pos:
+                    ja += 1
+                if ja == nall:
+                    self.skip_edges += nrise - i
+                    break
+                c = all_conds[ja]
+                k = bisect_left(rise, c, i)
+                self.skip_edges += k - i
+                self.on_skip_end(c, self.skip_edges)
+                if all_is_stop[ja]:
+                    self.state = FIND_START
+                    self.on_stop(c)
+                else:
+                    self.state, self.bitcount = FIND_ADDRESS, 0
+                    self.on_start(c)
+                pos = c + 1
+                continue
+
+            if state == FIND_ACK:
+                if i == nrise:
+                    break
+                self.state = FIND_DATA
+                self.on_ack(rise[i], bits[i])
+                pos = rise[i] + 1
+                continue
+
+            if state == FIND_DATA or self.address_conditions:
+                while jc < nconds and conds[jc] < pos:
+                    jc += 1
+                c = conds[jc] if jc < nconds else None
+                if c is not None and (i == nrise or c < rise[i]):
+                    if is_stop[jc]:
+                        self.state = FIND_START
+                        self.on_stop(c)
+                    else:
+                        self.state, self.bitcount = FIND_ADDRESS, 0
+                        self.on_start(c)
+                    pos = c + 1
+                    continue
+            else:
+                c = None
+            if i == nrise:
+                break
+
+            if self.bitcount == 0 and i + 8 <= nrise and (c is None or c > rise[i + 7]):
+                # A whole byte without START/STOP in between.
+                self.state = FIND_ACK
+                self.on_byte(windows[i], rise[i:i + 8])
+                pos = rise[i + 7] + 1
+                continue
+
+            self.bitcount += 1
+            if self.bitcount == 8:
+                self.state, self.bitcount = FIND_ACK, 0
+            self.on_bit(rise[i], bits[i])
+            pos = rise[i] + 1
@@ -23,6 +23,7 @@
 # TODO: Implement support for detecting various bus errors.
 
 import sigrokdecode as srd
+from .layers import FrameLayer, PacketLayer, ApduLayer, parse_apdu
 
 '''
 OUTPUT_PYTHON format:
@@ -41,11 +42,20 @@ Packet:
  - 'ACK' (ACK bit)
  - 'NACK' (NACK bit)
  - 'BITS' (<pdata>: list of data/address bits and their ss/es numbers)
+ - 'APDU-COMMAND' (Whole command APDU, see below)
+ - 'APDU-RESPONSE' (Whole response APDU, see below)
 
 <pdata> is the data or address byte associated with the 'ADDRESS*' and 'DATA*'
 command. Slave addresses do not include bit 0 (the READ/WRITE indication bit).
 For example, a slave address field could be 0x51 (instead of 0xa2).
 For 'START', 'START REPEAT', 'STOP', 'ACK', and 'NACK' <pdata> is None.
+
+For 'APDU-COMMAND' and 'APDU-RESPONSE' <pdata> is a dict with 'cmd', 'param',
+'length' and 'payload' (bytes), and with 'ss'/'es' of the APDU. For
+responses 'cmd' and 'param' are the Sta and UnDef bytes. Chained packets
+are reassembled, so there is one packet per APDU. Protected APDUs and
+frames with a wrong checksum are left out. The frame layer has to be
+parsed for them ('layer_max' at 'frame' or above).
 '''
 
 # CMD: [annotation-type-index, long annotation, short annotation]
@@ -62,6 +72,17 @@ proto = {
     'DATA WRITE':      [9, 'DATA WRITE',    'DW'],
 }
 
+# Decoder states.
+FIND_START, FIND_ADDRESS, FIND_DATA, FIND_ACK, SKIP_TRANSACTION = range(5)
+
+# Address/data byte kinds: the READ/WRITE bit, plus 2 for data bytes. They
+# double as the binary output classes.
+ADDRESS_READ, ADDRESS_WRITE, DATA_READ, DATA_WRITE = range(4)
+byte_cmds = ('ADDRESS READ', 'ADDRESS WRITE', 'DATA READ', 'DATA WRITE')
+# START/START REPEAT by is_repeat_start, ACK/NACK by the SDA level.
+start_cmds = ('START', 'START REPEAT')
+ack_cmds = ('ACK', 'NACK')
+
 # Command
 command = {
     0x01: [34, 'CMD GETDATAOBJECT', 'GETD', 'GD'],
@@ -120,6 +141,81 @@ framedata = {
     'DATA READ':       [22, 'DATA READ', 'DR','R'],
     'DATA WRITE':      [23, 'DATA WRITE','DW','W'],
 }
+
+# Annotation payloads for every byte value, built once and indexed by the
+# byte. They are never modified, so the same list can be put() repeatedly.
+def byte_anns(cls, name, short):
+    return tuple([cls, ['%s:0x%02X' % (name, b), '%s:%02X' % (short, b), '%02X' % b]]
+                 for b in range(256))
+
+def proto_ann(cmd):
+    return [proto[cmd][0], proto[cmd][1:]]
+
+start_anns = tuple(proto_ann(cmd) for cmd in start_cmds)
+ack_anns = tuple(proto_ann(cmd) for cmd in ack_cmds)
+stop_ann = proto_ann('STOP')
+bit_anns = ([5, ['0']], [5, ['1']])
+# READ/WRITE bit of address bytes, by byte kind.
+rw_anns = ([proto['ADDRESS READ'][0], ['READ', 'RD', 'R']],
+           [proto['ADDRESS WRITE'][0], ['WRITE', 'WR', 'W']])
+# Address/data bytes, by byte kind.
+bus_anns = tuple(byte_anns(*proto[cmd]) for cmd in byte_cmds)
+# Register, I2C_STATE register and frame packet data, by byte kind (data
+# bytes only).
+data_anns = (None, None) + tuple((byte_anns(regdata[cmd][0], *regdata[cmd][1:3]),
+                                  byte_anns(13, *regdata[cmd][1:3]),
+                                  byte_anns(framedata[cmd][0], *framedata[cmd][1:3]))
+                                 for cmd in byte_cmds[DATA_READ:])
+apdu_read_anns = byte_anns(37, *framedata['DATA READ'][1:3])
+apdu_write_anns = byte_anns(38, *framedata['DATA WRITE'][1:3])
+# Register names by address and APDU commands by command byte, and the
+# payloads for the ones which are not in the tables.
+reg_name_anns = {r: [cls, [name, short]] for r, (cls, name, short) in reg.items()}
+command_anns = {c: [cls, ['%s:0x%02X' % (name, c), '%s:0x%02X' % (short, c),
+                          '%s:%02X' % (letter, c), '%02X' % c]]
+                for c, (cls, name, short, letter) in command.items()}
+reg_error_ann = [43, ['PROTOCOL ERROR', 'ERROR', 'ERR', 'E']]
+command_error_ann = [40, ['PROTOCOL ERROR', 'ERROR', 'ERR', 'E']]
+
+# Longest packet a frame can carry: DATA_REG_LEN is at most 0x115, less
+# FCTR, LEN and FCS.
+MAX_FRAME_LEN = 0x110
+
+class ProtocolErrors:
+    # Protocol errors seen so far, by category: how many, and the start
+    # samples of the first and of the last one.
+    def __init__(self):
+        self.total = 0
+        self.first = -1
+        self.categories = {}
+
+    def add(self, category, ss):
+        if not self.total:
+            self.first = ss
+        self.total += 1
+        seen = self.categories.get(category)
+        if seen:
+            seen[0] += 1
+            seen[2] = ss
+        else:
+            self.categories[category] = [1, ss, ss]
+
+    def summary(self):
+        return ', '.join('%s: %d (%d-%d)' % (category, count, first, last)
+                         for category, (count, first, last) in self.categories.items())
+
+# Annotation layers, lowest first, and their annotation classes. Only the
+# layers between the 'layer_min' and 'layer_max' options are annotated, and
+# nothing above 'layer_max' is parsed at all.
+ann_layers = (
+    ('bits',      (5,)),
+    ('addr-data', (0, 1, 2, 3, 4, 6, 7, 8, 9, 44)),
+    ('register',  (10, 11, 12, 13, 14, 43)),
+    ('frame',     (15, 16, 21, 22, 23, 24, 25, 29, 33, 42)),
+    ('headers',   (17, 18, 19, 20, 26, 27, 28, 30, 31, 32, 39, 41)),
+    ('apdu',      (34, 35, 36, 37, 38, 40)),
+)
+
 class Decoder(srd.Decoder):
     api_version = 3
     id = 'ifx_trustm'
@@ -140,6 +236,18 @@ class Decoder(srd.Decoder):
         {'id': 'address_format', 'desc': 'Displayed slave address format',
             'default': 'shifted', 'values': ('shifted', 'unshifted')},
         {'id': 'address', 'desc': 'Device Addr', 'default': 0x30},
+        {'id': 'foreign', 'desc': 'Other addresses', 'default': 'decode',
+            'values': ('decode', 'skip', 'summary')},
+        {'id': 'python_output', 'desc': 'Python output (stacked decoders)',
+            'default': 'yes', 'values': ('yes', 'no')},
+        {'id': 'binary_output', 'desc': 'Binary output',
+            'default': 'yes', 'values': ('yes', 'no')},
+        {'id': 'bitrate_output', 'desc': 'Bitrate (meta) output',
+            'default': 'yes', 'values': ('yes', 'no')},
+        {'id': 'layer_min', 'desc': 'Lowest annotation layer',
+            'default': 'bits', 'values': ('bits', 'addr-data', 'register', 'frame', 'headers', 'apdu')},
+        {'id': 'layer_max', 'desc': 'Highest annotation layer',
+            'default': 'apdu', 'values': ('bits', 'addr-data', 'register', 'frame', 'headers', 'apdu')},
     )
 
     annotations = (
@@ -194,13 +302,17 @@ class Decoder(srd.Decoder):
         ('0', 'header-err','HEADER ERROR'),                 #41
         ('0', 'frame-err','FRAME ERROR'),                   #42
         ('0', 'reg-err','REGISTER ERROR'),                  #43
+
+        ('0', 'foreign','FOREIGN TRANSACTION'),             #44
+        ('0', 'errors','PROTOCOL ERRORS'),                  #45
     )
     annotation_rows = (
+        ('errors', 'Protocol errors', (45,)),
         ('apdu','APDU', (34,35,36,37,38,40,)),
         ('headers','Headers', (17,18,19,20,26,27,28,30,31,32,39,41,)),
         ('frame', 'Frame', (15,16,21,22,23,24,25,29,33,42,)),
         ('register', 'Register', (10,11,12,13,14,43,)),
-        ('addr-data', 'Address/Data', (0, 1, 2, 3, 4, 6, 7, 8, 9)),
+        ('addr-data', 'Address/Data', (0, 1, 2, 3, 4, 6, 7, 8, 9, 44)),
         ('bits', 'Bits', (5,)),
     )
     binary = (
@@ -220,10 +332,14 @@ class Decoder(srd.Decoder):
         self.databyte = 0
         self.wr = -1
         self.is_repeat_start = 0
-        self.state = 'FIND START'
+        self.state = FIND_START
         self.pdu_start = None
         self.pdu_bits = 0
-        self.bits = []
+        # Start/end sample numbers of the bits of the current byte, in the
+        # order they are received (MSB first). The bit values are in the
+        # databyte shift register.
+        self.bit_ss = [0] * 8
+        self.bit_es = [0] * 8
 
         self.addrflag = 0
         self.addr = 0x00
@@ -231,24 +347,45 @@ class Decoder(srd.Decoder):
         self.reg = 0x00
         self.regdata = 0x00
         self.regdatacnt = -1
-        self.regdatacmd = 'DATA READ'
+        self.regdatacmd = DATA_READ
+        self.reg_anns, self.i2c_state_anns, self.frame_anns = data_anns[self.regdatacmd]
         self.reg_sp = -1
         self.reg_ep = -1
         self.reg_i2c_state = 0
         self.reg_len = 0
 
         self.datalink = 0
-        self.framelen = 0
-        self.framecsum = 0
         self.frame_sp = -1
         self.frame_ep = -1
+        # Start of the previous DATA register byte, for two-byte fields.
+        self.field_sp = -1
+
+        # Trust M protocol stack, fed with the DATA register bytes.
+        self.apdus = ApduLayer(self.handle_apdu_command, self.handle_apdu_param,
+                               self.handle_apdu_length, self.handle_apdu_data)
+        self.packets = PacketLayer(self.handle_pctr, self.handle_sctr,
+                                   self.handle_packet_data, self.apdus,
+                                   self.handle_apdu_message)
+        # Start/end sample numbers of the APDU being reassembled, by
+        # direction (read, write).
+        self.message_ss = [-1, -1]
+        self.message_es = [-1, -1]
+        self.frames = FrameLayer(self.handle_fctr, self.handle_frame_length,
+                                 self.handle_frame_checksum, self.packets)
 
-        self.pctr_pres = 0
-        self.pctr_chain = 0
-        self.sctr_protection = 0
-        self.sctr_message = 0
+        self.skip_ss = -1
+        self.skip_addr = 0
+        self.skip_edges = 0
 
-        self.apdulen = 0
+        self.extractor = None
+
+        self.errors = ProtocolErrors()
+
+        # Which output streams to produce, see start().
+        self.python_on = self.binary_on = self.bitrate_on = True
+        self.ann_on = [True] * len(self.annotations)
+        self.bits_on = self.addr_data_on = True
+        self.parse_register = self.parse_frame = self.parse_apdu = True
 
 
     def metadata(self, key, value):
@@ -261,34 +398,70 @@ class Decoder(srd.Decoder):
         self.out_binary = self.register(srd.OUTPUT_BINARY)
         self.out_bitrate = self.register(srd.OUTPUT_META,
         meta=(int, 'Bitrate', 'Bitrate from Start bit to Stop bit'))
+        self.out_errors = self.register(srd.OUTPUT_META,
+        meta=(int, 'Protocol errors', 'Protocol errors so far'))
+        self.python_on = self.options['python_output'] == 'yes'
+        self.binary_on = self.options['binary_output'] == 'yes'
+        self.bitrate_on = self.options['bitrate_output'] == 'yes'
+
+        names = [name for name, classes in ann_layers]
+        lo = names.index(self.options['layer_min'])
+        hi = max(lo, names.index(self.options['layer_max']))
+        for i, (name, classes) in enumerate(ann_layers):
+            for c in classes:
+                self.ann_on[c] = lo <= i <= hi
+        self.bits_on = self.ann_on[5]
+        self.addr_data_on = self.ann_on[0]
+        self.parse_register = hi >= names.index('register')
+        self.parse_frame = hi >= names.index('frame')
+        self.parse_apdu = hi >= names.index('apdu')
+        self.packets.apdus = self.apdus if self.parse_apdu else None
 
     def putx_frame(self, data):
-        self.put(self.frame_sp, self.frame_ep, self.out_ann, data)
+        if self.ann_on[data[0]]:
+            self.put(self.frame_sp, self.frame_ep, self.out_ann, data)
 
     def putx_reg(self, data):
-        self.put(self.reg_sp, self.reg_ep, self.out_ann, data)
+        if self.ann_on[data[0]]:
+            self.put(self.reg_sp, self.reg_ep, self.out_ann, data)
 
     def putx(self, data):
-        self.put(self.ss, self.es, self.out_ann, data)
+        if self.addr_data_on:
+            self.put(self.ss, self.es, self.out_ann, data)
 
     def putp(self, data):
-        self.put(self.ss, self.es, self.out_python, data)
+        if self.python_on:
+            self.put(self.ss, self.es, self.out_python, data)
 
     def putb(self, data):
-        self.put(self.ss, self.es, self.out_binary, data)
+        if self.binary_on:
+            self.put(self.ss, self.es, self.out_binary, data)
+
+    def protocol_error(self, category, ss, es):
+        # Count the error, the META output is the running total.
+        self.errors.add(category, ss)
+        self.put(ss, es, self.out_errors, self.errors.total)
+
+    def finish(self):
+        # End of the samples: sum up the protocol errors, if there were
+        # any. decode() does this itself, decode_chunk() hosts call it
+        # after the last chunk.
+        errors = self.errors
+        if errors.total:
+            self.put(errors.first, max(errors.first, self.samplenum), self.out_ann,
+                     [45, ['PROTOCOL ERRORS: %d, %s' % (errors.total, errors.summary()),
+                           'PROTOCOL ERRORS: %d' % errors.total, 'ERRORS', 'E']])
 
     def handle_start(self):
         self.ss, self.es = self.samplenum, self.samplenum
         self.pdu_start = self.samplenum
         self.pdu_bits = 0
-        cmd = 'START REPEAT' if (self.is_repeat_start == 1) else 'START'
-        self.putp([cmd, None])
-        self.putx([proto[cmd][0], proto[cmd][1:]])
-        self.state = 'FIND ADDRESS'
+        self.putp([start_cmds[self.is_repeat_start], None])
+        self.putx(start_anns[self.is_repeat_start])
+        self.state = FIND_ADDRESS
         self.bitcount = self.databyte = 0
         self.is_repeat_start = 1
         self.wr = -1
-        self.bits = []
 
     # Gather 8 bits of data plus the ACK/NACK bit.
     def handle_address_or_data(self, scl, sda):
@@ -302,22 +475,31 @@ class Decoder(srd.Decoder):
         if self.bitcount == 0:
             self.ss_byte = self.samplenum
 
-        # Store individual bits and their start/end samplenumbers.
-        # In the list, index 0 represents the LSB (I²C transmits MSB-first).
-        self.bits.insert(0, [sda, self.samplenum, self.samplenum])
-        if self.bitcount > 0:
-            self.bits[1][2] = self.samplenum
-        if self.bitcount == 7:
-            self.bitwidth = self.bits[1][2] - self.bits[2][2]
-            self.bits[0][2] += self.bitwidth
+        # Store the start/end samplenumbers of the individual bits.
+        n = self.bitcount
+        self.bit_ss[n] = self.bit_es[n] = self.samplenum
+        if n > 0:
+            self.bit_es[n - 1] = self.samplenum
+        if n == 7:
+            self.bitwidth = self.bit_es[6] - self.bit_es[5]
+            self.bit_es[7] += self.bitwidth
 
         # Return if we haven't collected all 8 + 1 bits, yet.
         if self.bitcount < 7:
             self.bitcount += 1
             return
 
+        self.handle_byte()
+
+    def bit_list(self):
+        # [bit, ss, es] per bit of the current byte, as for 'BITS'.
+        # Index 0 represents the LSB (I²C transmits MSB-first).
+        d, bit_ss, bit_es = self.databyte, self.bit_ss, self.bit_es
+        return [[(d >> i) & 1, bit_ss[7 - i], bit_es[7 - i]] for i in range(8)]
+
+    def handle_byte(self):
         d = self.databyte
-        if self.state == 'FIND ADDRESS':
+        if self.state == FIND_ADDRESS:
             # The READ/WRITE bit is only in address bytes, not data bytes.
             self.wr = 0 if (self.databyte & 1) else 1
             if self.options['address_format'] == 'shifted':
@@ -326,26 +508,14 @@ class Decoder(srd.Decoder):
             # looking for the require address
             if ((self.databyte >> 1) == self.options['address']):
                 self.addrflag = 1
-
-        bin_class = -1
-        if self.state == 'FIND ADDRESS' and self.wr == 1:
-            cmd = 'ADDRESS WRITE'
-            bin_class = 1
-            if self.addrflag == 1:
+            kind = ADDRESS_READ + self.wr
+            if kind == ADDRESS_WRITE and self.addrflag == 1:
                 self.reg_sp = self.ss_byte
-        elif self.state == 'FIND ADDRESS' and self.wr == 0:
-            cmd = 'ADDRESS READ'
-            bin_class = 0
-        elif self.state == 'FIND DATA' and self.wr == 1:
-            cmd = 'DATA WRITE'
+        else:
+            kind = DATA_READ + self.wr
             if self.addrflag == 1:
-                self.regdatacmd = cmd
-            bin_class = 3
-        elif self.state == 'FIND DATA' and self.wr == 0:
-            cmd = 'DATA READ'
-            if self.addrflag == 1:
-                self.regdatacmd = cmd
-            bin_class = 2
+                self.regdatacmd = kind
+                self.reg_anns, self.i2c_state_anns, self.frame_anns = data_anns[kind]
 
         self.ss, self.es = self.ss_byte, self.samplenum + self.bitwidth
 
@@ -361,18 +531,21 @@ class Decoder(srd.Decoder):
 
             self.regdata = self.databyte
 
-        self.putp(['BITS', self.bits])
-        self.putp([cmd, d])
+        if self.python_on:
+            self.putp(['BITS', self.bit_list()])
+        self.putp([byte_cmds[kind], d])
 
-        self.putb([bin_class, bytes([d])])
+        self.putb([kind, bytes([d])])
 
-        for bit in self.bits:
-            self.put(bit[1], bit[2], self.out_ann, [5, ['%d' % bit[0]]])
+        # Bit annotations, LSB first.
+        if self.bits_on:
+            bit_ss, bit_es = self.bit_ss, self.bit_es
+            for i in range(8):
+                self.put(bit_ss[7 - i], bit_es[7 - i], self.out_ann, bit_anns[(self.databyte >> i) & 1])
 
-        if cmd.startswith('ADDRESS'):
+        if kind < DATA_READ:
             self.ss, self.es = self.samplenum, self.samplenum + self.bitwidth
-            w = ['WRITE', 'WR', 'W'] if self.wr else ['READ', 'RD', 'R']
-            self.putx([proto[cmd][0], w])
+            self.putx(rw_anns[kind])
             self.ss, self.es = self.ss_byte, self.samplenum
             if self.addrflag == 1:
                 if self.wr == 1:
@@ -381,317 +554,348 @@ class Decoder(srd.Decoder):
                 else:
                     self.addrbyte = 2
 
-        self.putx([proto[cmd][0], ['%s:0x%02X' % (proto[cmd][1], d),
-                   '%s:%02X' % (proto[cmd][2], d), '%02X' % d]])
+        self.putx(bus_anns[kind][d])
 
         # Done with this packet.
         self.bitcount = self.databyte = 0
-        self.bits = []
-        self.state = 'FIND ACK'
+        self.state = FIND_ACK
+
+        # The register name is annotated as soon as the register address
+        # byte is in, before its ACK/NACK, as it always was.
+        if self.regdatacnt == 1 and (self.addrflag == 1):
+            ann = reg_name_anns.get(self.reg)
+            if ann:
+                self.putx_reg(ann)
+            else:
+                self.putx_reg(reg_error_ann)
+                self.protocol_error('unknown register', self.reg_sp, self.reg_ep)
+            self.regdatacnt += 1
+            self.datalink = 0
+            if self.reg == 0x80 and self.parse_frame:
+                self.datalink = 1
+                self.frames.reset()
+
+        if kind < DATA_READ and self.addrflag == 0 and \
+                self.options['foreign'] != 'decode':
+            # Not our device: skip to the next START/STOP condition.
+            self.state = SKIP_TRANSACTION
+            self.skip_ss = self.ss_byte
+            self.skip_addr = d
+            self.skip_edges = 0
 
     def get_ack(self, scl, sda):
         self.ss, self.es = self.samplenum, self.samplenum + self.bitwidth
-        cmd = 'NACK' if (sda == 1) else 'ACK'
-
-        self.putp([cmd, None])
-        self.putx([proto[cmd][0], proto[cmd][1:]])
+        self.putp([ack_cmds[sda], None])
+        self.putx(ack_anns[sda])
         # There could be multiple data bytes in a row, so either find
         # another data byte or a STOP condition next.
-        self.state = 'FIND DATA'
+        self.state = FIND_DATA
 
     def handle_stop(self):
         # Meta bitrate
-        if self.samplerate:
+        if self.samplerate and self.bitrate_on and self.state != SKIP_TRANSACTION:
             elapsed = 1 / float(self.samplerate) * (self.samplenum - self.pdu_start + 1)
             bitrate = int(1 / elapsed * self.pdu_bits)
             self.put(self.ss_byte, self.samplenum, self.out_bitrate, bitrate)
 
-        cmd = 'STOP'
-
         self.ss, self.es = self.samplenum, self.samplenum
-        self.putp([cmd, None])
-        self.putx([proto[cmd][0], proto[cmd][1:]])
-        self.state = 'FIND START'
+        self.putp(['STOP', None])
+        self.putx(stop_ann)
+        self.state = FIND_START
         self.is_repeat_start = 0
         self.wr = -1
-        self.bits = []
         self.addrflag = 0
 
+    def handle_skip_end(self):
+        if self.options['foreign'] != 'summary' or not self.addr_data_on:
+            return
+        # The SCL edges include the ACK/NACK bit of the address byte.
+        nbytes = 1 + self.skip_edges // 9
+        if self.samplerate:
+            duration = '%.1fus' % ((self.samplenum - self.skip_ss) * 1e6 / self.samplerate)
+        else:
+            duration = '%d samples' % (self.samplenum - self.skip_ss)
+        a = self.skip_addr
+        self.put(self.skip_ss, self.samplenum, self.out_ann, [44,
+            ['FOREIGN 0x%02X: %d BYTES, %s' % (a, nbytes, duration),
+             'FOREIGN 0x%02X: %d B' % (a, nbytes), 'F:%02X' % a, 'F']])
+
+    def put_field(self, data):
+        # Two-byte frame/APDU field, ending with the current byte.
+        self.frame_sp, self.frame_ep = self.field_sp, self.reg_ep
+        self.putx_frame(data)
+
+    def handle_fctr(self, fctr):
+        # Frame
+        if (fctr & 0x80) == 0x80:
+            self.putx_reg([15,['CONTROL FRAME','CTLF','CF','C']])
+        else:
+            self.putx_reg([16,['DATA FRAME','DATF','DF','D']])
+        # Header - FTYPE
+        self.frame_sp = self.reg_sp
+        offset = int((self.reg_ep - self.reg_sp)/8)
+        self.frame_ep = (self.reg_sp + (offset))
+        ftype = (fctr & 0x80) >> 8
+        self.putx_frame([17, ['FRAME TYPE:%X' % ftype,'FTYPE:%X' % ftype,'FT:%X' % ftype,'%X' % ftype]])
+        # Header - SEQCTR
+        self.frame_sp = self.frame_ep
+        self.frame_ep = (self.frame_sp + (offset * 2))
+        seqctr = (fctr & 0x60) >> 5
+        self.putx_frame([18, ['SEQCTR:%X' % seqctr,'SEQ:%X' % seqctr,'SQ:%X' % seqctr,'%X' % seqctr]])
+        # Header - RFU
+        self.frame_sp = self.frame_ep
+        self.frame_ep = (self.frame_sp + (offset))
+        rfu = (fctr & 0x10) >> 4
+        self.putx_frame([39, ['RFU:%X' % rfu,'R:%X' % rfu,'%X' % rfu]])
+        # Header - FRNR
+        self.frame_sp = self.frame_ep
+        self.frame_ep = (self.frame_sp + (offset * 2))
+        frnr = (fctr & 0x0C) >> 2
+        self.putx_frame([19, ['FRAME NUMBER:%X' % frnr,'FRNR:%X' % frnr,'FR:%X' % frnr,'%X' % frnr]])
+        # Header - ACKNR
+        self.frame_sp = self.frame_ep
+        self.frame_ep = (self.frame_sp + (offset * 2))
+        acknr = (fctr & 0x03)
+        self.putx_frame([20, ['ACKNR:%X' % acknr,'ACK:%X' % acknr,'AK:%X' % acknr,'%X' % acknr]])
+
+    def handle_frame_length(self, framelen):
+        self.put_field([21,['LENGTH:%d' % framelen,'LEN:%d' % framelen,
+                            'L:%d' % framelen,'%d' % framelen]])
+        if framelen > MAX_FRAME_LEN:
+            self.protocol_error('bad frame length', self.frame_sp, self.frame_ep)
+
+    def handle_frame_checksum(self, framecsum, crc):
+        self.put_field([24,['FRAME CHECKSUM:0x%04X' % framecsum,'FCS:0x%04X' % framecsum,'0x%04X' % framecsum]])
+        if framecsum == crc:
+            self.put_field([42,['FCS OK','OK']])
+        else:
+            # Running count of corrupted frames.
+            errors = self.frames.errors
+            self.put_field([42,['FCS ERROR:0x%04X, EXPECTED:0x%04X, BAD FRAMES:%d' % (framecsum, crc, errors),
+                                'FCS ERROR (%d)' % errors,'FCS ERR','E']])
+            self.protocol_error('bad frame checksum', self.frame_sp, self.frame_ep)
+
+    def handle_pctr(self, pctr):
+        # Frame PCTR
+        self.putx_reg([25, ['PACKET CONTROL BYTE','PCTR','PC','P']])
+        # Header - pctr channel
+        self.frame_sp = self.reg_sp
+        offset = int((self.reg_ep - self.reg_sp)/8)
+        self.frame_ep = (self.reg_sp + (offset * 4))
+        channel = (pctr & 0xf0) >> 4
+        self.putx_frame([26, ['CHANNEL:%X' % channel,'CHAN:%X' % channel,'CL:%X' % channel,'%X' % channel]])
+        # Header - pctr presence
+        self.frame_sp = self.frame_ep
+        self.frame_ep = (self.frame_sp + (offset))
+        pres = (pctr & 0x8) >> 3
+        self.putx_frame([28, ['PRESENCE:%X' % pres,'PRES:%X' % pres,'P:%X' % pres,'%X' % pres]])
+        # Header - pctr chaining
+        self.frame_sp = self.frame_ep
+        self.frame_ep = (self.frame_sp + (offset * 3))
+        chain = (pctr & 0x7)
+        self.putx_frame([27, ['CHAINING:%X' % chain,'CHAIN:%X' % chain,'CN:%X' % chain,'%X' % chain]])
+
+    def handle_sctr(self, sctr):
+        # Frame SCTR
+        self.putx_reg([25, ['SECURITY CONTROL BYTE','SCTR','SC','S']])
+        # Header - sctr protocol
+        self.frame_sp = self.reg_sp
+        offset = int((self.reg_ep - self.reg_sp)/8)
+        self.frame_ep = (self.reg_sp + (offset * 3))
+        sctr_proto = (sctr & 0xe0) >> 5
+        self.putx_frame([30, ['PROTOCOL:%X' % sctr_proto,'PROTO:%X' % sctr_proto,'PR:%X' % sctr_proto,'%X' % sctr_proto]])
+        # Header - sctr message
+        self.frame_sp = self.frame_ep
+        self.frame_ep = (self.frame_sp + (offset * 3))
+        sctr_message = (sctr & 0x8) >> 2
+        self.putx_frame([31, ['MESSAGE:%X' % sctr_message,'MESS:%X' % sctr_message,'MG:%X' % sctr_message,'%X' % sctr_message]])
+        # Header - sctr protection
+        self.frame_sp = self.frame_ep
+        self.frame_ep = (self.frame_sp + (offset * 2))
+        sctr_protection = (sctr & 0x3)
+        self.putx_frame([32, ['PROTECTION:%X' % sctr_protection,'PROTECT:%X' % sctr_protection,'PT:%X' % sctr_protection,'%X' % sctr_protection]])
+
+    def handle_packet_data(self, b):
+        self.putx_reg(self.frame_anns[b])
+        w = self.packets.write
+        if self.packets.first and len(self.packets.data) == 1:
+            self.message_ss[w] = self.reg_sp
+        self.message_es[w] = self.reg_ep
+
+    def handle_apdu_message(self, write, data):
+        if not self.python_on or len(data) < 4:
+            return
+        cmd, param, length, payload = parse_apdu(data)
+        ss, es = self.message_ss[write], self.message_es[write]
+        self.put(ss, es, self.out_python, ['APDU-COMMAND' if write else 'APDU-RESPONSE',
+            {'cmd': cmd, 'param': param, 'length': length, 'payload': payload,
+             'ss': ss, 'es': es}])
+
+    def handle_apdu_command(self, cmd):
+        # APDU - Command
+        ann = command_anns.get(cmd)
+        if ann:
+            self.putx_reg(ann)
+        else:
+            self.putx_reg(command_error_ann)
+            self.protocol_error('unknown command', self.reg_sp, self.reg_ep)
+
+    def handle_apdu_param(self, param):
+        # APDU - Param
+        self.putx_reg([35,['PARAM:0x%02X' % param,'PR:0x%02X' % param,'P:%02X' % param,'%02X' % param]])
+
+    def handle_apdu_length(self, apdulen):
+        # APDU - Length
+        self.put_field([36,['LENGTH:%d' % apdulen,'LEN:%d' % apdulen,'L:%d' % apdulen,'%d' % apdulen]])
+
+    def handle_apdu_data(self, b, write):
+        # APDU - Command data / Response
+        self.putx_reg(apdu_write_anns[b] if write else apdu_read_anns[b])
+
+    def handle_reg_data(self):
+        if not self.parse_register:
+            return
+        if self.regdatacnt > 2:
+            # Data
+            if self.addrbyte < 2:
+                # Register data
+                #I2C STATE
+                if self.reg == 0x82:
+                    if self.regdatacnt == 3:
+                        # check BUSY / RESP_RDY
+                        self.reg_i2c_state = (self.regdata & 0xC0) >> 6
+                        self.frame_sp = self.reg_sp
+                    if self.regdatacnt == 4:
+                        self.frame_ep = self.reg_ep
+                        if self.reg_i2c_state == 3:
+                            self.putx_frame([16,['BUSY/RESP_RDY','BZ/RR','B/R']])
+                        elif self.reg_i2c_state == 2:
+                            self.putx_frame([16,['BUSY','BZ','B']])
+                        elif self.reg_i2c_state == 1:
+                            self.putx_frame([16,['RESPONSE READY','RESP_RDY','RR']])
+                        else:
+                            self.putx_reg([16,['READY','RDY','R']])
+                    if self.regdatacnt == 5:
+                        self.frame_sp = self.reg_sp
+                        self.reg_len = self.regdata << 8
+                    if self.regdatacnt == 6:
+                        self.frame_ep = self.reg_ep
+                        self.reg_len += self.regdata
+                        self.putx_frame([21,['LENGTH:%d' % self.reg_len,'LEN:%d' % self.reg_len,
+                            'L:%d' % self.reg_len,'%d' % self.reg_len]])
+
+                    self.putx_reg(self.i2c_state_anns[self.regdata])
+
+                else:
+                    self.putx_reg(self.reg_anns[self.regdata])
+
+                if self.datalink == 1 and self.addrflag == 1:
+                    self.frames.feed(self.regdata, self.regdatacmd == DATA_WRITE)
+                    self.field_sp = self.reg_sp
+            else:
+                self.addrbyte = 0
+                self.regdatacnt -= 1
+
     def decode(self):
-        while True:
-            # State machine.
-            if self.state == 'FIND START':
-                # Wait for a START condition (S): SCL = high, SDA = falling.
-                self.wait({0: 'h', 1: 'f'})
-                self.handle_start()
-            elif self.state == 'FIND ADDRESS':
-                # Wait for any of the following conditions (or combinations):
-                #  a) Data sampling of receiver: SCL = rising, and/or
-                #  b) START condition (S): SCL = high, SDA = falling, and/or
-                #  c) STOP condition (P): SCL = high, SDA = rising
-                (scl, sda) = self.wait([{0: 'r'}, {0: 'h', 1: 'f'}, {0: 'h', 1: 'r'}])
-
-                # Check which of the condition(s) matched and handle them.
-                if (self.matched & (0b1 << 0)):
-                    self.handle_address_or_data(scl, sda)
-                elif (self.matched & (0b1 << 1)):
-                    self.handle_start()
-                elif (self.matched & (0b1 << 2)):
-                    self.handle_stop()
-            elif self.state == 'FIND DATA':
-                # Wait for any of the following conditions (or combinations):
-                #  a) Data sampling of receiver: SCL = rising, and/or
-                #  b) START condition (S): SCL = high, SDA = falling, and/or
-                #  c) STOP condition (P): SCL = high, SDA = rising
-                (scl, sda) = self.wait([{0: 'r'}, {0: 'h', 1: 'f'}, {0: 'h', 1: 'r'}])
-
-                # Check which of the condition(s) matched and handle them.
-                if (self.matched & (0b1 << 0)):
-                    self.handle_address_or_data(scl, sda)
-                elif (self.matched & (0b1 << 1)):
+        # Wait conditions, by state:
+        #  FIND START: START condition (S): SCL = high, SDA = falling.
+        #  FIND ADDRESS, FIND DATA: any of the following conditions (or
+        #   combinations):
+        #   a) Data sampling of receiver: SCL = rising, and/or
+        #   b) START condition (S): SCL = high, SDA = falling, and/or
+        #   c) STOP condition (P): SCL = high, SDA = rising
+        #  FIND ACK: a data/ack bit: SCL = rising.
+        #  SKIP TRANSACTION: START (S) / STOP (P) conditions end a skipped
+        #   foreign transaction, the SCL rising edges are only counted for
+        #   its summary.
+        skip_cond = [{0: 'h', 1: 'f'}, {0: 'h', 1: 'r'}]
+        if self.options['foreign'] == 'summary':
+            skip_cond.append({0: 'r'})
+        bit_cond = [{0: 'r'}, {0: 'h', 1: 'f'}, {0: 'h', 1: 'r'}]
+        conds = ({0: 'h', 1: 'f'}, bit_cond, bit_cond, {0: 'r'}, skip_cond)
+
+        try:
+            while True:
+                # State machine.
+                state = self.state
+                (scl, sda) = self.wait(conds[state])
+                if state == FIND_DATA or state == FIND_ADDRESS:
+                    # Check which of the condition(s) matched and handle them.
+                    matched = self.matched
+                    if (matched & (0b1 << 0)):
+                        self.handle_address_or_data(scl, sda)
+                    elif (matched & (0b1 << 1)):
+                        self.handle_start()
+                    elif (matched & (0b1 << 2)):
+                        self.handle_stop()
+                elif state == FIND_ACK:
+                    self.get_ack(scl, sda)
+                    self.handle_reg_data()
+                elif state == FIND_START:
                     self.handle_start()
-                elif (self.matched & (0b1 << 2)):
-                    self.handle_stop()
-            elif self.state == 'FIND ACK':
-                # Wait for a data/ack bit: SCL = rising.
-                (scl, sda) = self.wait({0: 'r'})
-                self.get_ack(scl, sda)
-                if self.regdatacnt > 2:
-                    # Data
-                    if self.addrbyte < 2:
-                        # Register data
-                        #I2C STATE
-                        if self.reg == 0x82:
-                            if self.regdatacnt == 3:
-                                # check BUSY / RESP_RDY
-                                self.reg_i2c_state = (self.regdata & 0xC0) >> 6
-                                self.frame_sp = self.reg_sp
-                            if self.regdatacnt == 4:
-                                self.frame_ep = self.reg_ep
-                                if self.reg_i2c_state == 3:
-                                    self.putx_frame([16,['BUSY/RESP_RDY','BZ/RR','B/R']])
-                                elif self.reg_i2c_state == 2:
-                                    self.putx_frame([16,['BUSY','BZ','B']])
-                                elif self.reg_i2c_state == 1:
-                                    self.putx_frame([16,['RESPONSE READY','RESP_RDY','RR']])
-                                else:
-                                    self.putx_reg([16,['READY','RDY','R']])
-                            if self.regdatacnt == 5:
-                                self.frame_sp = self.reg_sp
-                                self.reg_len = self.regdata << 8
-                            if self.regdatacnt == 6:
-                                self.frame_ep = self.reg_ep
-                                self.reg_len += self.regdata
-                                self.putx_frame([21,['LENGTH:%d' % self.reg_len,'LEN:%d' % self.reg_len,
-                                    'L:%d' % self.reg_len,'%d' % self.reg_len]])
-
-                            try:
-                                self.putx_reg([13, ['%s:0x%02X' % (regdata[self.regdatacmd][1], self.regdata),
-                                    '%s:%02X' % (regdata[self.regdatacmd][2], self.regdata), '%02X' % self.regdata]])
-                            except:
-                                self.putx_reg([43, ['PROTOCOL ERROR','ERROR','ERR','E']])
-
-                        else:
-                            try:
-                                self.putx_reg([regdata[self.regdatacmd][0], ['%s:0x%02X' % (regdata[self.regdatacmd][1], self.regdata),
-                                            '%s:%02X' % (regdata[self.regdatacmd][2], self.regdata), '%02X' % self.regdata]])
-                            except:
-                                self.putx_reg([43, ['PROTOCOL ERROR','ERROR','ERR','E']])
-
-                        if self.datalink == 1:
-                            # Frame
-                            if self.regdatacnt == 3:
-                                # Frame
-                                if (self.regdata & 0x80) == 0x80:
-                                    self.putx_reg([15,['CONTROL FRAME','CTLF','CF','C']])
-                                else:
-                                    self.putx_reg([16,['DATA FRAME','DATF','DF','D']])
-                                # Header - FTYPE
-                                self.frame_sp = self.reg_sp
-                                offset = int((self.reg_ep - self.reg_sp)/8)
-                                self.frame_ep = (self.reg_sp + (offset))
-                                ftype = (self.regdata & 0x80) >> 8
-                                self.putx_frame([17, ['FRAME TYPE:%X' % ftype,'FTYPE:%X' % ftype,'FT:%X' % ftype,'%X' % ftype]])
-                                # Header - SEQCTR
-                                self.frame_sp = self.frame_ep
-                                self.frame_ep = (self.frame_sp + (offset * 2))
-                                seqctr = (self.regdata & 0x60) >> 5
-                                self.putx_frame([18, ['SEQCTR:%X' % seqctr,'SEQ:%X' % seqctr,'SQ:%X' % seqctr,'%X' % seqctr]])
-                                # Header - RFU
-                                self.frame_sp = self.frame_ep
-                                self.frame_ep = (self.frame_sp + (offset))
-                                rfu = (self.regdata & 0x10) >> 4
-                                self.putx_frame([39, ['RFU:%X' % rfu,'R:%X' % rfu,'%X' % rfu]])
-                                # Header - FRNR
-                                self.frame_sp = self.frame_ep
-                                self.frame_ep = (self.frame_sp + (offset * 2))
-                                frnr = (self.regdata & 0x0C) >> 2
-                                self.putx_frame([19, ['FRAME NUMBER:%X' % frnr,'FRNR:%X' % frnr,'FR:%X' % frnr,'%X' % frnr]])
-                                # Header - ACKNR
-                                self.frame_sp = self.frame_ep
-                                self.frame_ep = (self.frame_sp + (offset * 2))
-                                acknr = (self.regdata & 0x03)
-                                self.putx_frame([20, ['ACKNR:%X' % acknr,'ACK:%X' % acknr,'AK:%X' % acknr,'%X' % acknr]])
-                            # Frame Length
-                            if (self.regdatacnt == 4):
-                                    self.frame_sp = self.reg_sp
-                                    self.framelen = self.regdata << 8
-                            if (self.regdatacnt == 5):
-                                    self.frame_ep = self.reg_ep
-                                    self.framelen += self.regdata
-                                    self.putx_frame([21,['LENGTH:%d' % self.framelen,'LEN:%d' % self.framelen,
-                                                            'L:%d' % self.framelen,'%d' % self.framelen]])
-                            # Frame PCTR
-                            if (self.regdatacnt > 5) and (self.regdatacnt < (5+self.framelen+1)):
-                                    if (self.regdatacnt == 6):
-                                        # Frame PCTR
-                                        self.putx_reg([25, ['PACKET CONTROL BYTE','PCTR','PC','P']])
-                                        # Header - pctr channel
-                                        self.frame_sp = self.reg_sp
-                                        offset = int((self.reg_ep - self.reg_sp)/8)
-                                        self.frame_ep = (self.reg_sp + (offset * 4))
-                                        channel = (self.regdata & 0xf0) >> 4
-                                        self.putx_frame([26, ['CHANNEL:%X' % channel,'CHAN:%X' % channel,'CL:%X' % channel,'%X' % channel]])
-                                        # Header - pctr presence
-                                        self.frame_sp = self.frame_ep
-                                        self.frame_ep = (self.frame_sp + (offset))
-                                        self.pctr_pres = (self.regdata & 0x8) >> 3
-                                        self.putx_frame([28, ['PRESENCE:%X' % self.pctr_pres,'PRES:%X' % self.pctr_pres,'P:%X' % self.pctr_pres,'%X' % self.pctr_pres]])
-                                        # Header - pctr chaining
-                                        self.frame_sp = self.frame_ep
-                                        self.frame_ep = (self.frame_sp + (offset * 3))
-                                        chain = (self.regdata & 0x7)
-                                        self.pctr_chain = chain
-                                        self.putx_frame([27, ['CHAINING:%X' % chain,'CHAIN:%X' % chain,'CN:%X' % chain,'%X' % chain]])
-                                    elif (self.regdatacnt == 7):
-                                        if self.pctr_pres == 1:
-                                            # Frame SCTR
-                                            self.putx_reg([25, ['SECURITY CONTROL BYTE','SCTR','SC','S']])
-                                            # Header - sctr protocol
-                                            self.frame_sp = self.reg_sp
-                                            offset = int((self.reg_ep - self.reg_sp)/8)
-                                            self.frame_ep = (self.reg_sp + (offset * 3))
-                                            sctr_proto = (self.regdata & 0xe0) >> 5
-                                            self.putx_frame([30, ['PROTOCOL:%X' % sctr_proto,'PROTO:%X' % sctr_proto,'PR:%X' % sctr_proto,'%X' % sctr_proto]])
-                                            # Header - sctr message
-                                            self.frame_sp = self.frame_ep
-                                            self.frame_ep = (self.frame_sp + (offset * 3))
-                                            sctr_message = (self.regdata & 0x8) >> 2
-                                            self.sctr_message = sctr_message
-                                            self.putx_frame([31, ['MESSAGE:%X' % sctr_message,'MESS:%X' % sctr_message,'MG:%X' % sctr_message,'%X' % sctr_message]])
-                                            # Header - sctr protection
-                                            self.frame_sp = self.frame_ep
-                                            self.frame_ep = (self.frame_sp + (offset * 2))
-                                            sctr_protection = (self.regdata & 0x3)
-                                            self.sctr_protection = sctr_protection
-                                            self.putx_frame([32, ['PROTECTION:%X' % sctr_protection,'PROTECT:%X' % sctr_protection,'PT:%X' % sctr_protection,'%X' % sctr_protection]])
-                                        else:
-                                            try:
-                                                self.putx_reg([framedata[self.regdatacmd][0], ['%s:0x%02X' % (framedata[self.regdatacmd][1], self.regdata),
-                                                    '%s:%02X' % (framedata[self.regdatacmd][2], self.regdata), '%02X' % self.regdata]])
-                                            except:
-                                                self.putx_reg([42, ['PROTOCOL ERROR','ERROR','ERR','E']])
-                                    else:
-                                        try:
-                                            self.putx_reg([framedata[self.regdatacmd][0], ['%s:0x%02X' % (framedata[self.regdatacmd][1], self.regdata),
-                                                '%s:%02X' % (framedata[self.regdatacmd][2], self.regdata), '%02X' % self.regdata]])
-                                        except:
-                                            self.putx_reg([42, ['PROTOCOL ERROR','ERROR','ERR','E']])
-
-                                    # Application Layer
-                                    if self.pctr_pres == 1:
-                                        if (self.pctr_chain == 0) and ((self.sctr_protection & 0x01) == 0x00) and (self.sctr_message == 0) and (self.regdatacmd == 'DATA WRITE'):
-                                            # APDU - Command
-                                            if (self.regdatacnt == 8):
-                                                try:
-                                                    self.putx_reg([command[self.regdata][0], ['%s:0x%02X' % (command[self.regdata][1], self.regdata),
-                                                        '%s:0x%02X' % (command[self.regdata][2], self.regdata), '%s:%02X' % (command[self.regdata][3], self.regdata), '%02X' % self.regdata]])
-                                                except:
-                                                    self.putx_reg([40, ['PROTOCOL ERROR','ERROR','ERR','E']])
-
-                                            # APDU - Param
-                                            if (self.regdatacnt == 9):
-                                                self.putx_reg([35,['PARAM:0x%02X' % self.regdata,'PR:0x%02X' % self.regdata,'P:%02X' % self.regdata,'%02X' % self.regdata]])
-                                            # APDU - Length
-                                            if (self.regdatacnt == 10):
-                                                self.frame_sp = self.reg_sp
-                                                self.apdulen = self.regdata << 8
-                                            if (self.regdatacnt == 11):
-                                                self.frame_ep = self.reg_ep
-                                                self.apdulen += self.regdata
-                                                self.putx_frame([36,['LENGTH:%d' % self.apdulen,'LEN:%d' % self.apdulen,'L:%d' % self.apdulen,'%d' % self.apdulen]])
-                                            elif (self.regdatacnt > 11) and (self.regdatacnt < (11 + self.apdulen + 1)):
-                                                try:
-                                                    self.putx_reg([38, ['%s:0x%02X' % (framedata[self.regdatacmd][1], self.regdata),
-                                                        '%s:%02X' % (framedata[self.regdatacmd][2], self.regdata), '%02X' % self.regdata]])
-                                                except:
-                                                    self.putx_reg([40, ['PROTOCOL ERROR','ERROR','ERR','E']])
-
-                                        if ((self.sctr_protection & 0x02) == 0x00) and (self.regdatacmd == 'DATA READ'):
-                                            # APDU - Response
-                                            # Skip the pctr and sctr
-                                            if(self.regdatacnt != 6) and (self.regdatacnt != 7):
-                                                try:
-                                                    self.putx_reg([37, ['%s:0x%02X' % (framedata[self.regdatacmd][1], self.regdata),
-                                                        '%s:%02X' % (framedata[self.regdatacmd][2], self.regdata), '%02X' % self.regdata]])
-                                                except:
-                                                    self.putx_reg([40, ['PROTOCOL ERROR','ERROR','ERR','E']])
-                                    else:
-                                            # APDU - Command
-                                        if (self.regdatacmd == 'DATA WRITE'):
-                                            if (self.regdatacnt == 7):
-                                                try:
-                                                    self.putx_reg([command[self.regdata][0], ['%s:0x%02X' % (command[self.regdata][1], self.regdata),
-                                                        '%s:0x%02X' % (command[self.regdata][2], self.regdata), '%s:%02X' % (command[self.regdata][3], self.regdata), '%02X' % self.regdata]])
-                                                except:
-                                                    self.putx_reg([40, ['PROTOCOL ERROR','ERROR','ERR','E']])
-
-                                            # APDU - Param
-                                            if (self.regdatacnt == 8):
-                                                self.putx_reg([35,['PARAM:0x%02X' % self.regdata,'PR:0x%02X' % self.regdata,'P:%02X' % self.regdata,'%02X' % self.regdata]])
-                                            # APDU - Length
-                                            if (self.regdatacnt == 9):
-                                                self.frame_sp = self.reg_sp
-                                                self.apdulen = self.regdata << 8
-                                            if (self.regdatacnt == 11):
-                                                self.frame_ep = self.reg_ep
-                                                self.apdulen += self.regdata
-                                                self.putx_frame([36,['LENGTH:%d' % self.apdulen,'LEN:%d' % self.apdulen,'L:%d' % self.apdulen,'%d' % self.apdulen]])
-                                            elif (self.regdatacnt > 11) and (self.regdatacnt < (11 + self.apdulen + 1)):
-                                                try:
-                                                    self.putx_reg([38, ['%s:0x%02X' % (framedata[self.regdatacmd][1], self.regdata),
-                                                        '%s:%02X' % (framedata[self.regdatacmd][2], self.regdata), '%02X' % self.regdata]])
-                                                except:
-                                                    self.putx_reg([40, ['PROTOCOL ERROR','ERROR','ERR','E']])
-
-                                        if (self.regdatacmd == 'DATA READ'):
-                                            # APDU - Response
-                                            # Skip the pctr
-                                            if(self.regdatacnt != 6):
-                                                try:
-                                                    self.putx_reg([37, ['%s:0x%02X' % (framedata[self.regdatacmd][1], self.regdata),
-                                                        '%s:%02X' % (framedata[self.regdatacmd][2], self.regdata), '%02X' % self.regdata]])
-                                                except:
-                                                    self.putx_reg([40, ['PROTOCOL ERROR','ERROR','ERR','E']])
-
-                            # Frame Checksum
-                            if (self.regdatacnt == (5+self.framelen+1)):
-                                    self.frame_sp = self.reg_sp
-                                    self.framecsum = self.regdata << 8
-                            if (self.regdatacnt == (5+self.framelen+2)):
-                                    self.frame_ep = self.reg_ep
-                                    self.framecsum += self.regdata
-                                    self.putx_frame([24,['FRAME CHECKSUM:0x%04X' % self.framecsum,'FCS:0x%04X' % self.framecsum,'0x%04X' % self.framecsum]])
+                else:
+                    matched = self.matched
+                    if (matched & (0b1 << 0)):
+                        self.handle_skip_end()
+                        self.handle_start()
+                    elif (matched & (0b1 << 1)):
+                        self.handle_skip_end()
+                        self.handle_stop()
                     else:
-                        self.addrbyte = 0
-                        self.regdatacnt -= 1
-
-            if self.regdatacnt == 1 and (self.addrflag == 1):
-                try:
-                    self.putx_reg([reg[self.reg][0], [reg[self.reg][1], reg[self.reg][2]]])
-                except:
-                    self.putx_reg([43, ['PROTOCOL ERROR','ERROR','ERR','E']])
-                self.regdatacnt += 1
-                self.datalink = 0
-                if self.reg == 0x80:
-                    self.datalink = 1
+                        self.skip_edges += 1
+        except EOFError:
+            # No more samples.
+            self.finish()
+
+    def handle_bulk_start(self, samplenum):
+        self.samplenum = samplenum
+        self.handle_start()
+
+    def handle_bulk_stop(self, samplenum):
+        self.samplenum = samplenum
+        self.handle_stop()
+
+    def handle_bulk_skip_end(self, samplenum, edges):
+        self.samplenum = samplenum
+        self.skip_edges = edges
+        self.handle_skip_end()
+
+    def handle_bulk_bit(self, samplenum, sda):
+        self.samplenum = samplenum
+        self.handle_address_or_data(1, sda)
+        if self.state == SKIP_TRANSACTION:
+            self.extractor.skip()
+
+    def handle_bulk_byte(self, value, samples):
+        # Same bits and guesstimated endsamples as handle_address_or_data()
+        # produces.
+        self.bitwidth = samples[7] - samples[6]
+        self.bit_ss[:] = samples
+        self.bit_es[:7] = samples[1:]
+        self.bit_es[7] = samples[7] + self.bitwidth
+        self.databyte = value
+        self.pdu_bits += 8
+        self.ss_byte, self.samplenum = samples[0], samples[7]
+        self.handle_byte()
+        if self.state == SKIP_TRANSACTION:
+            self.extractor.skip()
+
+    def handle_bulk_ack(self, samplenum, sda):
+        self.samplenum = samplenum
+        self.get_ack(1, sda)
+        self.handle_reg_data()
+
+    def decode_chunk(self, scl, sda):
+        # Alternative to decode() for hosts which have the samples at hand:
+        # feed consecutive chunks of SCL/SDA sample arrays and the edges and
+        # START/STOP conditions are located per chunk with NumPy, so whole
+        # bytes reach handle_byte(). Annotations and outputs are the same
+        # as with decode().
+        if self.extractor is None:
+            from .bulk import I2cExtractor
+            # START/STOP are also looked for while the address byte is received.
+            self.extractor = I2cExtractor(True,
+                self.handle_bulk_start, self.handle_bulk_stop,
+                self.handle_bulk_skip_end, self.handle_bulk_bit, self.handle_bulk_byte,
+                self.handle_bulk_ack)
+        self.extractor.feed(scl, sda)
@@ -0,0 +1,281 @@
+##
+## This file is part of the libsigrokdecode project.
+##
+## This program is free software; you can redistribute it and/or modify
+## it under the terms of the GNU General Public License as published by
+## the Free Software Foundation; either version 2 of the License, or
+## (at your option) any later version.
+##
+## This program is distributed in the hope that it will be useful,
+## but WITHOUT ANY WARRANTY; without even the implied warranty of
+## MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+## GNU General Public License for more details.
+##
+## You should have received a copy of the GNU General Public License
+## along with this program; if not, see <http://www.gnu.org/licenses/>.
+##
+
+'''
+OPTIGA Trust M I2C protocol stack: frame, packet and APDU layers.
+
+The bytes of the DATA register are fed to the frame (data link) layer one
+at a time, together with their direction. Each layer keeps its own
+position, buffers its bytes and reports its fields through callbacks once
+their last byte is in; its payload bytes are passed on to the layer above
+it as they come in:
+
+ - FrameLayer: FCTR, LEN (2 bytes), packet, FCS (2 bytes). The FCS is
+   computed as the frame comes in and checked against the received one.
+ - PacketLayer: PCTR, SCTR (only if the PCTR presentation bit is set),
+   APDU. Chained packets are reassembled into whole APDUs, one per
+   direction. Retransmitted frames (same frame number as the frame before
+   in that direction) are not added again, and a corrupted or missing
+   frame drops the chain it belongs to.
+ - ApduLayer: command Cmd, Param, InLen (2 bytes), InData. Responses are
+   passed on as data only.
+
+Nothing here depends on sigrok, so the layers can be used on byte strings
+as well, e.g.:
+
+    frames = FrameLayer(on_checksum=print)
+    frames.feed_bytes(data, True)
+'''
+
+def ignore(*args):
+    pass
+
+# Frame checksum: CRC-16, reflected polynomial 0x8408 (x^16 + x^12 + x^5 + 1),
+# seed 0, over FCTR, LEN and the packet, sent MSB first. Updated a byte at a
+# time with crc = (crc >> 8) ^ fcs_table[(crc ^ b) & 0xff].
+def fcs_entry(i):
+    for _ in range(8):
+        i = (i >> 1) ^ 0x8408 if (i & 1) else (i >> 1)
+    return i
+
+fcs_table = tuple(fcs_entry(i) for i in range(256))
+
+# FCTR fields: frame type, SEQCTR of control frames, frame number.
+FCTR_CONTROL = 0x80
+FCTR_SEQCTR, SEQCTR_RESYNC = 0x60, 0x40
+
+def frame_number(fctr):
+    return (fctr >> 2) & 0x03
+
+# PCTR chaining field.
+CHAIN_NONE, CHAIN_FIRST, CHAIN_INTERMEDIATE, CHAIN_LAST = 0x00, 0x01, 0x02, 0x04
+
+def parse_apdu(data):
+    # (Cmd, Param, InLen, InData) of a command APDU, or (Sta, UnDef, OutLen,
+    # OutData) of a response APDU.
+    length = int.from_bytes(data[2:4], 'big')
+    return data[0], data[1], length, bytes(data[4:4 + length])
+
+class ApduLayer:
+    def __init__(self, on_command=ignore, on_param=ignore, on_length=ignore,
+                 on_data=ignore):
+        # on_command(cmd), on_param(param), on_length(inlen): command APDU
+        #                                                    header fields.
+        # on_data(b, write): command InData or response byte.
+        self.on_command = on_command
+        self.on_param = on_param
+        self.on_length = on_length
+        self.on_data = on_data
+        self.reset()
+
+    def reset(self):
+        self.pos = 0
+        self.header = bytearray(4)
+        self.data = bytearray()
+        self.length = 0
+        self.end = 0
+
+    def feed(self, b, write):
+        pos = self.pos
+        self.pos = pos + 1
+        if not write:
+            self.data.append(b)
+            self.on_data(b, False)
+        elif pos < 4:
+            self.header[pos] = b
+            if pos == 0:
+                self.on_command(b)
+            elif pos == 1:
+                self.on_param(b)
+            elif pos == 3:
+                self.length = int.from_bytes(self.header[2:4], 'big')
+                self.end = 4 + self.length
+                self.on_length(self.length)
+        elif pos < self.end:
+            self.data.append(b)
+            self.on_data(b, True)
+
+class PacketLayer:
+    def __init__(self, on_pctr=ignore, on_sctr=ignore, on_data=ignore,
+                 apdus=None, on_message=ignore):
+        # on_pctr(pctr), on_sctr(sctr): packet header bytes.
+        # on_data(b): packet payload byte.
+        # apdus: layer the payload is passed on to, or None.
+        # on_message(write, data): whole unprotected APDU, reassembled from
+        #                          its chained packets.
+        self.on_pctr = on_pctr
+        self.on_sctr = on_sctr
+        self.on_data = on_data
+        self.apdus = apdus
+        self.on_message = on_message
+        # APDU being reassembled, by direction (read, write), or None.
+        self.messages = [None, None]
+        # Number of the last good data frame, by direction, or None.
+        self.frnr = [None, None]
+        self.reset()
+
+    def reset(self):
+        self.pos = 0
+        self.pctr = self.sctr = 0
+        self.header_len = 1
+        self.first = True
+        self.write = False
+        self.data = bytearray()
+        # Whether the payload is unprotected, and whether it is passed on
+        # as an APDU, by direction (read, write). Protected or chained
+        # protected payloads are not.
+        self.plain = self.apdu_on = (False, False)
+
+    def start_payload(self):
+        if self.header_len == 1:
+            self.plain = self.apdu_on = (True, True)
+        else:
+            chain = self.pctr & 0x07
+            self.plain = ((self.sctr & 0x02) == 0, (self.sctr & 0x09) == 0)
+            self.apdu_on = (self.plain[0], self.plain[1] and chain == CHAIN_NONE)
+
+    def resync(self):
+        # Both sides start over with frame number 0, chains are dropped.
+        self.messages = [None, None]
+        self.frnr = [None, None]
+
+    def end(self, valid, frnr=None):
+        # The frame is complete, valid tells whether its checksum matched,
+        # frnr is its frame number (None: not checked).
+        # Add the payload of a good frame to the APDU of its direction.
+        w = self.write
+        if not valid:
+            # Whatever was reassembled so far can no longer be completed.
+            self.messages[w] = None
+            return
+        in_sequence = True
+        if frnr is not None:
+            last, self.frnr[w] = self.frnr[w], frnr
+            if frnr == last:
+                # Retransmission of a frame already handled.
+                return
+            in_sequence = last is None or frnr == (last + 1) & 0x03
+        if not self.plain[w]:
+            return
+        chain = self.pctr & 0x07
+        if self.first:
+            self.messages[w] = self.data
+        elif self.messages[w] is None:
+            # The start of the APDU was missed.
+            return
+        elif not in_sequence:
+            # A frame of the chain is missing.
+            self.messages[w] = None
+            return
+        else:
+            self.messages[w] += self.data
+        if chain == CHAIN_NONE or chain == CHAIN_LAST:
+            data, self.messages[w] = self.messages[w], None
+            self.on_message(w, data)
+
+    def feed(self, b, write):
+        pos = self.pos
+        self.pos = pos + 1
+        self.write = write
+        if pos == 0:
+            self.pctr = b
+            self.header_len = 2 if (b & 0x08) else 1
+            chain = b & 0x07
+            self.first = chain == CHAIN_NONE or chain == CHAIN_FIRST
+            # Further packets of a chain carry on with the same APDU.
+            if self.first and self.apdus:
+                self.apdus.reset()
+            self.on_pctr(b)
+            if self.header_len == 1:
+                self.start_payload()
+        elif pos < self.header_len:
+            self.sctr = b
+            self.on_sctr(b)
+            self.start_payload()
+        else:
+            self.data.append(b)
+            self.on_data(b)
+            if self.apdus and self.apdu_on[write]:
+                self.apdus.feed(b, write)
+
+class FrameLayer:
+    def __init__(self, on_fctr=ignore, on_length=ignore, on_checksum=ignore,
+                 packets=None):
+        # on_fctr(fctr), on_length(length): frame header fields.
+        # on_checksum(fcs, crc): received and computed frame checksum, once
+        #                       the frame is complete.
+        # packets: layer the packet is passed on to (and told when the
+        #          frame is complete), or None.
+        self.on_fctr = on_fctr
+        self.on_length = on_length
+        self.on_checksum = on_checksum
+        self.packets = packets
+        # Frames with a wrong checksum so far.
+        self.errors = 0
+        self.reset()
+
+    def reset(self):
+        self.pos = 0
+        self.data = bytearray()
+        self.length = 0
+        self.crc = 0
+        # Position of the FCS, not known before LEN is in.
+        self.fcs_pos = 3
+        if self.packets:
+            self.packets.reset()
+
+    def complete(self):
+        return self.pos >= self.fcs_pos + 2
+
+    def feed(self, b, write):
+        pos = self.pos
+        self.pos = pos + 1
+        if pos < self.fcs_pos:
+            self.crc = (self.crc >> 8) ^ fcs_table[(self.crc ^ b) & 0xff]
+        if pos < 3:
+            self.data.append(b)
+            if pos == 0:
+                self.on_fctr(b)
+            elif pos == 2:
+                self.length = int.from_bytes(self.data[1:3], 'big')
+                self.fcs_pos = 3 + self.length
+                self.on_length(self.length)
+        elif pos < self.fcs_pos:
+            self.data.append(b)
+            if self.packets:
+                self.packets.feed(b, write)
+        elif pos < self.fcs_pos + 2:
+            self.data.append(b)
+            if pos > self.fcs_pos:
+                fcs = int.from_bytes(self.data[-2:], 'big')
+                if fcs != self.crc:
+                    self.errors += 1
+                self.on_checksum(fcs, self.crc)
+                if self.packets:
+                    self.end_packet(fcs == self.crc)
+
+    def end_packet(self, valid):
+        fctr = self.data[0]
+        if self.length:
+            self.packets.end(valid, frame_number(fctr))
+        elif valid and (fctr & FCTR_CONTROL) and \
+                (fctr & FCTR_SEQCTR) == SEQCTR_RESYNC:
+            self.packets.resync()
+
+    def feed_bytes(self, data, write):
+        for b in data:
+            self.feed(b, write)
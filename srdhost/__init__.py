@@ -0,0 +1,34 @@
+##
+## This file is part of the libsigrokdecode project.
+##
+## This program is free software; you can redistribute it and/or modify
+## it under the terms of the GNU General Public License as published by
+## the Free Software Foundation; either version 2 of the License, or
+## (at your option) any later version.
+##
+## This program is distributed in the hope that it will be useful,
+## but WITHOUT ANY WARRANTY; without even the implied warranty of
+## MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+## GNU General Public License for more details.
+##
+## You should have received a copy of the GNU General Public License
+## along with this program; if not, see <http://www.gnu.org/licenses/>.
+##
+
+'''
+Minimal sigrokdecode host for the decoders in this repository.
+
+PulseView, DSView and sigrok-cli run the decoders through libsigrokdecode.
+This package runs them on capture files without any of those:
+
+ - captures: reads the session files PulseView and DSView save.
+ - edges: serves the decoders' wait() from the edges of the capture.
+ - sigrokdecode: the part of the libsigrokdecode module the decoders use
+   (Decoder, OUTPUT_* and SRD_CONF_SAMPLERATE).
+ - host: loads a decoder, sets its options and collects its output, fed
+   from the whole capture, chunk by chunk or through the pipeline.
+ - pipeline: reads the capture and decodes it in separate threads.
+ - edgecache: keeps the edges of captures on disk between runs.
+
+python -m srdhost DECODER CAPTURE prints the annotations like sigrok-cli.
+'''
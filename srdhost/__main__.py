@@ -0,0 +1,93 @@
+##
+## This file is part of the libsigrokdecode project.
+##
+## This program is free software; you can redistribute it and/or modify
+## it under the terms of the GNU General Public License as published by
+## the Free Software Foundation; either version 2 of the License, or
+## (at your option) any later version.
+##
+## This program is distributed in the hope that it will be useful,
+## but WITHOUT ANY WARRANTY; without even the implied warranty of
+## MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+## GNU General Public License for more details.
+##
+## You should have received a copy of the GNU General Public License
+## along with this program; if not, see <http://www.gnu.org/licenses/>.
+##
+
+'''
+Command line: decode a capture file and print the annotations the way
+sigrok-cli --protocol-decoder-samplenum does, e.g.
+
+    python -m srdhost ifx_trustm_PULSEVIEW/ifx_trustm trustm_chipinfo.sr \
+        -A apdu-cmd:apdu-param:apdu-len
+'''
+
+import argparse
+import sys
+import zipfile
+
+from .captures import open_capture
+from .edgecache import EdgeCache
+from .host import decode_file, load_decoder, methods, option_values
+
+def pairs(values, what):
+    # 'key=value' arguments as a dict.
+    result = {}
+    for value in values:
+        key, sep, rest = value.partition('=')
+        if not sep:
+            raise ValueError('%s: expected %s=VALUE, got %r' % (what, what.upper(), value))
+        result[key] = rest
+    return result
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m srdhost',
+                                     description='Run a decoder on a .sr or .dsl capture.')
+    parser.add_argument('decoder', help='decoder directory, the one with pd.py')
+    parser.add_argument('capture', help='PulseView .sr or DSView .dsl file')
+    parser.add_argument('-O', '--option', action='append', default=[],
+                        metavar='ID=VALUE', help='decoder option')
+    parser.add_argument('-C', '--channel', action='append', default=[],
+                        metavar='ID=PROBE', help='probe of a decoder channel')
+    parser.add_argument('-A', '--annotations', metavar='CLASS[:CLASS...]',
+                        help='annotation classes to print (default: all)')
+    parser.add_argument('-m', '--method', choices=methods, default='decode',
+                        help='how the samples are fed to the decoder')
+    parser.add_argument('--cache', action='store_true',
+                        help='keep the edges of the capture in the edge cache')
+    parser.add_argument('--report', action='store_true',
+                        help='print the pipeline stage report to stderr')
+    args = parser.parse_args(argv)
+
+    try:
+        decoder_class = load_decoder(args.decoder)
+        options = pairs(args.option, 'option')
+        names = pairs(args.channel, 'channel')
+        option_values(decoder_class, options)
+        with open_capture(args.capture) as capture:
+            capture.channel_map(decoder_class.channels, names)
+    except (ImportError, KeyError, ValueError, OSError, zipfile.BadZipFile) as e:
+        parser.error(str(e))
+    classes = [a[-2] for a in decoder_class.annotations]
+    wanted = None
+    if args.annotations:
+        # sigrok-cli's 'decoder=class:class' form is taken as well.
+        shown = args.annotations.split('=')[-1].split(':')
+        unknown = [c for c in shown if c not in classes]
+        if unknown:
+            parser.error('unknown annotation class: %s' % ', '.join(unknown))
+        wanted = set(classes.index(c) for c in shown)
+
+    cache = EdgeCache() if args.cache else None
+    session = decode_file(args.decoder, args.capture, options, names, args.method,
+                          cache=cache)
+    label = '%s-1' % decoder_class.id
+    for ss, es, cls, texts in session.annotations():
+        if wanted is None or cls in wanted:
+            print('%d-%d %s: %s' % (ss, es, label, texts[0]))
+    if args.report and session.pipeline:
+        print(session.pipeline.report(), file=sys.stderr)
+
+if __name__ == '__main__':
+    main()
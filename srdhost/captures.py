@@ -0,0 +1,312 @@
+##
+## This file is part of the libsigrokdecode project.
+##
+## This program is free software; you can redistribute it and/or modify
+## it under the terms of the GNU General Public License as published by
+## the Free Software Foundation; either version 2 of the License, or
+## (at your option) any later version.
+##
+## This program is distributed in the hope that it will be useful,
+## but WITHOUT ANY WARRANTY; without even the implied warranty of
+## MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+## GNU General Public License for more details.
+##
+## You should have received a copy of the GNU General Public License
+## along with this program; if not, see <http://www.gnu.org/licenses/>.
+##
+
+'''
+Readers for the session files PulseView (.sr) and DSView (.dsl) save.
+
+Both come out the same way: the probes are mapped to decoder channels by
+name, and the samples are read a chunk at a time as one array of 0/1
+values per channel, so a capture is never held in memory as a whole.
+The chunks are what the decoders' decode_chunk() takes, and what the
+edge extraction in srdhost.edges is built from:
+
+    capture = open_capture('TPM_STARTUP_CLEAR.dsl')
+    for clk, miso, mosi, cs in capture.chunks(Decoder.channels):
+        ...
+
+PulseView/sigrok session files (SrCapture) are a zip archive with a
+'metadata' INI file (samplerate, probe names, unitsize) and the logic
+samples, split into numbered 'logic-1-1', 'logic-1-2', ... members of
+unitsize bytes per sample. The members are inflated one at a time, a
+few of them ahead of the consumer by a worker thread.
+
+DSView session files (DslCapture) are a zip archive with a 'header' INI
+file (samplerate, total samples, total blocks, probe names) and the
+logic samples stored per probe and per block: member 'L-<probe>/<block>'
+is the bitplane of one probe for one block, eight samples per byte, LSB
+first. Only the probes mapped to decoder channels are read at all. Their
+blocks are independent of each other, so they are inflated and unpacked
+in a pool of worker threads (zlib and NumPy do the work without holding
+the GIL), a few blocks ahead of the consumer.
+'''
+
+import configparser
+import os
+import queue
+import re
+import threading
+import zipfile
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+# Sample words by unitsize, little endian.
+word_types = {1: np.uint8, 2: np.dtype('<u2'), 4: np.dtype('<u4')}
+
+rate_units = {'': 1, 'k': 10**3, 'm': 10**6, 'g': 10**9}
+
+def parse_samplerate(text):
+    # '1 GHz', '100 MHz', '10 kHz', '500 Hz' (or a bare number) in Hz.
+    m = re.match(r'\s*([\d.]+)\s*([kmg]?)(hz)?\s*$', text, re.IGNORECASE)
+    if not m:
+        raise ValueError('bad samplerate: %r' % text)
+    return int(float(m.group(1)) * rate_units[m.group(2).lower()])
+
+def plain_name(name):
+    # Probe and channel names are compared without case and punctuation,
+    # e.g. 'CS#' and 'cs'.
+    return re.sub(r'[^0-9a-z]', '', name.lower())
+
+def match_probe(channel, probes):
+    # Probe for a decoder channel: the one named like the channel id or
+    # name, else the only one with the channel id in its name (e.g. 'SCLK'
+    # for 'clk'), else None.
+    if isinstance(channel, dict):
+        keys = {plain_name(channel['id']), plain_name(channel['name'])}
+    else:
+        keys = {plain_name(channel)}
+    for name in probes:
+        if plain_name(name) in keys:
+            return name
+    found = [name for name in probes if any(k in plain_name(name) for k in keys)]
+    return found[0] if len(found) == 1 else None
+
+def map_channels(channels, probes, names=None):
+    # Probe of each decoder channel (ids or the decoders' channel dicts),
+    # by value of probes (probe name -> number), None for channels without
+    # a probe. names: probe name by channel id, overrides the name
+    # matching.
+    found = []
+    for channel in channels:
+        cid = channel['id'] if isinstance(channel, dict) else channel
+        if names and cid in names:
+            name = names[cid]
+            if name not in probes:
+                raise KeyError('no probe %r in the capture' % name)
+        else:
+            name = match_probe(channel, probes)
+        found.append(None if name is None else probes[name])
+    return found
+
+def read_ahead(items, depth):
+    # Iterate over items in a worker thread, at most depth items ahead of
+    # the consumer. Exceptions are raised in the consumer. Stopping early
+    # (break, close()) lets the worker thread end as well.
+    q = queue.Queue(depth)
+    stop = threading.Event()
+    done = object()
+
+    def put(item):
+        while not stop.is_set():
+            try:
+                q.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def work():
+        try:
+            for item in items:
+                if not put((item, None)):
+                    return
+            put((done, None))
+        except BaseException as e:
+            put((done, e))
+
+    worker = threading.Thread(target=work, daemon=True)
+    worker.start()
+    try:
+        while True:
+            item, error = q.get()
+            if error is not None:
+                raise error
+            if item is done:
+                return
+            yield item
+    finally:
+        stop.set()
+        worker.join()
+
+class SrCapture:
+    def __init__(self, path):
+        self.zip = zipfile.ZipFile(path)
+        meta = configparser.ConfigParser(interpolation=None)
+        meta.read_string(self.zip.read('metadata').decode('utf-8'))
+        # Only the first device is read, sigrok writes a single one.
+        device = meta[[s for s in meta.sections() if s.startswith('device ')][0]]
+        self.samplerate = parse_samplerate(device.get('samplerate', '0'))
+        self.unitsize = int(device.get('unitsize', '1'))
+        if self.unitsize not in word_types:
+            raise ValueError('unsupported unitsize: %d' % self.unitsize)
+        # Probe names and their bit numbers within the sample words.
+        self.probes = {}
+        for key, name in device.items():
+            m = re.match(r'probe(\d+)$', key)
+            if m:
+                self.probes[name] = int(m.group(1)) - 1
+        # Sample members, in order: 'logic-1' on its own or 'logic-1-<n>'.
+        capturefile = device.get('capturefile', 'logic-1')
+        numbered = re.compile(re.escape(capturefile) + r'(?:-(\d+))?$')
+        members = []
+        for name in self.zip.namelist():
+            m = numbered.match(name)
+            if m:
+                members.append((int(m.group(1) or 0), name))
+        self.members = [name for n, name in sorted(members)]
+
+    def close(self):
+        self.zip.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def num_samples(self):
+        return sum(self.zip.getinfo(name).file_size for name in self.members) // self.unitsize
+
+    def channel_map(self, channels, names=None):
+        # Bit numbers of the probes for decoder channels, see
+        # map_channels().
+        return map_channels(channels, self.probes, names)
+
+    def words(self, readahead=2):
+        # Sample words (uint8 for unitsize 1, uint16 for unitsize 2), one
+        # array per member. Members are inflated in a worker thread, at
+        # most readahead of them ahead.
+        return read_ahead(self.inflate(), readahead)
+
+    def inflate(self):
+        rest = b''
+        for name in self.members:
+            data = self.zip.read(name)
+            if rest:
+                data = rest + data
+            # Members are normally whole samples, else the part sample is
+            # carried over to the next one.
+            end = len(data) - len(data) % self.unitsize
+            rest = data[end:]
+            if end:
+                yield np.frombuffer(data, dtype=word_types[self.unitsize], count=end // self.unitsize)
+
+    def chunks(self, channels, names=None, readahead=2):
+        # Tuples of 0/1 uint8 arrays, one per decoder channel (None for
+        # channels without a probe), one tuple per member.
+        bits = self.channel_map(channels, names)
+        for words in self.words(readahead):
+            rows = words.view(np.uint8).reshape(-1, self.unitsize)
+            yield tuple(None if bit is None else (rows[:, bit >> 3] >> (bit & 7)) & 1
+                        for bit in bits)
+
+class DslCapture:
+    def __init__(self, path):
+        self.zip = zipfile.ZipFile(path)
+        meta = configparser.ConfigParser(interpolation=None)
+        meta.read_string(self.zip.read('header').decode('utf-8'))
+        header = meta['header']
+        self.samplerate = parse_samplerate(header.get('samplerate', '0'))
+        self.total_samples = int(header['total samples'])
+        self.total_blocks = int(header['total blocks'])
+        # Probe names and their numbers in the member names.
+        self.probes = {}
+        for key, name in header.items():
+            m = re.match(r'probe(\d+)$', key)
+            if m:
+                self.probes[name] = int(m.group(1))
+        # Samples per block, all but the last one are full.
+        self.block_samples = 0
+        if self.probes and self.total_blocks:
+            first = 'L-%d/0' % min(self.probes.values())
+            self.block_samples = self.zip.getinfo(first).file_size * 8
+
+    def close(self):
+        self.zip.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def num_samples(self):
+        return self.total_samples
+
+    def channel_map(self, channels, names=None):
+        # Probe numbers for decoder channels, see map_channels(). A channel
+        # no probe is named like gets the probe at its own position, if
+        # that one is not taken (DSView maps probes to channels in order,
+        # too).
+        found = map_channels(channels, self.probes, names)
+        for i, probe in enumerate(found):
+            if probe is None and i in self.probes.values() and i not in found:
+                found[i] = i
+        return found
+
+    def block_len(self, block):
+        # The last block is cut at the total samples.
+        return min(self.block_samples, self.total_samples - block * self.block_samples)
+
+    def unpack(self, probe, block, count):
+        data = self.zip.read('L-%d/%d' % (probe, block))
+        return np.unpackbits(np.frombuffer(data, dtype=np.uint8), count=count,
+                             bitorder='little')
+
+    def chunks(self, channels, names=None, workers=None, readahead=2):
+        # Tuples of 0/1 uint8 arrays, one per decoder channel (None for
+        # channels without a probe), one tuple per block. Up to readahead
+        # blocks beyond the current one are being read by up to workers
+        # threads.
+        probes = self.channel_map(channels, names)
+        used = sorted(set(p for p in probes if p is not None))
+        if not used or not self.total_blocks:
+            return
+        if workers is None:
+            workers = min(len(used) * (readahead + 1), os.cpu_count() or 1)
+
+        with ThreadPoolExecutor(max(1, workers)) as pool:
+            pending = deque()
+
+            def submit(block):
+                count = self.block_len(block)
+                pending.append({p: pool.submit(self.unpack, p, block, count) for p in used})
+
+            for block in range(min(readahead + 1, self.total_blocks)):
+                submit(block)
+            block = len(pending)
+            try:
+                while pending:
+                    planes = {p: f.result() for p, f in pending.popleft().items()}
+                    if block < self.total_blocks:
+                        submit(block)
+                        block += 1
+                    yield tuple(None if p is None else planes[p] for p in probes)
+            finally:
+                for futures in pending:
+                    for f in futures.values():
+                        f.cancel()
+
+# Reader by file name extension.
+readers = {'.sr': SrCapture, '.dsl': DslCapture}
+
+def open_capture(path):
+    ext = os.path.splitext(path)[1].lower()
+    if ext not in readers:
+        raise ValueError('not a capture file: %r' % path)
+    return readers[ext](path)
@@ -0,0 +1,147 @@
+##
+## This file is part of the libsigrokdecode project.
+##
+## This program is free software; you can redistribute it and/or modify
+## it under the terms of the GNU General Public License as published by
+## the Free Software Foundation; either version 2 of the License, or
+## (at your option) any later version.
+##
+## This program is distributed in the hope that it will be useful,
+## but WITHOUT ANY WARRANTY; without even the implied warranty of
+## MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+## GNU General Public License for more details.
+##
+## You should have received a copy of the GNU General Public License
+## along with this program; if not, see <http://www.gnu.org/licenses/>.
+##
+
+'''
+On-disk cache of the edge lists of captures.
+
+Extracting the edges inflates and scans the whole capture, but the result
+depends only on the samples and on which probes feed the decoder channels.
+Entries are keyed by the SHA-256 of the capture file and the channel
+mapping, so an edited capture gets an entry of its own; a hit memory-maps
+the stored arrays instead of reading the capture again. Least recently
+used entries go first once the cache grows past max_bytes.
+
+    edges = EdgeCache().load('TPM_STARTUP.sr', Decoder.channels)
+
+decode_file(..., cache=EdgeCache()) in srdhost.host decodes from it.
+'''
+
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+
+import numpy as np
+
+from .captures import open_capture
+from .edges import EdgeList
+
+# Bumped whenever the entry layout changes, old entries are not used then.
+FORMAT = 1
+
+def default_directory():
+    base = os.environ.get('XDG_CACHE_HOME') or os.path.join(os.path.expanduser('~'), '.cache')
+    return os.path.join(base, 'ifx-decoders', 'edges')
+
+def file_digest(path):
+    h = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            h.update(block)
+    return h.hexdigest()
+
+def entry_size(path):
+    return sum(os.path.getsize(os.path.join(path, name)) for name in os.listdir(path))
+
+class EdgeCache:
+    def __init__(self, directory=None, max_bytes=1 << 30):
+        self.directory = directory or default_directory()
+        self.max_bytes = max_bytes
+
+    def key(self, path, probes):
+        # Capture content, channel mapping and entry layout.
+        h = hashlib.sha256(json.dumps([FORMAT, file_digest(path), probes]).encode())
+        return h.hexdigest()
+
+    def load(self, path, channels, names=None):
+        # Edge list of the decoder channels (ids or the decoders' channel
+        # dicts) of the capture at path, from the cache if it is there,
+        # else extracted and stored.
+        with open_capture(path) as capture:
+            probes = capture.channel_map(channels, names)
+            entry = os.path.join(self.directory, self.key(path, probes))
+            edges = self.read(entry)
+            if edges is None:
+                edges = EdgeList.from_chunks(capture.chunks(channels, names), len(channels))
+                self.write(entry, edges)
+        return edges
+
+    def read(self, entry):
+        try:
+            with open(os.path.join(entry, 'meta.json')) as f:
+                meta = json.load(f)
+            samples = np.load(os.path.join(entry, 'samples.npy'), mmap_mode='r')
+            states = np.load(os.path.join(entry, 'states.npy'), mmap_mode='r')
+        except (OSError, ValueError):
+            return None
+        if len(samples) != meta['edges'] or len(states) != meta['edges']:
+            return None
+        # Touched on use, for the eviction order.
+        try:
+            os.utime(entry)
+        except OSError:
+            pass
+        edges = EdgeList(meta['channels'])
+        edges.present = meta['present']
+        edges.initial = meta['initial']
+        edges.length = meta['length']
+        edges.last = int(states[-1]) if len(states) else edges.initial
+        edges.samples, edges.states = samples, states
+        return edges
+
+    def write(self, entry, edges):
+        # Written to a temporary directory first and renamed into place, so
+        # readers never see half an entry.
+        os.makedirs(self.directory, exist_ok=True)
+        tmp = tempfile.mkdtemp(prefix='.tmp-', dir=self.directory)
+        try:
+            np.save(os.path.join(tmp, 'samples.npy'), edges.samples)
+            np.save(os.path.join(tmp, 'states.npy'), edges.states)
+            meta = {'channels': edges.num_channels, 'present': edges.present,
+                    'initial': edges.initial, 'length': edges.length,
+                    'edges': len(edges.samples)}
+            with open(os.path.join(tmp, 'meta.json'), 'w') as f:
+                json.dump(meta, f)
+            os.rename(tmp, entry)
+        except OSError:
+            # Another run stored the same entry meanwhile, or the cache is
+            # not writable: decode without it.
+            shutil.rmtree(tmp, ignore_errors=True)
+            return
+        self.evict()
+
+    def evict(self):
+        # Remove the least recently used entries while over the limit.
+        entries = []
+        for name in os.listdir(self.directory):
+            path = os.path.join(self.directory, name)
+            if name.startswith('.') or not os.path.isdir(path):
+                continue
+            try:
+                entries.append((os.path.getmtime(path), entry_size(path), path))
+            except OSError:
+                continue
+        total = sum(size for mtime, size, path in entries)
+        for mtime, size, path in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            shutil.rmtree(path, ignore_errors=True)
+            total -= size
+
+    def clear(self):
+        shutil.rmtree(self.directory, ignore_errors=True)
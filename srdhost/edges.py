@@ -0,0 +1,312 @@
+##
+## This file is part of the libsigrokdecode project.
+##
+## This program is free software; you can redistribute it and/or modify
+## it under the terms of the GNU General Public License as published by
+## the Free Software Foundation; either version 2 of the License, or
+## (at your option) any later version.
+##
+## This program is distributed in the hope that it will be useful,
+## but WITHOUT ANY WARRANTY; without even the implied warranty of
+## MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+## GNU General Public License for more details.
+##
+## You should have received a copy of the GNU General Public License
+## along with this program; if not, see <http://www.gnu.org/licenses/>.
+##
+
+'''
+Edge-list representation of logic captures.
+
+The buses are sampled way faster than they toggle, so nearly every sample
+repeats the one before it. An EdgeList only keeps the sample numbers at
+which any of the decoder's channels changes, and the channel levels from
+there on, packed into one word (bit n: channel n). It is built from the
+sample chunks of the capture readers with array operations, so its size
+follows the bus activity rather than the capture length.
+
+EdgeCursor answers wait() conditions ('h', 'l', 'r', 'f', 'e' and
+'skip') from the edge list, the way libsigrokdecode does from the samples.
+It steps and searches edges, never samples, and a decoder's decode() runs
+on it unchanged:
+
+    edges = EdgeList.from_chunks(capture.chunks(Decoder.channels), 4)
+    EdgeCursor(edges).attach(decoder)
+    decoder.decode()
+
+PulseView's libsigrokdecode reports the matched conditions as a list of
+booleans, DSView's as a bitmask; EdgeCursor(edges, bitmask=True) does the
+latter for the DSView decoders.
+'''
+
+import numpy as np
+
+def chunk_edges(channels, dtype):
+    # Edges within one chunk of per-channel samples: the levels on its
+    # first sample, the samples which differ from the one before and the
+    # levels there, the levels on its last sample, and its length. None
+    # for a chunk without samples.
+    state = None
+    for bit, data in enumerate(channels):
+        if data is None:
+            continue
+        levels = np.asarray(data) != 0
+        levels = levels.view(np.uint8) if dtype == np.uint8 else levels.astype(dtype)
+        if bit:
+            levels <<= bit
+        if state is None:
+            state = levels
+        else:
+            state |= levels
+    if state is None or not len(state):
+        return None
+    at = np.flatnonzero(state[1:] != state[:-1]) + 1
+    return int(state[0]), at, state[at], int(state[-1]), len(state)
+
+class EdgeList:
+    def __init__(self, num_channels):
+        self.num_channels = num_channels
+        self.dtype = np.uint8 if num_channels <= 8 else np.uint32
+        # Which channels have samples at all.
+        self.present = [False] * num_channels
+        # Channel levels at sample 0, and the sample numbers of the edges
+        # with the levels from there on.
+        self.initial = 0
+        self.samples = np.empty(0, dtype=np.int64)
+        self.states = np.empty(0, dtype=self.dtype)
+        self.length = 0
+        self.parts = []
+        self.last = 0
+
+    @classmethod
+    def from_chunks(cls, chunks, num_channels):
+        # chunks: tuples of per-channel sample arrays (None for channels
+        # without samples), as the capture readers produce them.
+        edges = cls(num_channels)
+        for chunk in chunks:
+            edges.feed(chunk)
+        edges.close()
+        return edges
+
+    def feed(self, channels):
+        # Add the next chunk of samples.
+        for bit, data in enumerate(channels):
+            if data is not None:
+                self.present[bit] = True
+        self.add(chunk_edges(channels, self.dtype))
+
+    def add(self, edges):
+        # Add the edges of the next chunk, as chunk_edges() returns them.
+        if edges is None:
+            return
+        first, at, states, last, length = edges
+        if not self.length:
+            self.initial = self.last = first
+        if first != self.last:
+            # The chunk starts with an edge.
+            at = np.concatenate(([0], at))
+            states = np.concatenate((np.array([first], dtype=self.dtype), states))
+        self.parts.append((at + self.length, states))
+        self.length += length
+        self.last = last
+
+    def close(self):
+        # Done feeding: join the chunks' edges.
+        if self.parts:
+            self.samples = np.concatenate([self.samples] + [p[0] for p in self.parts])
+            self.states = np.concatenate([self.states] + [p[1] for p in self.parts])
+            self.parts = []
+
+    def __len__(self):
+        return len(self.samples)
+
+    def more(self, keep):
+        # Wait for more edges. An edge list is complete, so None; streamed
+        # ones add the next edges, may drop those before index keep, and
+        # return how many they dropped.
+        return None
+
+    def state_at(self, samplenum):
+        i = int(np.searchsorted(self.samples, samplenum, 'right')) - 1
+        return self.initial if i < 0 else int(self.states[i])
+
+# Condition terms: the bits which have to be 1 or 0 after and before the
+# sample, and the ones which have to change.
+term_bits = {
+    'h': (1, 0, 0, 0, 0),
+    'l': (0, 1, 0, 0, 0),
+    'r': (1, 0, 0, 1, 1),
+    'f': (0, 1, 1, 0, 1),
+    'e': (0, 0, 0, 0, 1),
+}
+
+class Condition:
+    __slots__ = ('one', 'zero', 'was_one', 'was_zero', 'change', 'skip')
+
+    def __init__(self, cond):
+        masks = [0] * 5
+        self.skip = None
+        for key, term in cond.items():
+            if key == 'skip':
+                self.skip = term
+                continue
+            for i, flag in enumerate(term_bits[term]):
+                if flag:
+                    masks[i] |= 1 << key
+        self.one, self.zero, self.was_one, self.was_zero, self.change = masks
+
+    def level_only(self):
+        # Can match on any sample, not only on edges.
+        return not (self.was_one or self.was_zero or self.change)
+
+    def match(self, state, prev):
+        return ((state & self.one) == self.one and not state & self.zero and
+                (prev & self.was_one) == self.was_one and not prev & self.was_zero and
+                ((state ^ prev) & self.change) == self.change)
+
+    def match_all(self, states, prevs):
+        m = (states & self.one) == self.one
+        if self.zero:
+            m &= (states & self.zero) == 0
+        if self.was_one:
+            m &= (prevs & self.was_one) == self.was_one
+        if self.was_zero:
+            m &= (prevs & self.was_zero) == 0
+        if self.change:
+            m &= ((states ^ prevs) & self.change) == self.change
+        return m
+
+class EdgeCursor:
+    # Edges checked one by one before searching the rest with arrays.
+    STEPS = 8
+
+    def __init__(self, edges, bitmask=False):
+        self.edges = edges
+        # matched as a bitmask (DSView) rather than a list.
+        self.bitmask = bitmask
+        self.samplenum = -1
+        # Index of the first edge after samplenum.
+        self.edge = 0
+        self.matched = None
+        self.decoder = None
+        self.compiled = {}
+
+    def attach(self, decoder):
+        # Have decoder.wait() served by the cursor, and keep the decoder's
+        # samplenum and matched up to date.
+        self.decoder = decoder
+        decoder.wait = self.wait
+
+    def conditions(self, conds):
+        if isinstance(conds, dict):
+            conds = [conds]
+        key = tuple(tuple(sorted(c.items())) for c in conds)
+        compiled = self.compiled.get(key)
+        if compiled is None:
+            compiled = self.compiled[key] = [Condition(c) for c in conds]
+        return compiled
+
+    def pins(self, state):
+        # Levels of unused channels read 0xff, as in libsigrokdecode.
+        return tuple((state >> i) & 1 if present else 0xff
+                     for i, present in enumerate(self.edges.present))
+
+    def find_edge(self, conds, start):
+        # Index of the first edge from start on which matches any of the
+        # conditions, or None.
+        edges = self.edges
+        samples, states, n = edges.samples, edges.states, len(edges.samples)
+        k = start
+        end = min(n, start + self.STEPS)
+        prev = edges.initial if k == 0 else int(states[k - 1])
+        while k < end:
+            state = int(states[k])
+            for c in conds:
+                if c.match(state, prev):
+                    return k
+            prev = state
+            k += 1
+        width = 256
+        while k < n:
+            hi = min(n, k + width)
+            cur = states[k:hi]
+            if k:
+                prevs = states[k - 1:hi - 1]
+            else:
+                prevs = np.concatenate(([edges.initial], states[:hi - 1])).astype(states.dtype)
+            m = conds[0].match_all(cur, prevs)
+            for c in conds[1:]:
+                m |= c.match_all(cur, prevs)
+            hit = np.flatnonzero(m)
+            if len(hit):
+                return k + int(hit[0])
+            k = hi
+            width = min(width * 4, 1 << 20)
+        return None
+
+    def find(self, conds):
+        # First sample after samplenum on which any of the conditions
+        # matches (None if no edge does), and the samples of the skip
+        # conditions.
+        edges = self.edges
+        samples, states = edges.samples, edges.states
+        n = len(samples)
+        cur, e = self.samplenum, self.edge
+        nxt = cur + 1
+
+        # The levels only change on edges: level conditions which do not
+        # hold on the next sample can only match on a later edge.
+        found = None
+        level = edges.initial if e == 0 else int(states[e - 1])
+        if not (e < n and int(samples[e]) == nxt):
+            if any(c.skip is None and c.level_only() and c.match(level, level)
+                   for c in conds):
+                found = nxt
+        if found is None:
+            edge_conds = [c for c in conds if c.skip is None]
+            k = self.find_edge(edge_conds, e) if edge_conds else None
+            if k is not None:
+                found = int(samples[k])
+        skips = [max(cur + c.skip, nxt) if c.skip is not None else None
+                 for c in conds]
+        for at in skips:
+            if at is not None and (found is None or at < found):
+                found = at
+        return found, skips
+
+    def wait(self, conds=None):
+        # No conditions: the next sample, as in libsigrokdecode.
+        conds = self.conditions({} if conds is None else conds)
+        edges = self.edges
+        while True:
+            found, skips = self.find(conds)
+            if found is not None and found < edges.length:
+                break
+            # Not within the edges so far, but there may be more to come.
+            dropped = edges.more(max(self.edge - 1, 0))
+            if dropped is None:
+                self.samplenum = edges.length
+                raise EOFError('no more samples')
+            self.edge -= dropped
+        samples, states = edges.samples, edges.states
+        n = len(samples)
+        e, nxt = self.edge, self.samplenum + 1
+
+        # Levels and matched conditions on the found sample.
+        if found != nxt:
+            e = int(np.searchsorted(samples, found, 'left'))
+        prev = edges.initial if e == 0 else int(states[e - 1])
+        if e < n and int(samples[e]) == found:
+            state = int(states[e])
+            e += 1
+        else:
+            state = prev
+        matched = [found == at if at is not None else c.match(state, prev)
+                   for c, at in zip(conds, skips)]
+        if self.bitmask:
+            matched = sum(1 << i for i, m in enumerate(matched) if m)
+        self.samplenum, self.edge, self.matched = found, e, matched
+        if self.decoder is not None:
+            self.decoder.samplenum = found
+            self.decoder.matched = matched
+        return self.pins(state)
@@ -0,0 +1,192 @@
+##
+## This file is part of the libsigrokdecode project.
+##
+## This program is free software; you can redistribute it and/or modify
+## it under the terms of the GNU General Public License as published by
+## the Free Software Foundation; either version 2 of the License, or
+## (at your option) any later version.
+##
+## This program is distributed in the hope that it will be useful,
+## but WITHOUT ANY WARRANTY; without even the implied warranty of
+## MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+## GNU General Public License for more details.
+##
+## You should have received a copy of the GNU General Public License
+## along with this program; if not, see <http://www.gnu.org/licenses/>.
+##
+
+'''
+Runs a decoder on a capture file, without libsigrokdecode.
+
+A decoder directory (the one with pd.py, e.g. 'ifx-tpm_PULSEVIEW/ifx-tpm')
+is imported with srdhost.sigrokdecode in place of libsigrokdecode's
+module. A Session holds one instance of the decoder and everything it
+puts, and feeds it the capture in one of three ways:
+
+ - 'decode': decode(), with wait() served by an EdgeCursor over the edges
+   of the whole capture. This is the path PulseView and DSView take.
+ - 'chunks': the decoder's decode_chunk() on the sample chunks of the
+   capture reader, then finish().
+ - 'pipeline': decode() on the edges as a Pipeline extracts them.
+
+All three are meant to give the same annotations, binary and meta
+output, e.g.:
+
+    session = decode_file('ifx_trustm_PULSEVIEW/ifx_trustm', 'trustm_chipinfo.sr')
+    for ss, es, cls, texts in session.annotations():
+        print(ss, es, texts[0])
+'''
+
+import collections
+import importlib.util
+import os
+import sys
+
+from . import sigrokdecode as srd
+from .captures import open_capture
+from .edges import EdgeList, EdgeCursor
+from .pipeline import Pipeline
+
+Output = collections.namedtuple('Output', 'ss es output_id output_type data')
+
+def install():
+    # The decoders import sigrokdecode at the top of pd.py.
+    module = sys.modules.setdefault('sigrokdecode', srd)
+    if module is not srd:
+        raise RuntimeError('another sigrokdecode module is loaded')
+
+# Decoder classes by directory.
+loaded = {}
+
+def load_decoder(directory):
+    # Decoder class of the decoder in directory. Its name need not be a
+    # valid module name, and the PulseView and DSView copies of a decoder
+    # can be loaded side by side.
+    directory = os.path.abspath(directory)
+    if directory in loaded:
+        return loaded[directory]
+    init = os.path.join(directory, '__init__.py')
+    if not os.path.isfile(init):
+        raise ImportError('no decoder in %r' % directory)
+    install()
+    name = 'srdhost_decoder_%d' % len(loaded)
+    spec = importlib.util.spec_from_file_location(name, init,
+                                                  submodule_search_locations=[directory])
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[name] = module
+    try:
+        spec.loader.exec_module(module)
+    except BaseException:
+        del sys.modules[name]
+        raise
+    loaded[directory] = module.Decoder
+    return module.Decoder
+
+def matched_bitmask(decoder_class):
+    # DSView's decoders declare their annotations with a leading type
+    # code, (type, id, description), and get matched as a bitmask.
+    annotations = decoder_class.annotations
+    return bool(annotations) and len(annotations[0]) == 3
+
+def option_values(decoder_class, options=None):
+    # The decoder's option defaults, updated with options. Values given as
+    # strings (from the command line) are converted to the type of the
+    # default.
+    declared = {o['id']: o for o in decoder_class.options}
+    values = {key: o['default'] for key, o in declared.items()}
+    for key, value in (options or {}).items():
+        if key not in declared:
+            raise KeyError('unknown option %r' % key)
+        default = values[key]
+        if isinstance(value, str) and not isinstance(default, str):
+            value = int(value, 0) if isinstance(default, int) else float(value)
+        allowed = declared[key].get('values')
+        if allowed and value not in allowed:
+            raise ValueError('option %r: %r not one of %r' % (key, value, allowed))
+        values[key] = value
+    return values
+
+class Session:
+    def __init__(self, decoder_class, options=None, bitmask=None):
+        self.channels = tuple(decoder_class.channels) + \
+                        tuple(getattr(decoder_class, 'optional_channels', ()))
+        if bitmask is None:
+            bitmask = matched_bitmask(decoder_class)
+        self.bitmask = bitmask
+        # Registered outputs, (type, meta) by output id, and the outputs
+        # put so far.
+        self.registered = []
+        self.outputs = []
+        # Which channels have a probe.
+        self.present = [False] * len(self.channels)
+        self.pipeline = None
+        decoder = decoder_class.__new__(decoder_class)
+        decoder.session = self
+        decoder.__init__()
+        decoder.options = option_values(decoder_class, options)
+        self.decoder = decoder
+
+    def register(self, output_type, meta=None):
+        self.registered.append((output_type, meta))
+        return len(self.registered) - 1
+
+    def put(self, ss, es, output_id, data):
+        self.outputs.append(Output(ss, es, output_id, self.registered[output_id][0], data))
+
+    def has_channel(self, index):
+        return self.present[index]
+
+    def start(self, samplerate, present):
+        # As libsigrokdecode does: the samplerate first, then start().
+        self.present = list(present)
+        if samplerate:
+            self.decoder.metadata(srd.SRD_CONF_SAMPLERATE, samplerate)
+        self.decoder.start()
+
+    def decode(self, edges):
+        # decode() on an EdgeList of the decoder channels.
+        EdgeCursor(edges, self.bitmask).attach(self.decoder)
+        try:
+            self.decoder.decode()
+        except EOFError:
+            # Decoders which do not end the decode themselves.
+            pass
+
+    def decode_chunks(self, chunks):
+        # decode_chunk() on tuples of per-channel sample arrays.
+        for chunk in chunks:
+            self.decoder.decode_chunk(*chunk)
+        self.decoder.finish()
+
+    def run_pipeline(self, capture, names=None, workers=2):
+        self.pipeline = Pipeline(capture, self.channels, names, workers=workers)
+        self.pipeline.run(self.decoder, self.bitmask)
+
+    def annotations(self):
+        # (ss, es, class, texts) of the annotations.
+        return [(o.ss, o.es, o.data[0], o.data[1]) for o in self.outputs
+                if o.output_type == srd.OUTPUT_ANN]
+
+methods = ('decode', 'chunks', 'pipeline')
+
+def decode_file(directory, path, options=None, names=None, method='decode', workers=2,
+                cache=None):
+    # Session of the decoder in directory, run on the capture at path.
+    # names: probe name by channel id, where the names do not match.
+    # cache: EdgeCache the 'decode' method takes the edges from.
+    if method not in methods:
+        raise ValueError('unknown method %r' % method)
+    session = Session(load_decoder(directory), options)
+    with open_capture(path) as capture:
+        probes = capture.channel_map(session.channels, names)
+        session.start(capture.samplerate, [p is not None for p in probes])
+        if method == 'chunks':
+            session.decode_chunks(capture.chunks(session.channels, names))
+        elif method == 'pipeline':
+            session.run_pipeline(capture, names, workers)
+        elif cache is not None:
+            session.decode(cache.load(path, session.channels, names))
+        else:
+            chunks = capture.chunks(session.channels, names)
+            session.decode(EdgeList.from_chunks(chunks, len(session.channels)))
+    return session
@@ -0,0 +1,254 @@
+##
+## This file is part of the libsigrokdecode project.
+##
+## This program is free software; you can redistribute it and/or modify
+## it under the terms of the GNU General Public License as published by
+## the Free Software Foundation; either version 2 of the License, or
+## (at your option) any later version.
+##
+## This program is distributed in the hope that it will be useful,
+## but WITHOUT ANY WARRANTY; without even the implied warranty of
+## MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+## GNU General Public License for more details.
+##
+## You should have received a copy of the GNU General Public License
+## along with this program; if not, see <http://www.gnu.org/licenses/>.
+##
+
+'''
+Pipelined decoding of capture files.
+
+Decoding a capture file runs in three stages, each one in its own thread
+and connected to the next one by a bounded queue:
+
+ - read: inflates the capture members and splits them into per-channel
+   sample chunks (the capture reader).
+ - edges: turns the chunks into their edges (chunk_edges()), a few of
+   them at a time in a pool of worker threads, and passes them on in
+   order.
+ - decode: runs the decoder's decode() on an EdgeCursor, which takes the
+   edges from the queue as it gets to them. This is the calling thread.
+
+zlib and NumPy do their work without holding the GIL, so reading and edge
+extraction overlap with the Python protocol code. A full queue blocks
+the stage in front of it, so no more than a few chunks are in flight.
+Each stage's busy time is recorded; the stage closest to 100% busy (of
+its threads) is the one which bounds the throughput:
+
+    pipeline = Pipeline(capture, session.channels)
+    pipeline.run(session.decoder, session.bitmask)
+    print(pipeline.report())
+
+srdhost.host.decode_file(..., method='pipeline') sets this up.
+'''
+
+import queue
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+from .edges import EdgeList, EdgeCursor, chunk_edges
+
+class StageError(Exception):
+    pass
+
+def timed(func, *args):
+    start = time.perf_counter()
+    result = func(*args)
+    return time.perf_counter() - start, result
+
+class Stage:
+    # Busy time of a pipeline stage (summed over its threads), not counting
+    # waits on its queues.
+    def __init__(self, name, threads=1):
+        self.name = name
+        self.threads = threads
+        self.busy = 0.0
+        self.items = 0
+
+class EdgeQueue(EdgeList):
+    # Edge list which is filled from the edges stage while being read.
+    def __init__(self, num_channels, source, stage, stopped, producer):
+        EdgeList.__init__(self, num_channels)
+        self.source = source
+        self.stage = stage
+        self.stopped = stopped
+        self.producer = producer
+        self.done = False
+
+    def next_item(self):
+        # Blocks until the edges stage passes something on. None once the
+        # pipeline is stopped.
+        while not self.stopped.is_set():
+            try:
+                return self.source.get(timeout=0.1)
+            except queue.Empty:
+                # It always ends with None or an exception, unless its
+                # thread is gone.
+                if not self.producer.is_alive() and self.source.empty():
+                    raise StageError('edges stage ended without a result')
+        return None
+
+    def more(self, keep):
+        if self.done:
+            return None
+        waited = time.perf_counter()
+        try:
+            item = self.next_item()
+        finally:
+            self.stage.busy -= time.perf_counter() - waited
+        if item is None:
+            self.done = True
+            return None
+        if isinstance(item, BaseException):
+            self.done = True
+            raise StageError('pipeline stage failed') from item
+        self.stage.items += 1
+        samples, states, length, initial, present = item
+        if not self.length:
+            self.initial = initial
+        self.present = present
+        self.length = length
+        # The cursor only looks at the edges from keep on.
+        self.samples = np.concatenate((self.samples[keep:], samples))
+        self.states = np.concatenate((self.states[keep:], states))
+        return keep
+
+class Pipeline:
+    def __init__(self, capture, channels, names=None, depth=4, workers=2):
+        # capture: SrCapture or DslCapture. channels: the decoder's channel
+        # dicts (or ids). depth: chunks each queue holds at most. workers:
+        # threads of the edges stage.
+        self.capture = capture
+        self.channels = channels
+        self.names = names
+        self.depth = depth
+        self.stages = [Stage('read'), Stage('edges', workers), Stage('decode')]
+        self.elapsed = 0.0
+        self.stopped = threading.Event()
+
+    def put(self, q, item):
+        # Blocks while the queue is full, unless the pipeline is stopped.
+        while not self.stopped.is_set():
+            try:
+                q.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def get(self, q):
+        # Blocks while the queue is empty, None once the pipeline is stopped.
+        while not self.stopped.is_set():
+            try:
+                return q.get(timeout=0.1)
+            except queue.Empty:
+                pass
+        return None
+
+    def read(self, out):
+        stage = self.stages[0]
+        try:
+            chunks = self.capture.chunks(self.channels, self.names)
+            while True:
+                start = time.perf_counter()
+                chunk = next(chunks, None)
+                stage.busy += time.perf_counter() - start
+                if chunk is None:
+                    break
+                stage.items += 1
+                if not self.put(out, chunk):
+                    chunks.close()
+                    return
+            self.put(out, None)
+        except BaseException as e:
+            self.put(out, e)
+
+    def extract(self, source, out):
+        stage = self.stages[1]
+        builder = EdgeList(len(self.channels))
+        pending = deque()
+        end = None
+        try:
+            with ThreadPoolExecutor(stage.threads) as pool:
+                try:
+                    while True:
+                        # Keep every worker busy, plus one chunk in reserve.
+                        while end is None and len(pending) <= stage.threads:
+                            chunk = self.get(source)
+                            if chunk is None or isinstance(chunk, BaseException):
+                                end = chunk or True
+                                break
+                            for bit, data in enumerate(chunk):
+                                if data is not None:
+                                    builder.present[bit] = True
+                            pending.append(pool.submit(timed, chunk_edges, chunk, builder.dtype))
+                        if not pending:
+                            self.put(out, None if end is True else end)
+                            return
+                        busy, edges = pending.popleft().result()
+                        stage.busy += busy
+                        stage.items += 1
+                        builder.add(edges)
+                        if builder.parts:
+                            samples = np.concatenate([p[0] for p in builder.parts])
+                            states = np.concatenate([p[1] for p in builder.parts])
+                            builder.parts = []
+                        else:
+                            samples = np.empty(0, dtype=np.int64)
+                            states = np.empty(0, dtype=builder.dtype)
+                        if not self.put(out, (samples, states, builder.length,
+                                              builder.initial, list(builder.present))):
+                            return
+                finally:
+                    for f in pending:
+                        f.cancel()
+        except BaseException as e:
+            # Whatever went wrong, the decode stage gets to know.
+            self.put(out, e)
+
+    def run(self, decoder, bitmask=False):
+        # Decode the capture with decoder.decode(), in this thread. Its
+        # wait() is served by an EdgeCursor (matched as a bitmask for the
+        # DSView decoders).
+        chunks = queue.Queue(self.depth)
+        edges = queue.Queue(self.depth)
+        workers = [threading.Thread(target=self.read, args=(chunks,), daemon=True),
+                   threading.Thread(target=self.extract, args=(chunks, edges), daemon=True)]
+        stage = self.stages[2]
+        stream = EdgeQueue(len(self.channels), edges, stage, self.stopped, workers[1])
+        EdgeCursor(stream, bitmask).attach(decoder)
+        start = time.perf_counter()
+        for worker in workers:
+            worker.start()
+        try:
+            decoder.decode()
+        except EOFError:
+            # Decoders which do not end the decode themselves.
+            pass
+        finally:
+            self.elapsed = time.perf_counter() - start
+            stage.busy += self.elapsed
+            self.stopped.set()
+            for worker in workers:
+                worker.join()
+
+    def utilization(self):
+        # Busy share of the elapsed time of each stage's threads, by stage
+        # name.
+        if not self.elapsed:
+            return {stage.name: 0.0 for stage in self.stages}
+        return {stage.name: stage.busy / (self.elapsed * stage.threads)
+                for stage in self.stages}
+
+    def report(self):
+        lines = ['%.2f s' % self.elapsed]
+        shares = self.utilization()
+        for stage in self.stages:
+            lines.append('%-6s %5.1f%% busy (%d thread%s), %.2f s, %d chunks' % (
+                stage.name, 100 * shares[stage.name], stage.threads,
+                '' if stage.threads == 1 else 's', stage.busy, stage.items))
+        return '\n'.join(lines)
@@ -0,0 +1,49 @@
+##
+## This file is part of the libsigrokdecode project.
+##
+## This program is free software; you can redistribute it and/or modify
+## it under the terms of the GNU General Public License as published by
+## the Free Software Foundation; either version 2 of the License, or
+## (at your option) any later version.
+##
+## This program is distributed in the hope that it will be useful,
+## but WITHOUT ANY WARRANTY; without even the implied warranty of
+## MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+## GNU General Public License for more details.
+##
+## You should have received a copy of the GNU General Public License
+## along with this program; if not, see <http://www.gnu.org/licenses/>.
+##
+
+'''
+Stand-in for the sigrokdecode module libsigrokdecode provides.
+
+The decoders import sigrokdecode for their base class and a handful of
+constants. This module has the same names, as far as the decoders here
+use them, so they can be imported and run without libsigrokdecode;
+srdhost.host installs it under the name sigrokdecode. The Decoder base
+class hands register(), put() and has_channel() over to the host's
+Session, and wait() to the EdgeCursor the session attaches.
+'''
+
+# Output types and config keys, numbered as in libsigrokdecode.
+OUTPUT_ANN, OUTPUT_PYTHON, OUTPUT_BINARY, OUTPUT_LOGIC, OUTPUT_META = range(5)
+SRD_CONF_SAMPLERATE = 10000
+
+class Decoder:
+    # Session the decoder reports to, set before its __init__() runs.
+    session = None
+    samplenum = 0
+    matched = None
+
+    def register(self, output_type, proto_id=None, meta=None):
+        return self.session.register(output_type, meta)
+
+    def put(self, ss, es, output_id, data):
+        self.session.put(ss, es, output_id, data)
+
+    def has_channel(self, index):
+        return self.session.has_channel(index)
+
+    def wait(self, conds=None):
+        raise RuntimeError('no samples attached to the decoder')
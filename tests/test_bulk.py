@@ -0,0 +1,247 @@
+##
+## This file is part of the libsigrokdecode project.
+##
+## This program is free software; you can redistribute it and/or modify
+## it under the terms of the GNU General Public License as published by
+## the Free Software Foundation; either version 2 of the License, or
+## (at your option) any later version.
+##
+## This program is distributed in the hope that it will be useful,
+## but WITHOUT ANY WARRANTY; without even the implied warranty of
+## MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+## GNU General Public License for more details.
+##
+## You should have received a copy of the GNU General Public License
+## along with this program; if not, see <http://www.gnu.org/licenses/>.
+##
+
+# decode_chunk() of the decoders (bulk.py) against their decode(), on
+# synthetic waveforms cut into chunks at awkward places: inside a byte,
+# on a clock edge, on a CS# edge or START/STOP condition, and into chunks
+# of a few samples.
+
+import os
+import unittest
+
+import numpy as np
+
+from srdhost import host, sigrokdecode as srd
+from srdhost.edges import EdgeList
+
+root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+def comparable(session):
+    # Annotations, binary and meta output, and the kind of the Python
+    # output (its data holds objects which only compare by identity).
+    result = []
+    for o in session.outputs:
+        if o.output_type == srd.OUTPUT_BINARY:
+            result.append((o.ss, o.es, o.output_id, o.data[0], bytes(o.data[1])))
+        elif o.output_type == srd.OUTPUT_PYTHON:
+            result.append((o.ss, o.es, o.output_id, o.data[0]))
+        else:
+            result.append((o.ss, o.es, o.output_id, o.data))
+    return result
+
+def split(channels, cuts):
+    # The per-channel sample arrays cut before the given sample numbers.
+    bounds = [0] + sorted(set(cuts)) + [len(channels[0])]
+    return [tuple(None if c is None else c[a:b] for c in channels)
+            for a, b in zip(bounds, bounds[1:]) if a < b]
+
+class Waveform:
+    # Per-channel levels, a sample at a time, and sample numbers of
+    # interest by name.
+    def __init__(self, **levels):
+        self.names = tuple(levels)
+        self.levels = dict(levels)
+        self.samples = {name: [] for name in self.names}
+        self.marks = {}
+
+    def __len__(self):
+        return len(self.samples[self.names[0]])
+
+    def mark(self, name):
+        self.marks.setdefault(name, []).append(len(self))
+
+    def hold(self, count, **levels):
+        self.levels.update(levels)
+        for name in self.names:
+            self.samples[name].extend([self.levels[name]] * count)
+
+    def channels(self):
+        return tuple(np.array(self.samples[name], dtype=np.uint8) for name in self.names)
+
+class BulkTest:
+    decoder = None
+    options = None
+
+    def session(self, channels):
+        session = host.Session(host.load_decoder(os.path.join(root, self.decoder)), self.options)
+        session.start(1000000, [c is not None for c in channels])
+        return session
+
+    def reference(self, channels):
+        session = self.session(channels)
+        session.decode(EdgeList.from_chunks([channels], len(channels)))
+        return comparable(session)
+
+    def chunked(self, channels, cuts):
+        session = self.session(channels)
+        session.decode_chunks(split(channels, cuts))
+        return comparable(session)
+
+    def check(self, channels, cuts):
+        reference = self.reference(channels)
+        self.assertTrue(reference)
+        self.assertEqual(self.chunked(channels, cuts), reference)
+
+class SpiTest(BulkTest):
+    def waveform(self):
+        # TPM SPI, mode 0: read TPM_ACCESS_0, TPM2_Startup written to the
+        # FIFO, then TPM_STS_0 read with a wait state.
+        w = Waveform(clk=0, miso=1, mosi=1, cs=1)
+        w.hold(10)
+        self.transfer(w, '80d40000 00', '00000001 a1')
+        self.transfer(w, '0bd40024 8001 0000000c 00000144 0000',
+                      '00000001' + '00' * 12)
+        self.transfer(w, '80d40018 00 00', '00000000 01 94')
+        return w
+
+    def transfer(self, w, mosi, miso, half=3):
+        w.mark('cs')
+        w.hold(5, cs=0)
+        for out, back in zip(bytes.fromhex(mosi), bytes.fromhex(miso)):
+            w.mark('byte')
+            for i in range(7, -1, -1):
+                w.hold(half, clk=0, mosi=(out >> i) & 1, miso=(back >> i) & 1)
+                w.mark('clk')
+                w.hold(half, clk=1)
+        w.hold(5, clk=0)
+        w.mark('cs')
+        w.hold(10, cs=1, mosi=1, miso=1)
+
+    def test_whole(self):
+        self.check(self.waveform().channels(), [])
+
+    def test_cut_in_byte(self):
+        w = self.waveform()
+        # Between the third and fourth bit of each byte.
+        self.check(w.channels(), [s + 17 for s in w.marks['byte']])
+
+    def test_cut_on_clk_edge(self):
+        w = self.waveform()
+        self.check(w.channels(), w.marks['clk'][::5])
+
+    def test_cut_on_cs_edge(self):
+        w = self.waveform()
+        self.check(w.channels(), w.marks['cs'])
+
+    def test_small_chunks(self):
+        w = self.waveform()
+        for size in (1, 3, 7):
+            self.check(w.channels(), range(size, len(w), size))
+
+    def test_no_cs(self):
+        w = self.waveform()
+        clk, miso, mosi, cs = w.channels()
+        self.check((clk, miso, mosi, None), w.marks['cs'] + [s + 17 for s in w.marks['byte']])
+
+class PulseViewSpiTest(SpiTest, unittest.TestCase):
+    decoder = 'ifx-tpm_PULSEVIEW/ifx-tpm'
+
+class DSViewSpiTest(SpiTest, unittest.TestCase):
+    decoder = 'ifx-tpm_DSVIEW/ifx-tpm'
+
+class I2cTest(BulkTest):
+    def waveform(self):
+        # Trust M I2C: a GetDataObject command frame written to DATA, a
+        # write to another address, an address nobody acknowledges, and
+        # a response frame read back after a repeated START.
+        w = Waveform(scl=1, sda=1)
+        w.hold(20)
+        self.write(w, 0x30, '80 0000070081000002e0c224b8')
+        self.write(w, 0x31, '80 00')
+        self.write(w, 0x29, None)
+        self.start(w)
+        self.byte(w, 0x30 << 1)
+        self.byte(w, 0x80)
+        self.start(w)
+        self.byte(w, 0x30 << 1 | 1)
+        response = bytes.fromhex('0000070000000002aabb7061')
+        for i, b in enumerate(response):
+            self.byte(w, b, i < len(response) - 1)
+        self.stop(w)
+        return w
+
+    def start(self, w, half=4):
+        w.hold(half, scl=1, sda=1)
+        w.mark('condition')
+        w.hold(half, sda=0)
+        w.hold(half, scl=0)
+
+    def stop(self, w, half=4):
+        w.hold(half, scl=0, sda=0)
+        w.hold(half, scl=1)
+        w.mark('condition')
+        w.hold(4 * half, sda=1)
+
+    def byte(self, w, value, ack=True, half=4):
+        w.mark('byte')
+        for i in range(7, -1, -1):
+            w.hold(half, scl=0, sda=(value >> i) & 1)
+            w.mark('scl')
+            w.hold(half, scl=1)
+        w.hold(half, scl=0, sda=0 if ack else 1)
+        w.mark('scl')
+        w.hold(half, scl=1)
+        w.hold(1, scl=0)
+
+    def write(self, w, address, data):
+        # data None: the address is not acknowledged.
+        self.start(w)
+        self.byte(w, address << 1, data is not None)
+        for b in bytes.fromhex(data or ''):
+            self.byte(w, b)
+        self.stop(w)
+
+    def test_whole(self):
+        self.check(self.waveform().channels(), [])
+
+    def test_cut_in_byte(self):
+        w = self.waveform()
+        # Between the third and fourth bit of each byte.
+        self.check(w.channels(), [s + 22 for s in w.marks['byte']])
+
+    def test_cut_on_scl_edge(self):
+        w = self.waveform()
+        self.check(w.channels(), w.marks['scl'][::5])
+
+    def test_cut_on_condition(self):
+        # On the SDA edge of each START, repeated START and STOP.
+        w = self.waveform()
+        self.check(w.channels(), w.marks['condition'])
+
+    def test_small_chunks(self):
+        w = self.waveform()
+        for size in (1, 3, 7):
+            self.check(w.channels(), range(size, len(w), size))
+
+class I2cSkipTest(I2cTest):
+    # Transactions to other addresses are jumped over.
+    options = {'foreign': 'skip'}
+
+class PulseViewI2cTest(I2cTest, unittest.TestCase):
+    decoder = 'ifx_trustm_PULSEVIEW/ifx_trustm'
+
+class DSViewI2cTest(I2cTest, unittest.TestCase):
+    decoder = 'ifx_trustm_DSVIEW/ifx_trustm'
+
+class PulseViewI2cSkipTest(I2cSkipTest, unittest.TestCase):
+    decoder = 'ifx_trustm_PULSEVIEW/ifx_trustm'
+
+class DSViewI2cSkipTest(I2cSkipTest, unittest.TestCase):
+    decoder = 'ifx_trustm_DSVIEW/ifx_trustm'
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,172 @@
+##
+## This file is part of the libsigrokdecode project.
+##
+## This program is free software; you can redistribute it and/or modify
+## it under the terms of the GNU General Public License as published by
+## the Free Software Foundation; either version 2 of the License, or
+## (at your option) any later version.
+##
+## This program is distributed in the hope that it will be useful,
+## but WITHOUT ANY WARRANTY; without even the implied warranty of
+## MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+## GNU General Public License for more details.
+##
+## You should have received a copy of the GNU General Public License
+## along with this program; if not, see <http://www.gnu.org/licenses/>.
+##
+
+# Capture file readers (srdhost.captures), on the shipped samples and on
+# small session files written here.
+
+import os
+import tempfile
+import unittest
+import zipfile
+
+import numpy as np
+
+from srdhost import captures
+
+root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+tpm_channels = (
+    {'id': 'clk', 'name': 'CLK'},
+    {'id': 'miso', 'name': 'MISO'},
+    {'id': 'mosi', 'name': 'MOSI'},
+    {'id': 'cs', 'name': 'CS#'},
+)
+
+def read_all(capture, channels, **kwargs):
+    # The chunks joined per channel.
+    chunks = list(capture.chunks(channels, **kwargs))
+    return [None if chunk[0] is None else np.concatenate(chunk)
+            for chunk in zip(*chunks)], len(chunks)
+
+class HelpersTest(unittest.TestCase):
+    def test_parse_samplerate(self):
+        self.assertEqual(captures.parse_samplerate('1 GHz'), 10**9)
+        self.assertEqual(captures.parse_samplerate('100 MHz'), 10**8)
+        self.assertEqual(captures.parse_samplerate('12.5 kHz'), 12500)
+        self.assertEqual(captures.parse_samplerate('500'), 500)
+        with self.assertRaises(ValueError):
+            captures.parse_samplerate('fast')
+
+    def test_match_probe(self):
+        probes = {'SCLK': 0, 'MISO': 1, 'MOSI': 2, 'CS': 3}
+        # By channel name without punctuation, then by the id within the
+        # probe name.
+        self.assertEqual(captures.match_probe({'id': 'cs', 'name': 'CS#'}, probes), 'CS')
+        self.assertEqual(captures.match_probe({'id': 'clk', 'name': 'CLK'}, probes), 'SCLK')
+        self.assertEqual(captures.match_probe('miso', probes), 'MISO')
+        self.assertIsNone(captures.match_probe('sda', probes))
+        # More than one probe with the id in its name is no match.
+        self.assertIsNone(captures.match_probe('s', probes))
+
+    def test_map_channels_names(self):
+        probes = {'D0': 0, 'D1': 1}
+        self.assertEqual(captures.map_channels(['scl', 'sda'], probes,
+                                               {'scl': 'D1', 'sda': 'D0'}), [1, 0])
+        with self.assertRaises(KeyError):
+            captures.map_channels(['scl'], probes, {'scl': 'D7'})
+
+    def test_open_capture(self):
+        with self.assertRaises(ValueError):
+            captures.open_capture('capture.vcd')
+
+class SrCaptureTest(unittest.TestCase):
+    def test_tpm_startup(self):
+        path = os.path.join(root, 'ifx-tpm_PULSEVIEW', 'sample TPM', 'TPM_STARTUP.sr')
+        with captures.open_capture(path) as capture:
+            self.assertIsInstance(capture, captures.SrCapture)
+            self.assertEqual(capture.samplerate, 10**9)
+            self.assertEqual(capture.probes, {'SCLK': 0, 'MISO': 1, 'MOSI': 2, 'CS': 3})
+            self.assertEqual(capture.channel_map(tpm_channels), [0, 1, 2, 3])
+            self.assertEqual(capture.num_samples(), 4746522)
+            (clk, miso, mosi, cs), _ = read_all(capture, tpm_channels)
+            self.assertEqual(len(clk), 4746522)
+            # CS# deasserted on the first sample, asserted later on.
+            self.assertEqual((cs[0], cs.min()), (1, 0))
+
+    def write(self, members, unitsize=2):
+        # Session file with probes D0 and D9 (probe10: in the second byte).
+        path = os.path.join(self.tmp.name, 'test.sr')
+        with zipfile.ZipFile(path, 'w') as z:
+            z.writestr('metadata', '[device 1]\ncapturefile=logic-1\n'
+                       'samplerate=2 MHz\nprobe1=D0\nprobe10=D9\n'
+                       'unitsize=%d\n' % unitsize)
+            for i, data in enumerate(members):
+                z.writestr('logic-1-%d' % (i + 1), data)
+        return path
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def test_members(self):
+        # Samples 0x0201, 0x0001, 0x0200 split over two members in the
+        # middle of a sample.
+        words = np.array([0x0201, 0x0001, 0x0200], dtype='<u2').tobytes()
+        with captures.SrCapture(self.write([words[:3], words[3:]])) as capture:
+            self.assertEqual(capture.samplerate, 2 * 10**6)
+            self.assertEqual(capture.members, ['logic-1-1', 'logic-1-2'])
+            self.assertEqual(capture.num_samples(), 3)
+            (d0, d9, none), count = read_all(capture, ['d0', 'd9', 'd5'])
+            self.assertEqual(count, 2)
+            self.assertEqual(list(d0), [1, 1, 0])
+            self.assertEqual(list(d9), [1, 0, 1])
+            self.assertIsNone(none)
+
+class DslCaptureTest(unittest.TestCase):
+    def test_tpm_startup_clear(self):
+        path = os.path.join(root, 'ifx-tpm_DSVIEW', 'sample TPM', 'TPM_STARTUP_CLEAR.dsl')
+        with captures.open_capture(path) as capture:
+            self.assertIsInstance(capture, captures.DslCapture)
+            self.assertEqual(capture.samplerate, 400 * 10**6)
+            self.assertEqual(capture.probes, {'SCLK': 0, 'MISO': 1, 'MOSI': 2, 'CS': 3})
+            self.assertEqual(capture.channel_map(tpm_channels), [0, 1, 2, 3])
+            self.assertEqual(capture.num_samples(), 67108864)
+            # Four blocks, the channels of a block are of the same length.
+            lengths = [set(len(data) for data in chunk)
+                       for chunk in capture.chunks(tpm_channels)]
+            self.assertEqual(len(lengths), 4)
+            self.assertTrue(all(len(n) == 1 for n in lengths))
+            self.assertEqual(sum(n.pop() for n in lengths), 67108864)
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def test_blocks(self):
+        # Probes 0 and 2, 20 samples in blocks of 16: the last block has
+        # 4 samples left.
+        d0 = np.arange(20) % 2
+        d2 = (np.arange(20) // 3) % 2
+        path = os.path.join(self.tmp.name, 'test.dsl')
+        with zipfile.ZipFile(path, 'w') as z:
+            z.writestr('header', '[version]\nversion = 2\n[header]\n'
+                       'total samples = 20\ntotal blocks = 2\n'
+                       'samplerate = 1 MHz\nprobe0 = D0\nprobe2 = Data\n')
+            for probe, data in ((0, d0), (2, d2)):
+                for block in range(2):
+                    bits = np.zeros(16, dtype=np.uint8)
+                    part = data[block * 16:(block + 1) * 16]
+                    bits[:len(part)] = part
+                    z.writestr('L-%d/%d' % (probe, block),
+                               np.packbits(bits, bitorder='little').tobytes())
+        with captures.DslCapture(path) as capture:
+            self.assertEqual(capture.samplerate, 10**6)
+            self.assertEqual((capture.block_samples, capture.block_len(1)), (16, 4))
+            # 'x' matches no probe name and takes probe 2 by its position.
+            self.assertEqual(capture.channel_map(['d0', 'y', 'x']), [0, None, 2])
+            (a, none, b), count = read_all(capture, ['d0', 'y', 'x'], workers=2)
+            self.assertEqual(count, 2)
+            self.assertEqual(list(a), list(d0))
+            self.assertEqual(list(b), list(d2))
+            self.assertIsNone(none)
+
+if __name__ == '__main__':
+    unittest.main()
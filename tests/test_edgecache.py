@@ -0,0 +1,145 @@
+##
+## This file is part of the libsigrokdecode project.
+##
+## This program is free software; you can redistribute it and/or modify
+## it under the terms of the GNU General Public License as published by
+## the Free Software Foundation; either version 2 of the License, or
+## (at your option) any later version.
+##
+## This program is distributed in the hope that it will be useful,
+## but WITHOUT ANY WARRANTY; without even the implied warranty of
+## MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+## GNU General Public License for more details.
+##
+## You should have received a copy of the GNU General Public License
+## along with this program; if not, see <http://www.gnu.org/licenses/>.
+##
+
+# Edge cache (srdhost.edgecache): entries, keys, eviction and decoding
+# from a cached entry.
+
+import os
+import shutil
+import tempfile
+import unittest
+from unittest import mock
+
+import numpy as np
+
+from srdhost import host
+from srdhost.captures import open_capture
+from srdhost.edgecache import EdgeCache, entry_size
+from srdhost.edges import EdgeList
+
+root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+tpm = ('ifx-tpm_PULSEVIEW/ifx-tpm', 'ifx-tpm_PULSEVIEW/sample TPM/TPM_STARTUP.sr')
+trustm = ('ifx_trustm_DSVIEW/ifx_trustm', 'ifx_trustm_DSVIEW/sample TrustM_X/trustm_chipinfo.dsl')
+
+def path(name):
+    return os.path.join(root, name)
+
+def channels(sample):
+    return host.Session(host.load_decoder(path(sample[0]))).channels
+
+def extract(sample, names=None):
+    # Edge list straight from the capture, no cache.
+    with open_capture(path(sample[1])) as capture:
+        chans = channels(sample)
+        return EdgeList.from_chunks(capture.chunks(chans, names), len(chans))
+
+class EdgeCacheTest(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.cache = EdgeCache(os.path.join(self.tmp, 'edges'))
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp)
+
+    def entries(self):
+        return sorted(os.listdir(self.cache.directory))
+
+    def load(self, sample, names=None):
+        return self.cache.load(path(sample[1]), channels(sample), names)
+
+    def assertSameEdges(self, a, b):
+        self.assertEqual((a.present, a.initial, a.last, a.length),
+                         (b.present, b.initial, b.last, b.length))
+        np.testing.assert_array_equal(a.samples, b.samples)
+        np.testing.assert_array_equal(a.states, b.states)
+
+    def test_miss(self):
+        edges = self.load(tpm)
+        self.assertEqual(len(self.entries()), 1)
+        self.assertSameEdges(edges, extract(tpm))
+
+    def test_hit(self):
+        self.load(tpm)
+        # A hit does not extract the edges again, it maps the entry.
+        with mock.patch.object(EdgeList, 'from_chunks', side_effect=AssertionError):
+            edges = self.load(tpm)
+        self.assertIsInstance(edges.samples, np.memmap)
+        self.assertIsInstance(edges.states, np.memmap)
+        self.assertSameEdges(edges, extract(tpm))
+        self.assertEqual(len(self.entries()), 1)
+
+    def test_key_channel_map(self):
+        # SCL and SDA swapped is another entry, with other edges.
+        swapped = {'scl': 'SDL', 'sda': 'SCL'}
+        plain, other = self.load(trustm), self.load(trustm, swapped)
+        self.assertEqual(len(self.entries()), 2)
+        self.assertFalse(np.array_equal(plain.states, other.states))
+        self.assertSameEdges(other, extract(trustm, swapped))
+
+    def test_key_content(self):
+        # Keyed by content: a copy hits, a changed copy does not.
+        copy = os.path.join(self.tmp, 'copy.sr')
+        shutil.copyfile(path(tpm[1]), copy)
+        with open_capture(copy) as capture:
+            probes = capture.channel_map(channels(tpm))
+        key = self.cache.key(path(tpm[1]), probes)
+        self.assertEqual(self.cache.key(copy, probes), key)
+        with open(copy, 'ab') as f:
+            f.write(b'\0')
+        self.assertNotEqual(self.cache.key(copy, probes), key)
+
+    def test_stale_format(self):
+        self.load(tpm)
+        with mock.patch('srdhost.edgecache.FORMAT', 0):
+            self.load(tpm)
+        self.assertEqual(len(self.entries()), 2)
+
+    def test_eviction(self):
+        self.load(tpm)
+        [first] = self.entries()
+        self.load(trustm)
+        [second] = [e for e in self.entries() if e != first]
+        entry = lambda name: os.path.join(self.cache.directory, name)
+        # The first entry is older, then used again, which makes the
+        # second one the least recently used.
+        os.utime(entry(first), (1, 1))
+        os.utime(entry(second), (2, 2))
+        self.load(tpm)
+        # Room for either entry, not for both.
+        self.cache.max_bytes = max(entry_size(entry(first)), entry_size(entry(second)))
+        self.cache.evict()
+        self.assertEqual(self.entries(), [first])
+
+    def test_evict_on_write(self):
+        # Over the limit right away: the new entry is written, and the
+        # older one evicted.
+        self.cache.max_bytes = 1
+        self.load(tpm)
+        self.load(trustm)
+        self.assertLessEqual(len(self.entries()), 1)
+
+    def test_decode(self):
+        for sample in (tpm, trustm):
+            reference = host.decode_file(path(sample[0]), path(sample[1]))
+            for _ in range(2):
+                # A miss, then a hit.
+                cached = host.decode_file(path(sample[0]), path(sample[1]), cache=self.cache)
+                self.assertEqual(cached.annotations(), reference.annotations())
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,205 @@
+##
+## This file is part of the libsigrokdecode project.
+##
+## This program is free software; you can redistribute it and/or modify
+## it under the terms of the GNU General Public License as published by
+## the Free Software Foundation; either version 2 of the License, or
+## (at your option) any later version.
+##
+## This program is distributed in the hope that it will be useful,
+## but WITHOUT ANY WARRANTY; without even the implied warranty of
+## MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+## GNU General Public License for more details.
+##
+## You should have received a copy of the GNU General Public License
+## along with this program; if not, see <http://www.gnu.org/licenses/>.
+##
+
+# Edge lists and the wait() cursor (srdhost.edges), checked step by step
+# against a plain per-sample implementation of the wait() conditions.
+
+import unittest
+
+import numpy as np
+
+from srdhost.edges import EdgeList, EdgeCursor, chunk_edges
+
+class SampleWait:
+    # wait() the slow way: every sample after the current one is checked.
+    def __init__(self, channels):
+        self.channels = channels
+        self.length = len(next(c for c in channels if c is not None))
+        self.samplenum = -1
+
+    def level(self, ch, i):
+        return int(self.channels[ch][i])
+
+    def match(self, cond, i):
+        cur = self.samplenum
+        for key, term in cond.items():
+            if key == 'skip':
+                if i != max(cur + term, cur + 1):
+                    return False
+                continue
+            now = self.level(key, i)
+            # Nothing changes on the first sample.
+            before = self.level(key, i - 1) if i else now
+            if term == 'h' and now != 1 or term == 'l' and now != 0:
+                return False
+            if term == 'r' and not (before == 0 and now == 1):
+                return False
+            if term == 'f' and not (before == 1 and now == 0):
+                return False
+            if term == 'e' and before == now:
+                return False
+        return True
+
+    def wait(self, conds=None):
+        if conds is None:
+            conds = {}
+        if isinstance(conds, dict):
+            conds = [conds]
+        for i in range(self.samplenum + 1, self.length):
+            matched = [self.match(c, i) for c in conds]
+            if any(matched):
+                self.samplenum = i
+                pins = tuple(0xff if c is None else int(c[i]) for c in self.channels)
+                return pins, matched
+        self.samplenum = self.length
+        raise EOFError()
+
+def waveform(rng, length, runs):
+    # 0/1 samples which keep their level for runs of about runs samples.
+    levels = []
+    level = int(rng.integers(2))
+    while len(levels) < length:
+        levels.extend([level] * int(rng.integers(1, 2 * runs)))
+        level ^= 1
+    return np.array(levels[:length], dtype=np.uint8)
+
+def split(channels, cuts):
+    # The channels cut into chunks at the given sample numbers.
+    bounds = [0] + sorted(cuts) + [len(next(c for c in channels if c is not None))]
+    return [tuple(None if c is None else c[lo:hi] for c in channels)
+            for lo, hi in zip(bounds, bounds[1:])]
+
+# Condition lists as the decoders use them, and a few more.
+condition_sets = [
+    [{0: 'r'}],
+    [{0: 'r'}, {3: 'e'}],
+    [{0: 'r', 3: 'e'}, {3: 'e'}],
+    [{0: 'f'}, {1: 'h', 3: 'l'}],
+    [{1: 'l'}],
+    [{3: 'h'}, {0: 'e'}],
+    [{}],
+    None,
+    [{'skip': 7}],
+    [{0: 'r'}, {'skip': 3}],
+    [{1: 'r', 0: 'h'}, {1: 'f', 0: 'h'}, {0: 'r'}],
+]
+
+class Decoder:
+    pass
+
+class EdgeCursorTest(unittest.TestCase):
+    bitmask = False
+
+    def expected_matched(self, matched):
+        if self.bitmask:
+            return sum(1 << i for i, m in enumerate(matched) if m)
+        return matched
+
+    def run_random(self, seed):
+        rng = np.random.default_rng(seed)
+        length = 3000
+        # Channel 2 has no samples, channel 1 toggles a lot.
+        channels = [waveform(rng, length, 20), waveform(rng, length, 3), None,
+                    waveform(rng, length, 60)]
+        cuts = list(rng.integers(1, length, 5))
+        # A chunk boundary right on an edge of channel 0.
+        cuts.append(int(np.flatnonzero(np.diff(channels[0]))[0]) + 1)
+        edges = EdgeList.from_chunks(split(channels, cuts), 4)
+        decoder = Decoder()
+        cursor = EdgeCursor(edges, self.bitmask)
+        cursor.attach(decoder)
+        reference = SampleWait(channels)
+        steps = 0
+        while True:
+            conds = condition_sets[int(rng.integers(len(condition_sets)))]
+            try:
+                expected = reference.wait(conds)
+            except EOFError:
+                with self.assertRaises(EOFError):
+                    decoder.wait(conds)
+                break
+            pins = decoder.wait(conds)
+            self.assertEqual((decoder.samplenum, pins, decoder.matched),
+                             (reference.samplenum, expected[0],
+                              self.expected_matched(expected[1])),
+                             'step %d, conditions %r' % (steps, conds))
+            steps += 1
+        self.assertGreater(steps, 100)
+
+    def test_random(self):
+        for seed in range(10):
+            self.run_random(seed)
+
+    def cursor(self, channels):
+        return EdgeCursor(EdgeList.from_chunks([channels], len(channels)), self.bitmask)
+
+    def test_matched_and_pins(self):
+        clk = np.array([0, 0, 1, 1, 0, 1, 1], dtype=np.uint8)
+        cs = np.array([1, 1, 0, 0, 0, 1, 1], dtype=np.uint8)
+        cursor = self.cursor((clk, None, cs))
+        # CLK rising and CS# edge on the same sample: both matched.
+        pins = cursor.wait([{0: 'r'}, {2: 'e'}])
+        self.assertEqual((cursor.samplenum, pins), (2, (1, 0xff, 0)))
+        self.assertEqual(cursor.matched, self.expected_matched([True, True]))
+        # Only the second condition.
+        cursor.wait([{0: 'r'}, {0: 'f'}])
+        self.assertEqual(cursor.samplenum, 4)
+        self.assertEqual(cursor.matched, self.expected_matched([False, True]))
+        # A level condition which holds right away: the next sample.
+        pins = cursor.wait({2: 'h'})
+        self.assertEqual((cursor.samplenum, pins), (5, (1, 0xff, 1)))
+        # No conditions: the next sample, then the end of the samples.
+        cursor.wait()
+        self.assertEqual(cursor.samplenum, 6)
+        with self.assertRaises(EOFError):
+            cursor.wait({0: 'e'})
+        self.assertEqual(cursor.samplenum, 7)
+
+    def test_skip(self):
+        clk = np.zeros(10, dtype=np.uint8)
+        cursor = self.cursor((clk,))
+        cursor.wait()
+        cursor.wait([{0: 'r'}, {'skip': 4}])
+        self.assertEqual(cursor.samplenum, 4)
+        self.assertEqual(cursor.matched, self.expected_matched([False, True]))
+
+class EdgeCursorBitmaskTest(EdgeCursorTest):
+    bitmask = True
+
+class EdgeListTest(unittest.TestCase):
+    def test_chunks(self):
+        rng = np.random.default_rng(1)
+        a, b = waveform(rng, 1000, 10), waveform(rng, 1000, 25)
+        whole = EdgeList.from_chunks([(a, b)], 2)
+        # Chunks cut anywhere, also right on edges, give the same edges.
+        cuts = [1, 2, 500, 999] + list(np.flatnonzero(np.diff(a))[:3] + 1)
+        chunked = EdgeList.from_chunks(split((a, b), cuts), 2)
+        expected = np.flatnonzero((a[1:] != a[:-1]) | (b[1:] != b[:-1])) + 1
+        for edges in (whole, chunked):
+            self.assertEqual(list(edges.samples), list(expected))
+            self.assertEqual(edges.length, 1000)
+            self.assertEqual(edges.present, [True, True])
+            for i in (0, 1, 499, 500, 999):
+                self.assertEqual(edges.state_at(i), int(a[i]) | int(b[i]) << 1)
+
+    def test_chunk_edges_empty(self):
+        self.assertIsNone(chunk_edges((None, None), np.uint8))
+        empty = np.empty(0, dtype=np.uint8)
+        self.assertIsNone(chunk_edges((empty,), np.uint8))
+
+if __name__ == '__main__':
+    unittest.main()
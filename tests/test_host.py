@@ -0,0 +1,142 @@
+##
+## This file is part of the libsigrokdecode project.
+##
+## This program is free software; you can redistribute it and/or modify
+## it under the terms of the GNU General Public License as published by
+## the Free Software Foundation; either version 2 of the License, or
+## (at your option) any later version.
+##
+## This program is distributed in the hope that it will be useful,
+## but WITHOUT ANY WARRANTY; without even the implied warranty of
+## MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+## GNU General Public License for more details.
+##
+## You should have received a copy of the GNU General Public License
+## along with this program; if not, see <http://www.gnu.org/licenses/>.
+##
+
+# The sigrokdecode stand-in and host (srdhost.host, srdhost.pipeline and
+# the command line), running the decoders on the shipped samples.
+
+import contextlib
+import io
+import os
+import unittest
+
+import numpy as np
+
+from srdhost import host, sigrokdecode as srd
+from srdhost.__main__ import main
+from srdhost.pipeline import Pipeline, StageError
+
+root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+def path(*parts):
+    return os.path.join(root, *parts)
+
+# Decoder directory and a small sample of each decoder.
+samples = {
+    'tpm-pulseview': ('ifx-tpm_PULSEVIEW/ifx-tpm', 'ifx-tpm_PULSEVIEW/sample TPM/TPM_STARTUP.sr'),
+    'tpm-dsview': ('ifx-tpm_DSVIEW/ifx-tpm', 'ifx-tpm_DSVIEW/sample TPM/TPM_STARTUP_CLEAR.dsl'),
+    'trustm-pulseview': ('ifx_trustm_PULSEVIEW/ifx_trustm',
+                         'ifx_trustm_PULSEVIEW/sample TrustM_X/trustm_chipinfo.sr'),
+    'trustm-dsview': ('ifx_trustm_DSVIEW/ifx_trustm',
+                      'ifx_trustm_DSVIEW/sample TrustM_X/trustm_chipinfo.dsl'),
+}
+
+def comparable(session):
+    # Annotations, binary and meta output. The Python output holds parsed
+    # objects, which only compare by identity.
+    result = []
+    for o in session.outputs:
+        if o.output_type == srd.OUTPUT_BINARY:
+            result.append((o.ss, o.es, o.output_id, o.data[0], bytes(o.data[1])))
+        elif o.output_type != srd.OUTPUT_PYTHON:
+            result.append((o.ss, o.es, o.output_id, o.data))
+    return result
+
+class LoadTest(unittest.TestCase):
+    def test_side_by_side(self):
+        pv = host.load_decoder(path(samples['tpm-pulseview'][0]))
+        ds = host.load_decoder(path(samples['tpm-dsview'][0]))
+        self.assertIsNot(pv, ds)
+        self.assertTrue(issubclass(pv, srd.Decoder))
+        self.assertIs(host.load_decoder(path(samples['tpm-pulseview'][0])), pv)
+        self.assertFalse(host.matched_bitmask(pv))
+        self.assertTrue(host.matched_bitmask(ds))
+
+    def test_no_decoder(self):
+        with self.assertRaises(ImportError):
+            host.load_decoder(path('tests'))
+
+    def test_options(self):
+        decoder = host.load_decoder(path(samples['trustm-pulseview'][0]))
+        values = host.option_values(decoder, {'address': '0x29', 'foreign': 'skip'})
+        self.assertEqual((values['address'], values['foreign']), (0x29, 'skip'))
+        self.assertEqual(values['layer_max'], 'apdu')
+        with self.assertRaises(KeyError):
+            host.option_values(decoder, {'speed': '1'})
+        with self.assertRaises(ValueError):
+            host.option_values(decoder, {'foreign': 'ignore'})
+
+class DecodeTest(unittest.TestCase):
+    def check(self, name):
+        directory, capture = samples[name]
+        sessions = [host.decode_file(path(directory), path(capture), method=method)
+                    for method in host.methods]
+        reference = comparable(sessions[0])
+        self.assertGreater(len(sessions[0].annotations()), 1000)
+        for method, session in zip(host.methods[1:], sessions[1:]):
+            self.assertEqual(comparable(session), reference, method)
+        self.assertEqual(set(sessions[2].pipeline.utilization()),
+                         {'read', 'edges', 'decode'})
+
+    def test_tpm_pulseview(self):
+        self.check('tpm-pulseview')
+
+    def test_tpm_dsview(self):
+        self.check('tpm-dsview')
+
+    def test_trustm_pulseview(self):
+        self.check('trustm-pulseview')
+
+    def test_trustm_dsview(self):
+        self.check('trustm-dsview')
+
+class CommandLineTest(unittest.TestCase):
+    def test_readme_example(self):
+        # The same lines as the sigrok-cli output in the README.
+        with open(path('README.md')) as f:
+            readme = f.read()
+        expected = readme.split('cat test.txt\n')[1].split('```')[0].split()
+        out = io.StringIO()
+        with contextlib.redirect_stdout(out):
+            main([path(samples['trustm-pulseview'][0]), path(samples['trustm-pulseview'][1]),
+                  '-A', 'ifx_trustm=apdu-cmd:apdu-param:apdu-len:apdu-data-r:apdu-data-w:apdu-err'])
+        self.assertEqual(out.getvalue().split(), expected)
+        self.assertGreater(len(expected), 100)
+
+    def test_bad_arguments(self):
+        decoder, capture = samples['trustm-pulseview']
+        for args in (['-O', 'foreign=ignore'], ['-C', 'scl=D7'], ['-A', 'nope']):
+            with contextlib.redirect_stderr(io.StringIO()):
+                with self.assertRaises(SystemExit):
+                    main([path(decoder), path(capture)] + args)
+
+class BrokenCapture:
+    # One chunk, then the read fails.
+    def chunks(self, channels, names=None):
+        yield (np.zeros(100, dtype=np.uint8), np.ones(100, dtype=np.uint8))
+        raise ValueError('bad member')
+
+class PipelineTest(unittest.TestCase):
+    def test_stage_failure(self):
+        session = host.Session(host.load_decoder(path(samples['trustm-pulseview'][0])))
+        session.start(10**6, [True, True])
+        pipeline = Pipeline(BrokenCapture(), session.channels)
+        with self.assertRaises(StageError) as caught:
+            pipeline.run(session.decoder)
+        self.assertIsInstance(caught.exception.__cause__, ValueError)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,158 @@
+##
+## This file is part of the libsigrokdecode project.
+##
+## This program is free software; you can redistribute it and/or modify
+## it under the terms of the GNU General Public License as published by
+## the Free Software Foundation; either version 2 of the License, or
+## (at your option) any later version.
+##
+## This program is distributed in the hope that it will be useful,
+## but WITHOUT ANY WARRANTY; without even the implied warranty of
+## MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+## GNU General Public License for more details.
+##
+## You should have received a copy of the GNU General Public License
+## along with this program; if not, see <http://www.gnu.org/licenses/>.
+##
+
+# TPM 2.0 command/response parser (tpm2.py). Both decoder copies are
+# tested, the module does not need sigrok.
+
+import importlib.util
+import os
+import unittest
+
+root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+def load(variant):
+    path = os.path.join(root, 'ifx-tpm_%s' % variant, 'ifx-tpm', 'tpm2.py')
+    spec = importlib.util.spec_from_file_location('tpm2_%s' % variant.lower(), path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+def message(text):
+    return bytes.fromhex(text.replace(' ', ''))
+
+# TPM2_Startup(TPM_SU_CLEAR).
+startup = message('8001 0000000c 00000144 0000')
+
+# TPM2_PCR_Extend(PCR 0) with a password session and a SHA256 digest.
+pcr_extend = message('8002 00000041 00000182 00000000'
+                     '00000009 40000009 0000 00 0000'
+                     '00000001 000b' + '11' * 32)
+
+# Its response: no parameters, the password session's attributes.
+pcr_extend_response = message('8002 00000013 00000000 00000000 0000 01 0000')
+
+class Tpm2Test:
+    tpm2 = None
+
+    def fields(self, data, command=True, cc=None):
+        return [tuple(f) for f in self.tpm2.Message(data, command, cc).fields]
+
+    def test_parameters(self):
+        self.assertEqual(self.fields(startup),
+                         [(10, 2, 'param', 'startupType', 'TPM_SU_CLEAR')])
+
+    def test_command_handles_and_sessions(self):
+        self.assertEqual(self.fields(pcr_extend), [
+            (10, 4, 'handle', 'handle1', '0x00000000'),
+            (14, 4, 'session', 'authorizationSize', '9'),
+            (18, 4, 'session', 'sessionHandle', 'TPM_RS_PW'),
+            (22, 2, 'session', 'nonceCaller', '(0) (empty)'),
+            (24, 1, 'session', 'sessionAttributes', '0x00'),
+            (25, 2, 'session', 'hmac', '(0) (empty)'),
+            (27, 38, 'param', 'digests', 'SHA256:' + '11' * 32),
+        ])
+
+    def test_response_sessions(self):
+        # A response is parsed by the command code of its command.
+        self.assertEqual(self.fields(pcr_extend_response, False, 0x182), [
+            (10, 4, 'session', 'parameterSize', '0'),
+            (14, 2, 'session', 'nonceTPM', '(0) (empty)'),
+            (16, 1, 'session', 'sessionAttributes', '0x01'),
+            (17, 2, 'session', 'hmac', '(0) (empty)'),
+        ])
+
+    def test_error_response(self):
+        # Error responses are header only.
+        self.assertEqual(self.fields(message('8001 0000000a 00000922'), False, 0x144), [])
+
+    def test_truncated(self):
+        data = startup[:-1]
+        with self.assertRaises(self.tpm2.ParseError):
+            self.tpm2.Message(data, True).parse([])
+        # The decoder only uses fields, which ends with an error field over
+        # the bytes left instead of raising.
+        msg = self.tpm2.Message(data, True)
+        [error] = msg.fields
+        self.assertEqual((error.offset, error.size, error.name), (10, 1, 'error'))
+        self.assertIs(msg.fields, msg.fields)
+        # Later messages are not affected.
+        self.assertEqual(self.fields(startup)[0][3], 'startupType')
+
+    def test_session_area_past_end(self):
+        data = message('8002 00000016 00000182 00000000 00000020 40000009')
+        fields = self.fields(data)
+        self.assertEqual(fields[:2], [
+            (10, 4, 'handle', 'handle1', '0x00000000'),
+            (14, 4, 'session', 'authorizationSize', '32'),
+        ])
+        self.assertEqual(fields[2][2:4], ('param', 'error'))
+        self.assertEqual(len(fields), 3)
+
+    def rc(self, rc):
+        info = self.tpm2.decode_rc(rc)
+        return info.kind, info.name, info.number, info.index_type, info.index
+
+    def test_rc_success(self):
+        self.assertEqual(self.rc(0x000), ('success', 'TPM_RC_SUCCESS', 0, None, 0))
+
+    def test_rc_format_zero(self):
+        self.assertEqual(self.rc(0x101), ('error', 'TPM_RC_FAILURE', 0x01, None, 0))
+        self.assertEqual(self.rc(0x143), ('error', 'TPM_RC_COMMAND_CODE', 0x43, None, 0))
+        self.assertEqual(self.tpm2.decode_rc(0x101).text, 'TPM_RC_FAILURE')
+
+    def test_rc_warning(self):
+        self.assertEqual(self.rc(0x922), ('warning', 'TPM_RC_RETRY', 0x22, None, 0))
+        self.assertEqual(self.rc(0x908), ('warning', 'TPM_RC_YIELDED', 0x08, None, 0))
+        self.assertEqual(self.tpm2.decode_rc(0x922).text, 'TPM_RC_RETRY (warning)')
+
+    def test_rc_vendor(self):
+        self.assertEqual(self.rc(0x50A), ('vendor', 'VENDOR RC 0x0A', 0x0A, None, 0))
+
+    def test_rc_tpm12(self):
+        self.assertEqual(self.rc(0x02E), ('tpm12', 'TPM 1.2 RC 0x2E', 0x2E, None, 0))
+
+    def test_rc_format_one_parameter(self):
+        self.assertEqual(self.rc(0x2C4), ('format1', 'TPM_RC_VALUE', 0x04, 'parameter', 2))
+        info = self.tpm2.decode_rc(0x2C4)
+        self.assertEqual((info.text, info.short), ('TPM_RC_VALUE (parameter 2)', 'VALUE P2'))
+        # Parameter 15 uses all four index bits.
+        self.assertEqual(self.rc(0xFD5), ('format1', 'TPM_RC_SIZE', 0x15, 'parameter', 15))
+
+    def test_rc_format_one_handle(self):
+        self.assertEqual(self.rc(0x18B), ('format1', 'TPM_RC_HANDLE', 0x0B, 'handle', 1))
+        self.assertEqual(self.rc(0x08B), ('format1', 'TPM_RC_HANDLE', 0x0B, 'handle', 0))
+        self.assertEqual(self.tpm2.decode_rc(0x08B).text, 'TPM_RC_HANDLE (handle unspecified)')
+
+    def test_rc_format_one_session(self):
+        self.assertEqual(self.rc(0x9A2), ('format1', 'TPM_RC_BAD_AUTH', 0x22, 'session', 1))
+        self.assertEqual(self.rc(0xF8E), ('format1', 'TPM_RC_AUTH_FAIL', 0x0E, 'session', 7))
+        self.assertEqual(self.tpm2.decode_rc(0x9A2).short, 'BAD_AUTH S1')
+
+    def test_rc_layer(self):
+        # Response codes of the TSS layers keep their layer number.
+        info = self.tpm2.decode_rc(0x90903)
+        self.assertEqual((info.kind, info.name), ('warning', 'TPM_RC_SESSION_MEMORY'))
+        self.assertEqual(info.text, 'TPM_RC_SESSION_MEMORY (warning) (layer 0x09)')
+
+class PulseViewTpm2Test(Tpm2Test, unittest.TestCase):
+    tpm2 = load('PULSEVIEW')
+
+class DSViewTpm2Test(Tpm2Test, unittest.TestCase):
+    tpm2 = load('DSVIEW')
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,209 @@
+##
+## This file is part of the libsigrokdecode project.
+##
+## This program is free software; you can redistribute it and/or modify
+## it under the terms of the GNU General Public License as published by
+## the Free Software Foundation; either version 2 of the License, or
+## (at your option) any later version.
+##
+## This program is distributed in the hope that it will be useful,
+## but WITHOUT ANY WARRANTY; without even the implied warranty of
+## MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+## GNU General Public License for more details.
+##
+## You should have received a copy of the GNU General Public License
+## along with this program; if not, see <http://www.gnu.org/licenses/>.
+##
+
+# Trust M frame, packet and APDU layers (layers.py), fed with byte strings.
+# Both decoder copies are tested, the module does not need sigrok.
+
+import importlib.util
+import os
+import unittest
+
+root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+def load(variant):
+    path = os.path.join(root, 'ifx_trustm_%s' % variant, 'ifx_trustm', 'layers.py')
+    spec = importlib.util.spec_from_file_location('trustm_layers_%s' % variant.lower(), path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+def fcs(data):
+    # CRC-16/KERMIT, bit by bit rather than with the table of layers.py.
+    crc = 0
+    for b in data:
+        crc ^= b
+        for _ in range(8):
+            crc = (crc >> 1) ^ 0x8408 if crc & 1 else crc >> 1
+    return crc
+
+def frame(fctr, packet):
+    # FCTR, LEN, packet and FCS.
+    data = bytes([fctr]) + len(packet).to_bytes(2, 'big') + packet
+    return data + fcs(data).to_bytes(2, 'big')
+
+class LayersTest:
+    layers = None
+
+    def stack(self):
+        # Frame, packet and APDU layers which log their callbacks.
+        layers, self.log = self.layers, []
+        log = self.log.append
+        apdus = layers.ApduLayer(on_command=lambda cmd: log(('command', cmd)),
+                                 on_param=lambda param: log(('param', param)),
+                                 on_length=lambda inlen: log(('inlen', inlen)),
+                                 on_data=lambda b, write: log(('data', b, write)))
+        packets = layers.PacketLayer(on_sctr=lambda sctr: log(('sctr', sctr)),
+                                     apdus=apdus,
+                                     on_message=lambda write, data: log(('message', write, bytes(data))))
+        return layers.FrameLayer(on_checksum=lambda received, crc: log(('checksum', received, crc)),
+                                 packets=packets)
+
+    def events(self, kind):
+        return [e[1:] for e in self.log if e[0] == kind]
+
+    def test_unprotected_command_apdu(self):
+        # No SCTR: the APDU starts right after the PCTR, InLen is bytes 2-3.
+        apdu = bytes.fromhex('81000002e0c2')
+        frames = self.stack()
+        frames.feed_bytes(frame(0x00, bytes([0x00]) + apdu), True)
+        self.assertEqual(self.events('command'), [(0x81,)])
+        self.assertEqual(self.events('param'), [(0x00,)])
+        self.assertEqual(self.events('inlen'), [(2,)])
+        self.assertEqual(self.events('data'), [(0xE0, True), (0xC2, True)])
+        self.assertEqual(self.events('message'), [(True, apdu)])
+
+    def test_unprotected_sctr(self):
+        # PCTR with the SCTR presence bit, SCTR protocol 1 without
+        # protection: the APDU is parsed.
+        apdu = bytes.fromhex('81000006e0c200000400')
+        frames = self.stack()
+        frames.feed_bytes(frame(0x04, bytes([0x08, 0x20]) + apdu), True)
+        self.assertEqual(self.events('sctr'), [(0x20,)])
+        self.assertEqual(self.events('command'), [(0x81,)])
+        self.assertEqual(self.events('inlen'), [(6,)])
+        self.assertEqual(self.events('message'), [(True, apdu)])
+
+    def test_protected_sctr(self):
+        # Protected payloads are ciphertext, not passed on as APDUs.
+        payload = bytes.fromhex('81000006e0c200000400')
+        frames = self.stack()
+        frames.feed_bytes(frame(0x04, bytes([0x08, 0x23]) + payload), True)
+        self.assertEqual(self.events('sctr'), [(0x23,)])
+        self.assertEqual(self.events('command'), [])
+        self.assertEqual(self.events('data'), [])
+        self.assertEqual(self.events('message'), [])
+
+    def test_fcs_helper(self):
+        # CRC-16/KERMIT check value, and a frame from trustm_chipinfo.
+        self.assertEqual(fcs(b'123456789'), 0x2189)
+        self.assertEqual(frame(0x04, bytes.fromhex('082081000006e0c200000400')),
+                         bytes.fromhex('04000c082081000006e0c2000004009593'))
+
+    def test_fcs_good(self):
+        apdu = bytes.fromhex('81000006e0c200000400')
+        frames = self.stack()
+        frames.feed_bytes(frame(0x04, bytes([0x08, 0x20]) + apdu), True)
+        self.assertEqual(self.events('checksum'), [(0x9593, 0x9593)])
+        self.assertEqual(frames.errors, 0)
+        self.assertTrue(frames.complete())
+        self.assertEqual(self.events('message'), [(True, apdu)])
+
+    def test_fcs_mismatch(self):
+        # One payload byte changed, the FCS left as it was.
+        data = bytearray(frame(0x04, bytes.fromhex('082081000006e0c200000400')))
+        data[9] ^= 0x01
+        frames = self.stack()
+        frames.feed_bytes(data, True)
+        [(received, computed)] = self.events('checksum')
+        self.assertEqual(received, 0x9593)
+        self.assertNotEqual(computed, received)
+        self.assertEqual(frames.errors, 1)
+        # A frame with a wrong checksum does not make an APDU.
+        self.assertEqual(self.events('message'), [])
+
+    def test_chained_response(self):
+        # A response APDU in two chained packets (first, last), each one
+        # read from the DATA register in a frame of its own, frame numbers
+        # 0 and 1.
+        apdu = bytes.fromhex('00000006aabbccddeeff')
+        frames = self.stack()
+        frames.feed_bytes(frame(0x01, bytes([0x01]) + apdu[:6]), False)
+        self.assertEqual(self.events('message'), [])
+        frames.reset()
+        frames.feed_bytes(frame(0x05, bytes([0x04]) + apdu[6:]), False)
+        self.assertEqual(self.events('message'), [(False, apdu)])
+        self.assertEqual(self.layers.parse_apdu(apdu),
+                         (0x00, 0x00, 6, bytes.fromhex('aabbccddeeff')))
+
+    def test_chain_start_missed(self):
+        # The last packet of a chain alone does not make an APDU.
+        frames = self.stack()
+        frames.feed_bytes(frame(0x02, bytes.fromhex('04ccddeeff')), False)
+        self.assertEqual(frames.errors, 0)
+        self.assertEqual(self.events('message'), [])
+
+    def feed_frames(self, frames, corrupt=None):
+        # (FCTR, packet) pairs, written one frame per DATA register access;
+        # the frame at index corrupt gets a wrong FCS.
+        layer = self.stack()
+        for i, (fctr, packet) in enumerate(frames):
+            data = bytearray(frame(fctr, bytes.fromhex(packet)))
+            if i == corrupt:
+                data[-1] ^= 0xff
+            layer.feed_bytes(data, True)
+            layer.reset()
+        return layer
+
+    # FIRST AAAA, INTERMEDIATE BBBB, LAST CCCC with frame numbers 0, 1, 2.
+    chain = [(0x00, '01aaaa'), (0x04, '02bbbb'), (0x08, '04cccc')]
+
+    def test_chain(self):
+        self.feed_frames(self.chain)
+        self.assertEqual(self.events('message'),
+                         [(True, bytes.fromhex('aaaabbbbcccc'))])
+
+    def test_chain_corrupted_frame(self):
+        # A bad FCS in the middle of the chain: the first and last packets
+        # are not spliced together.
+        frames = self.feed_frames(self.chain, corrupt=1)
+        self.assertEqual(frames.errors, 1)
+        self.assertEqual(self.events('message'), [])
+
+    def test_chain_missing_frame(self):
+        # Frame number 1 was never seen, the chain goes on with 2.
+        self.feed_frames([self.chain[0], self.chain[2]])
+        self.assertEqual(self.events('message'), [])
+
+    def test_chain_retransmission(self):
+        # The intermediate frame is sent twice (same frame number), its
+        # packet is only added once.
+        self.feed_frames(self.chain[:2] + self.chain[1:])
+        self.assertEqual(self.events('message'),
+                         [(True, bytes.fromhex('aaaabbbbcccc'))])
+
+    def test_repeated_message(self):
+        # A whole unchained APDU sent twice is only output once, the next
+        # frame number makes a new one.
+        apdu = '0081000002e0c2'
+        self.feed_frames([(0x00, apdu), (0x00, apdu), (0x04, apdu)])
+        self.assertEqual(len(self.events('message')), 2)
+
+    def test_resync(self):
+        # After a RE-SYNC control frame numbering starts over at 0, which
+        # is not taken for a repeat of the frame 0 before.
+        apdu = '0081000002e0c2'
+        self.feed_frames([(0x00, apdu), (0xc0, ''), (0x00, apdu)])
+        self.assertEqual(len(self.events('message')), 2)
+
+class PulseViewLayersTest(LayersTest, unittest.TestCase):
+    layers = load('PULSEVIEW')
+
+class DSViewLayersTest(LayersTest, unittest.TestCase):
+    layers = load('DSVIEW')
+
+if __name__ == '__main__':
+    unittest.main()